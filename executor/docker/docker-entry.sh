@@ -21,4 +21,5 @@ echo "Web server started."
 # Perform config test, triggers also registration
 opensubmit-exec configtest
 
-cron && tail -f /var/log/cron.log
+# Fetch and run jobs until the container is stopped
+exec opensubmit-exec daemon
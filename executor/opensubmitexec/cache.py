@@ -0,0 +1,141 @@
+'''
+    Size-bounded on-disk caches of the executor.
+'''
+
+import os
+import shutil
+import hashlib
+import tempfile
+
+import logging
+logger = logging.getLogger('opensubmitexec')
+
+
+def file_hash(fname):
+    '''
+    Content hash of a file, as used for cache keys.
+    '''
+    sha = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class FileCache():
+    '''
+    A directory of files, addressed by some key (normally a content hash).
+
+    Entries are added atomically, so that parallel jobs can share the cache.
+    When the total size exceeds the limit, the least recently used
+    entries are removed.
+    '''
+    directory = None
+    max_size = None
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+    def keys(self):
+        return [entry for entry in os.listdir(self.directory)
+                if not entry.startswith('.') and not entry.startswith('tag-')]
+
+    def recent_keys(self, limit):
+        '''
+        The most recently used keys, newest first.
+        '''
+        entries = []
+        for key in self.keys():
+            try:
+                entries.append((os.stat(self._path(key)).st_mtime, key))
+            except FileNotFoundError:
+                # Removed by a parallel job
+                pass
+        return [key for mtime, key in sorted(entries, reverse=True)[:limit]]
+
+    def get(self, key, target):
+        '''
+        Copy the cache entry to the target file name.
+
+        Returns False if there is no such entry.
+        '''
+        path = self._path(key)
+        try:
+            shutil.copy(path, target)
+            # Remember usage for the LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        logger.debug("Using cached copy of {0} for {1}".format(key, target))
+        return True
+
+    def put(self, key, source):
+        '''
+        Store a copy of the source file under the given key.
+        '''
+        handle, tmpname = tempfile.mkstemp(dir=self.directory, prefix='.')
+        os.close(handle)
+        shutil.copy(source, tmpname)
+        os.replace(tmpname, self._path(key))
+        self.evict()
+
+    def get_tag(self, name):
+        '''
+        Get a small text value that was stored under some name, e.g.
+        the last known content hash for a download URL.
+        '''
+        try:
+            with open(self._path(self._tag_key(name))) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set_tag(self, name, value):
+        handle, tmpname = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(handle, 'w') as f:
+            f.write(value)
+        os.replace(tmpname, self._path(self._tag_key(name)))
+
+    def _tag_key(self, name):
+        return 'tag-' + hashlib.sha1(name.encode('utf-8')).hexdigest()
+
+    def evict(self):
+        '''
+        Remove least recently used entries until the size limit is met.
+        '''
+        entries = []
+        for key in self.keys():
+            try:
+                stat = os.stat(self._path(key))
+                entries.append((stat.st_mtime, stat.st_size, key))
+            except FileNotFoundError:
+                # Removed by a parallel job
+                pass
+        total = sum([size for mtime, size, key in entries])
+        for mtime, size, key in sorted(entries):
+            if total <= self.max_size:
+                break
+            logger.debug("Removing {0} from cache {1}".format(key, self.directory))
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def validator_cache(config):
+    return FileCache(os.path.join(config.get("Execution", "cache_dir"), 'validators'),
+                     config.getint("Execution", "cache_size") * 1024 * 1024)
+
+
+def compiler_cache(config):
+    return FileCache(os.path.join(config.get("Execution", "cache_dir"), 'compiler'),
+                     config.getint("Execution", "cache_size") * 1024 * 1024)
@@ -0,0 +1,164 @@
+'''
+    HTTP client for the communication with the OpenSubmit server.
+
+    Connections are kept open between requests (HTTP keep-alive),
+    so that a job does not need a new TCP / TLS handshake for every
+    download and result report. Each thread in each process has its own
+    set of connections, since http.client connections are not thread-safe
+    and sockets must not be shared with forked worker processes.
+'''
+
+import io
+import os
+import time
+import shutil
+import threading
+import http.client
+from urllib.parse import urlsplit, urlencode
+from urllib.error import HTTPError, URLError
+
+import logging
+logger = logging.getLogger('opensubmitexec')
+
+# Server responses that are worth another try, for GET requests
+RETRY_STATUS = (502, 503, 504)
+
+# Seconds after which an idle connection is not used for POST requests,
+# since the server may have closed it in the meantime
+POST_MAX_IDLE = 1
+
+# Block size for copying response bodies to files
+CHUNK_SIZE = 64 * 1024
+
+_local = threading.local()
+
+
+class Response():
+    '''
+    A completely received server response.
+
+    The body is None if it was written to a file.
+    '''
+    status = None
+    headers = None
+    body = None
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+def _connections():
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}
+    return _local.connections
+
+
+def _get_connection(scheme, netloc, timeout, max_idle=None):
+    connections = _connections()
+    conn = connections.get((scheme, netloc))
+    if conn is not None and max_idle is not None and time.time() - conn.last_used > max_idle:
+        _drop_connection(scheme, netloc)
+        conn = None
+    if conn is None:
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout=timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=timeout)
+        connections[(scheme, netloc)] = conn
+    conn.last_used = time.time()
+    conn.timeout = timeout
+    if conn.sock:
+        conn.sock.settimeout(timeout)
+    return conn
+
+
+def _drop_connection(scheme, netloc):
+    conn = _connections().pop((scheme, netloc), None)
+    if conn:
+        conn.close()
+
+
+def close_connections():
+    '''
+    Close all connections of the current thread.
+    '''
+    for conn in _connections().values():
+        conn.close()
+    _connections().clear()
+
+
+def request(config, url, data=None, headers={}, timeout=None, target=None):
+    '''
+    Perform a GET request, or a POST request if data is given.
+
+    POST data can be given as list of tuples or dictionary,
+    which is then form-encoded, or as bytes.
+
+    If a target file object is given, the body of a successful (200)
+    response is copied to it in chunks, instead of being kept in memory.
+
+    Connection problems and temporary server errors are retried
+    according to the configuration, with exponential backoff.
+    POST requests are not idempotent (e.g. job results), so they are only
+    retried when the connection failed before the request was sent.
+
+    Returns a Response object for all status codes below 400.
+    Raises HTTPError for other status codes, and URLError if the
+    server cannot be reached.
+    '''
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    headers = dict(headers)
+    method = 'GET'
+    if data is not None:
+        method = 'POST'
+        if not isinstance(data, bytes):
+            data = urlencode(data).encode("utf-8", errors="ignore")
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    if timeout is None:
+        timeout = config.getfloat("Server", "request_timeout")
+    retries = config.getint("Server", "request_retries")
+    delay = config.getfloat("Server", "request_retry_delay")
+
+    attempt = 0
+    while True:
+        sent = False
+        try:
+            if method == 'POST':
+                conn = _get_connection(parts.scheme, parts.netloc, timeout, POST_MAX_IDLE)
+            else:
+                conn = _get_connection(parts.scheme, parts.netloc, timeout)
+            conn.request(method, path, body=data, headers=headers)
+            sent = True
+            result = conn.getresponse()
+            conn.last_used = time.time()
+            if target is not None and result.status == 200:
+                # Start from scratch in case of a retry
+                target.seek(0)
+                target.truncate()
+                shutil.copyfileobj(result, target, CHUNK_SIZE)
+                body = None
+            else:
+                body = result.read()
+        except (http.client.HTTPException, OSError) as e:
+            # Also covers connections closed by the server while being idle
+            _drop_connection(parts.scheme, parts.netloc)
+            if attempt >= retries or (sent and method == 'POST'):
+                raise URLError(e)
+            logger.debug("Connection problem with {0}, trying again: {1}".format(parts.netloc, e))
+        else:
+            if result.status in RETRY_STATUS and attempt < retries and method == 'GET':
+                logger.debug("Server responded with {0}, trying again.".format(result.status))
+            elif result.status >= 400:
+                raise HTTPError(url, result.status, result.reason, result.headers, io.BytesIO(body))
+            else:
+                return Response(result.status, result.headers, body)
+        # A stale keep-alive connection is retried immediately
+        if attempt > 0:
+            time.sleep(delay * 2 ** (attempt - 1))
+        attempt += 1
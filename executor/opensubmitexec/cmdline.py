@@ -4,8 +4,10 @@ import sys
 
 from . import CONFIG_FILE_DEFAULT
 from .server import fetch_job, fake_fetch_job, send_hostinfo
+from .spool import ResultSpool
 from .running import kill_longrunning
 from .locking import ScriptLock, break_lock
+from .daemon import Daemon
 from .config import read_config, has_config, create_config, check_config
 
 
@@ -16,6 +18,8 @@ def download_and_run(config):
     Returns True when a job was downloaded and executed.
     Returns False when no job could be downloaded.
     '''
+    # Results of earlier calls that did not reach the server
+    ResultSpool(config).flush()
     job = fetch_job(config)
     if job:
         job._run_validate()
@@ -60,13 +64,14 @@ def console_script():
         installed by setuptools.
     '''
     if len(sys.argv) == 1:
-        print("opensubmit-exec [configcreate <server_url>|configtest|run|test <dir>|unlock|help] [-c config_file]")
+        print("opensubmit-exec [configcreate <server_url>|configtest|run|daemon|test <dir>|unlock|help] [-c config_file]")
         return 0
 
     if "help" in sys.argv[1]:
         print("configcreate <server_url>:  Create initial config file for the OpenSubmit executor.")
         print("configtest:                 Check config file for correct installation of the OpenSubmit executor.")
         print("run:                        Fetch and run code to be tested from the OpenSubmit web server. Suitable for crontab.")
+        print("daemon:                     Continuously fetch and run code to be tested from the OpenSubmit web server.")
         print("test <dir>:                 Run test script from a local folder for testing purposes.")
         print("unlock:                     Break the script lock, because of crashed script.")
         print("help:                       Print this help")
@@ -104,7 +109,8 @@ def console_script():
             return 1
 
         print("Sending host information update to server ...")
-        send_hostinfo(config)
+        if not send_hostinfo(config, only_changed=True):
+            print("Host information is unchanged, nothing to send.")
         return 0
 
     if "unlock" in sys.argv[1]:
@@ -112,6 +118,12 @@ def console_script():
         break_lock(config)
         return 0
 
+    if "daemon" in sys.argv[1]:
+        daemon = Daemon(config_fname)
+        daemon.install_signal_handlers()
+        daemon.run()
+        return 0
+
     if "run" in sys.argv[1]:
         config = read_config(config_fname)
         # Perform additional precautions for unattended mode in cron
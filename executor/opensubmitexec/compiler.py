@@ -2,7 +2,12 @@
 Functions dealing with the compilation of code.
 '''
 
+import os
+import shutil
+import hashlib
+
 from .exceptions import ValidatorBrokenException
+from .cache import file_hash
 
 import logging
 logger = logging.getLogger('opensubmitexec')
@@ -33,3 +38,36 @@ def compiler_cmdline(compiler=GCC, output=None, inputs=None):
         else:
             cmdline.append(element)
     return cmdline[0], cmdline[1:]
+
+
+def compile_cache_key(working_dir, cmdline, inputs, files, output=None):
+    '''
+    Determine the key for the result of a compiler call in the compile cache.
+
+    It covers the command line, the compiler binary, the content of the
+    input files and the content of the given student files, since any of
+    them may be included. The validator package and its unpacked files are
+    left out, so that validity and full test of the same submission share
+    the result. Only the output file is left out, too.
+
+    Returns None if some input file is missing.
+    '''
+    key = hashlib.sha1()
+    key.update(repr(cmdline).encode('utf-8'))
+    binary = shutil.which(cmdline[0])
+    if binary:
+        stat = os.stat(binary)
+        key.update(repr((binary, stat.st_size, stat.st_mtime)).encode('utf-8'))
+    for fname in inputs:
+        path = os.path.join(working_dir, fname)
+        if not os.path.isfile(path):
+            return None
+        key.update(fname.encode('utf-8'))
+        key.update(file_hash(path).encode('utf-8'))
+    for fname in sorted(files):
+        path = os.path.join(working_dir, fname)
+        if fname == output or fname in inputs or not os.path.isfile(path):
+            continue
+        key.update(fname.encode('utf-8'))
+        key.update(file_hash(path).encode('utf-8'))
+    return key.hexdigest()
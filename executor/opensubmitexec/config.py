@@ -19,11 +19,32 @@ DEFAULT_SETTINGS = {
     'Execution': {
         'cleanup': 'True',                       # Override for disabling file cleanup
         'message_size': '10000',                 # Override for result text limit
+        'output_size': '10000000',               # Bytes of captured output per student program
         'timeout': '3600',                       # Override for execution timeout
         # Command to compile something on this machine
         'compile_cmd': 'make',
         'directory': '/tmp/',                    # Base directory for temporary directories
+        'cache_dir': '/tmp/opensubmit-cache/',   # Base directory for on-disk caches
+        'cache_size': '200',                     # Size limit in MB for each on-disk cache
+        'compile_cache': 'True',                 # Reuse results of identical compiler calls
+        'hostinfo_ttl': '86400',                 # Seconds until the host information is collected again
+        'hostinfo_timeout': '10',                # Seconds per host information probe
+        'spool_dir': '/tmp/opensubmit-spool/',   # Results waiting for delivery to the server
+        'spool_retry_delay': '5',                # Seconds until the first delivery retry
+        'spool_retry_max': '300',                # Upper limit for the delivery retry interval
+        'limit_cpu': '0',                        # CPU seconds per student program, 0 for no limit
+        'limit_memory': '0',                     # MB of memory per student program, 0 for no limit
+        'limit_processes': '0',                  # Processes per student program, 0 for no limit
+        'limit_file_size': '0',                  # MB per written file, 0 for no limit
+        'cgroup': '',                            # Delegated cgroup v2 directory for the limits
+        'max_unpacked_size': '2000',             # MB of unpacked student archive content
+        'max_unpacked_files': '10000',           # Number of entries in student archives
+        'max_path_depth': '32',                  # Directory depth in student archives
         'pidfile': '/tmp/executor.lock',         # Lock file for script lock
+        'slots': '1',                            # Daemon mode: Number of parallel jobs
+        'poll_interval': '5',                    # Daemon mode: Seconds between polls when idle
+        'poll_interval_max': '60',               # Daemon mode: Upper limit for idle backoff
+        'long_poll': '20',                       # Daemon mode: Max. server-side wait for new jobs
         # Execution environment for validation scripts
         'script_runner': '/usr/bin/env python3'
     },
@@ -31,13 +52,18 @@ DEFAULT_SETTINGS = {
         'url': 'http://localhost:8000',          # OpenSubmit web server
         # Shared secret with OpenSubmit web server
         'secret': '49846zut93purfh977TTTiuhgalkjfnk89',
-        'uuid': uuid.getnode()
+        'uuid': uuid.getnode(),
+        'request_timeout': '30',                 # Socket timeout for server communication
+        'request_retries': '3',                  # Retries for failed server communication
+        'request_retry_delay': '1'               # Initial delay between retries, doubled each time
     },
     'Logging': {
         'format': '%%(asctime)-15s (%%(process)d): %%(message)s',
         'file': '/tmp/executor.log',
         'to_file': 'False',
-        'level': 'DEBUG'
+        'level': 'DEBUG',
+        'metrics_file': '',                      # JSON lines with the phase timings of each job
+        'metrics_prometheus': ''                 # Prometheus text file with job metrics
     }
 }
 
@@ -58,12 +84,71 @@ secret={secret}
 # UUID of this executor
 uuid={uuid}
 
+# Timeout in seconds for the communication with the OpenSubmit server
+request_timeout={request_timeout}
+
+# Failed requests to the server are repeated this number of times.
+# The delay in seconds between retries is doubled on every attempt.
+request_retries={request_retries}
+request_retry_delay={request_retry_delay}
+
 [Execution]
 
 # Place where downloaded archives are extracted, compiled and validated
 # The executor will create sub-directories per fetched job
 directory={directory}
 
+# Downloaded validators are kept in a cache below this directory,
+# so that they are only fetched again when they were modified.
+cache_dir={cache_dir}
+
+# Size limit in MB for the cache. The least recently used files are removed first.
+cache_size={cache_size}
+
+# Compiler calls of validators with identical input and student files
+# reuse the compiled output from a cache in the same directory.
+# Files of the validator package only count when given as compiler input.
+compile_cache={compile_cache}
+
+# The host information sent to the server is cached in the same directory.
+# It is collected again after this number of seconds, or when installed
+# software changes. Each probe, such as 'java -version', is stopped after
+# the given timeout.
+hostinfo_ttl={hostinfo_ttl}
+hostinfo_timeout={hostinfo_timeout}
+
+# Job results are stored in this directory until the server got them.
+# When the server is not reachable, the delivery is tried again after
+# spool_retry_delay seconds, doubled for each failed attempt up to
+# spool_retry_max seconds. The daemon and each 'run' call deliver
+# pending results, so they are not lost when the web server restarts.
+spool_dir={spool_dir}
+spool_retry_delay={spool_retry_delay}
+spool_retry_max={spool_retry_max}
+
+# Resource limits for each program started by the validators, 0 means no limit.
+# CPU time is given in seconds, memory and file size in MB.
+# Without the cgroup setting, exceeded memory or process limits only show up
+# as failing malloc() or fork() calls in the student program. The process
+# limit is then only best-effort, since parallel jobs share it.
+limit_cpu={limit_cpu}
+limit_memory={limit_memory}
+limit_processes={limit_processes}
+limit_file_size={limit_file_size}
+
+# Limits for unpacking student archives, 0 means no limit.
+# The size is given in MB. Larger archives are rejected with an according
+# message to the student. Keep the size well above the largest uploads,
+# since archives with datasets can have a few hundred MB already compressed.
+max_unpacked_size={max_unpacked_size}
+max_unpacked_files={max_unpacked_files}
+max_path_depth={max_path_depth}
+
+# Directory of a cgroup (v2) that is delegated to this account.
+# Each program gets its own child group there, so that memory and process
+# limits apply to the whole process tree. Empty for using only rlimits.
+cgroup={cgroup}
+
 # Delete all student files after the executor did its work.
 # Disable this to debug problems that are only reproducible by running the
 # downloaded student code manually.
@@ -77,18 +162,40 @@ script_runner={script_runner}
 # In this case, the following lock file is used.
 pidfile={pidfile}
 
-# Whatver runs under this account is not allowed to run longer than this time
+# Student programs are not allowed to run longer than this time
 # This is the ultimate safeguard for deadlocks and submission processes going mad
-# This also means that you should not use this account for interactive work
+# Only the process trees started by validators are killed, they are registered
+# in a directory next to the pidfile
 timeout={timeout}
 
 # Limit the size of result message to a number of bytes, because of database entry
 # size. <=0 means no limit, any positive value limits the message size
+# Longer messages are shortened in the middle.
 message_size={message_size}
 
+# Limit the output of student programs kept in memory for the validator
+# to a number of bytes. <=0 means no limit. Longer output is shortened in the
+# middle. Result messages are still limited by message_size.
+output_size={output_size}
+
 # Customize the compilation command to be executed
 compile_cmd={compile_cmd}
 
+# In daemon mode, this number of jobs is executed in parallel.
+# Validators can still demand to run alone on the machine.
+slots={slots}
+
+# In daemon mode, the server is asked for new work every poll_interval seconds.
+# When nothing is to do, the interval doubles up to poll_interval_max seconds.
+# After a finished job, the next job is fetched immediately.
+poll_interval={poll_interval}
+poll_interval_max={poll_interval_max}
+
+# In daemon mode, the server is asked to hold back the answer for up to
+# long_poll seconds until new work arrives, if the server supports it.
+# This delivers new jobs without delay. 0 disables long polling.
+long_poll={long_poll}
+
 [Logging]
 
 # Logging format, as described in the Python logging module documentation
@@ -103,6 +210,16 @@ to_file={to_file}
 
 # Log level, as described in the Python logging module documentation
 level={level}
+
+# Each finished job is appended as JSON line to this file, with the
+# durations of the processing phases (fetch, validator, prepare, validate, report)
+# and the outcome. Empty for no metrics.
+metrics_file={metrics_file}
+
+# Counters and histograms over all jobs are written to this file in the
+# Prometheus text format, e.g. for the textfile collector of the node exporter.
+# Empty for no Prometheus metrics.
+metrics_prometheus={metrics_prometheus}
 '''
 
 
@@ -0,0 +1,222 @@
+'''
+    Long-running operation of the executor.
+
+    Instead of being triggered by cron once per job, the daemon
+    keeps asking the OpenSubmit server for work and runs it directly.
+'''
+
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from .config import read_config
+from .server import fetch_jobs, long_poll_wait, send_hostinfo
+from .running import kill_longrunning
+from .spool import ResultSpool
+
+import logging
+logger = logging.getLogger('opensubmitexec')
+
+# Seconds between the checks for left-over student programs
+KILL_INTERVAL = 60
+
+
+def run_job(job):
+    '''
+    Executed in a worker process of the daemon.
+    '''
+    job._run_validate()
+    return True
+
+
+class Daemon():
+    '''
+    Polling loop for fetching jobs and running them in a process pool.
+
+    The pool has one worker process per configured job slot.
+    New jobs are fetched as long as a slot is free, with one
+    lease request for all free slots.
+
+    When no work is available, the polling interval grows
+    from 'poll_interval' up to 'poll_interval_max' seconds.
+    After a fetched job, the next poll happens immediately.
+
+    If the server supports long polling, it holds back the answer
+    until new work arrives or 'long_poll' seconds are over. In this case,
+    the next poll also happens immediately.
+
+    When a worker process dies (e.g. by a crash or the OOM killer),
+    the pool is replaced by a new one. Jobs that were lost with the
+    broken pool are submitted again, but only once. The student programs
+    of dead workers are killed then, and every KILL_INTERVAL seconds.
+
+    SIGHUP re-reads the configuration file, SIGTERM / SIGINT
+    stop the daemon after the currently running jobs are finished.
+    '''
+    config = None
+    config_fname = None
+    override_url = None
+    stopping = False
+    reload_requested = False
+    pool = None
+    slots = None
+    running = None
+
+    def __init__(self, config_fname, override_url=None):
+        self.config_fname = config_fname
+        self.override_url = override_url
+        self.config = read_config(config_fname, override_url=override_url)
+
+    def install_signal_handlers(self):
+        '''
+        Only possible from the main thread of the process.
+        '''
+        signal.signal(signal.SIGTERM, self._on_stop_signal)
+        signal.signal(signal.SIGINT, self._on_stop_signal)
+        signal.signal(signal.SIGHUP, self._on_reload_signal)
+
+    def _on_stop_signal(self, signum, frame):
+        logger.info("Got signal {0}, stopping after the current job.".format(signum))
+        self.stop()
+
+    def _on_reload_signal(self, signum, frame):
+        logger.info("Got signal {0}, reloading configuration.".format(signum))
+        self.reload_requested = True
+
+    def stop(self):
+        self.stopping = True
+
+    def reload(self):
+        self.reload_requested = False
+        self.config = read_config(self.config_fname, override_url=self.override_url)
+        send_hostinfo(self.config, only_changed=True)
+        slots = self.config.getint("Execution", "slots")
+        if slots != self.slots:
+            logger.info("Changing number of job slots from {0} to {1}.".format(self.slots, slots))
+            # Running jobs in the old pool are finished in the background
+            self.pool.shutdown(wait=False)
+            self._create_pool()
+
+    def _create_pool(self):
+        self.slots = self.config.getint("Execution", "slots")
+        self.pool = ProcessPoolExecutor(max_workers=self.slots)
+
+    def _pool_broken(self):
+        # There is no public API for this check
+        return getattr(self.pool, '_broken', False)
+
+    def _replace_broken_pool(self):
+        logger.error("Worker process of the job pool died, creating a new pool.")
+        # Returns when the dead workers are collected
+        self.pool.shutdown(wait=True)
+        self._create_pool()
+
+    def _submit(self, job):
+        try:
+            future = self.pool.submit(run_job, job)
+        except BrokenProcessPool:
+            self._replace_broken_pool()
+            future = self.pool.submit(run_job, job)
+        self.running[future] = job
+
+    def _wait(self, seconds):
+        '''
+        Sleep for the given time, but react quickly on signals.
+        '''
+        deadline = time.time() + seconds
+        while not self.stopping and not self.reload_requested:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return
+            time.sleep(min(remaining, 1))
+
+    def _collect_finished(self):
+        for future in [f for f in self.running if f.done()]:
+            job = self.running.pop(future)
+            if isinstance(future.exception(), BrokenProcessPool):
+                if self._pool_broken():
+                    self._replace_broken_pool()
+                # The programs of the dead worker are still running
+                kill_longrunning(self.config)
+                if getattr(job, '_resubmitted', False) or self.stopping:
+                    logger.error("Job {0} was lost with a broken job pool.".format(job.file_id))
+                    continue
+                # Maybe the job itself crashed the worker, so there is no second retry
+                logger.error("Job {0} was lost with a broken job pool, running it again.".format(job.file_id))
+                job._resubmitted = True
+                self._submit(job)
+            elif future.exception():
+                logger.error("Error while running job: " + str(future.exception()))
+
+    def _flush_results(self):
+        '''
+        Deliver results that could not be sent by the jobs themselves.
+        '''
+        try:
+            ResultSpool(self.config).flush()
+        except Exception as e:
+            logger.error("Error while delivering spooled results: " + str(e))
+
+    def run_once(self, wait=0):
+        '''
+        Lease jobs for all free slots and hand them over to the pool.
+
+        Returns True when a job was fetched.
+        '''
+        if self._pool_broken():
+            # Check before leasing, so that no job gets lost
+            self._replace_broken_pool()
+        jobs = fetch_jobs(self.config, self.slots - len(self.running), wait)
+        for job in jobs:
+            self._submit(job)
+        return len(jobs) > 0
+
+    def run(self):
+        '''
+        Poll for jobs until stop() is called,
+        then wait for the running jobs.
+        '''
+        logger.info("Executor daemon started, fetching jobs from " +
+                    self.config.get("Server", "url"))
+        kill_longrunning(self.config)
+        last_kill = time.time()
+        send_hostinfo(self.config, only_changed=True)
+        # Future of each running job
+        self.running = {}
+        self._create_pool()
+        interval = self.config.getfloat("Execution", "poll_interval")
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload()
+                interval = self.config.getfloat("Execution", "poll_interval")
+            self._collect_finished()
+            self._flush_results()
+            if time.time() - last_kill >= KILL_INTERVAL:
+                kill_longrunning(self.config)
+                last_kill = time.time()
+            if len(self.running) >= self.slots:
+                wait(self.running, timeout=1, return_when=FIRST_COMPLETED)
+                continue
+            wait_time = long_poll_wait(self.config)
+            started = time.time()
+            try:
+                did_fetch = self.run_once(wait_time)
+            except Exception as e:
+                logger.error("Error while fetching job: " + str(e))
+                did_fetch = False
+            if did_fetch:
+                interval = self.config.getfloat("Execution", "poll_interval")
+            elif long_poll_wait(self.config) > 0 and time.time() - started >= wait_time:
+                # The server already waited for new work (or just announced
+                # that it can), so ask again directly
+                interval = self.config.getfloat("Execution", "poll_interval")
+            else:
+                self._wait(interval)
+                interval = min(interval * 2,
+                               self.config.getfloat("Execution", "poll_interval_max"))
+        logger.info("Executor daemon stopping, waiting for {0} running job(s).".format(len(self.running)))
+        self.pool.shutdown(wait=True)
+        self._collect_finished()
+        self._flush_results()
+        logger.info("Executor daemon stopped.")
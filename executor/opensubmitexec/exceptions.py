@@ -50,6 +50,33 @@ class TerminationException(NestedException):
     pass
 
 
+class ResourceLimitException(RunningProgramException):
+    '''
+    The student program exceeded one of the configured
+    resource limits. The limit parameter names the resource.
+    '''
+    def __init__(self, instance, limit, output=None):
+        self.instance = instance
+        self.limit = limit
+        self.output = output
+
+
+class CpuLimitException(ResourceLimitException):
+    pass
+
+
+class MemoryLimitException(ResourceLimitException):
+    pass
+
+
+class ProcessLimitException(ResourceLimitException):
+    pass
+
+
+class FileSizeLimitException(ResourceLimitException):
+    pass
+
+
 class ValidatorBrokenException(JobException):
     '''
     Indication that the validator script is broken.
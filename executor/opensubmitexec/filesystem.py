@@ -4,6 +4,7 @@
 
 import zipfile
 import tarfile
+import zlib
 import os
 import tempfile
 import shutil
@@ -14,7 +15,203 @@ import logging
 logger = logging.getLogger('opensubmitexec')
 
 
-def unpack_if_needed(destination_path, fpath):
+# Chunk size for streaming archive entries to disk
+CHUNK_SIZE = 64 * 1024
+
+MB = 1024 * 1024
+
+# Errors of the archive modules for broken or unsupported archives
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, EOFError,
+                  NotImplementedError, RuntimeError)
+
+
+def archive_type(fpath):
+    '''
+    Detect the archive format from the magic bytes at the start of the file.
+
+    Returns 'zip', 'tar' (also for compressed files that might be
+    a TAR archive), or None.
+    '''
+    with open(fpath, 'rb') as f:
+        head = f.read(512)
+    if head.startswith((b'PK\x03\x04', b'PK\x05\x06')):
+        return 'zip'
+    if head.startswith((b'\x1f\x8b', b'BZh', b'\xfd7zXZ\x00')) or head[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+
+class ArchiveWriter():
+    '''
+    Writes archive entries below the destination path, while checking
+    the entry names and the configured limits for unpacked archives.
+
+    Violations raise a JobException with an explanation for the student.
+    Without config, only the entry names are checked.
+    '''
+    destination = None
+    max_size = 0
+    max_files = 0
+    max_depth = 0
+    size = 0
+    files = 0
+
+    def __init__(self, destination, config=None):
+        self.destination = os.path.realpath(destination)
+        if config:
+            self.max_size = config.getint("Execution", "max_unpacked_size") * MB
+            self.max_files = config.getint("Execution", "max_unpacked_files")
+            self.max_depth = config.getint("Execution", "max_path_depth")
+
+    def _fail(self, info_student, info_tutor):
+        logger.error(info_tutor)
+        raise JobException(info_student=info_student, info_tutor=info_tutor)
+
+    def _inside(self, path):
+        path = os.path.realpath(path)
+        return path == self.destination or path.startswith(self.destination + os.sep)
+
+    def _path(self, name):
+        parts = [part for part in name.split('/') if part not in ['', '.']]
+        if '..' in parts or not parts:
+            self._fail("Your archive contains the invalid file name '{0}'.".format(name),
+                       "Submission archive has invalid file name '{0}'.".format(name))
+        if self.max_depth and len(parts) > self.max_depth:
+            self._fail("Your archive contains more than {0} nested directories.".format(self.max_depth),
+                       "Submission archive exceeds the directory depth limit of {0}.".format(self.max_depth))
+        path = os.path.join(self.destination, *parts)
+        # Prevent writing through symbolic links from earlier entries
+        if not self._inside(os.path.dirname(path)):
+            self._fail("Your archive contains the invalid file name '{0}'.".format(name),
+                       "Submission archive has file '{0}' outside of the working directory.".format(name))
+        return path
+
+    def _target(self, name):
+        target = self._path(name)
+        self.files += 1
+        if self.max_files and self.files > self.max_files:
+            self._fail("Your archive contains more than {0} files.".format(self.max_files),
+                       "Submission archive exceeds the file count limit of {0}.".format(self.max_files))
+        if os.path.islink(target):
+            os.remove(target)
+        return target
+
+    def directory(self, name):
+        os.makedirs(self._target(name), exist_ok=True)
+
+    def file(self, name, source):
+        '''
+        Stream the content of the file-like source object into the new file.
+        Returns the path of the new file.
+        '''
+        target = self._target(name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            for chunk in iter(lambda: source.read(CHUNK_SIZE), b''):
+                self.size += len(chunk)
+                if self.max_size and self.size > self.max_size:
+                    self._fail("Your archive is larger than {0} MB when unpacked.".format(self.max_size // MB),
+                               "Submission archive exceeds the unpacked size limit of {0} MB.".format(self.max_size // MB))
+                f.write(chunk)
+        return target
+
+    def link(self, name, linkname, symbolic):
+        target = self._target(name)
+        if symbolic:
+            if self._inside(os.path.join(os.path.dirname(target), linkname)):
+                os.symlink(linkname, target)
+            else:
+                logger.warning("Ignoring symbolic link {0} to {1} outside of the working directory.".format(name, linkname))
+        else:
+            source = self._path(linkname)
+            if os.path.isfile(source) and not os.path.islink(source):
+                os.link(source, target)
+
+
+def _unpack_zip(writer, fpath):
+    '''
+    Unpacks the ZIP file, returns the names of directories and files.
+    '''
+    with zipfile.ZipFile(fpath, "r") as zip:
+        infolist = zip.infolist()
+        for entry in infolist:
+            if entry.filename.endswith('/'):
+                writer.directory(entry.filename)
+            else:
+                # Sizes in the ZIP header are not trusted, since the writer counts
+                with zip.open(entry) as source:
+                    writer.file(entry.filename, source)
+    directories = [entry.filename for entry in infolist if entry.filename.endswith('/')]
+    files = [entry.filename for entry in infolist if not entry.filename.endswith('/')]
+    return directories, files
+
+
+def _unpack_tar(writer, fpath):
+    '''
+    Unpacks the (compressed) TAR file in one pass,
+    returns the names of directories and files.
+    '''
+    directories = []
+    files = []
+    # Stream mode, so every member is read only once
+    with tarfile.open(fpath, 'r|*') as tar:
+        for member in tar:
+            if member.isdir():
+                writer.directory(member.name)
+                directories.append(member.name)
+            elif member.isfile():
+                target = writer.file(member.name, tar.extractfile(member))
+                # Keep executable flags and time stamps, e.g. for make
+                os.chmod(target, member.mode & 0o777)
+                os.utime(target, (member.mtime, member.mtime))
+                files.append(member.name)
+            elif member.issym() or member.islnk():
+                writer.link(member.name, member.linkname, member.issym())
+            else:
+                logger.warning("Ignoring special file {0} in archive.".format(member.name))
+    return directories, files
+
+
+def _remove_new_entries(destination_path, old_content):
+    '''
+    Remove everything in destination_path that is not in old_content.
+    '''
+    for name in os.listdir(destination_path):
+        if name not in old_content:
+            path = os.path.join(destination_path, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+
+def _unpack(unpack, writer, destination_path, fpath, old_content):
+    '''
+    Call the unpack function for the archive. Returns the names of
+    directories and files, or None if the file is no archive after all.
+
+    When unpacking fails, the partially unpacked content is removed.
+    Broken archives and I/O errors are turned into a JobException.
+    '''
+    try:
+        return unpack(writer, fpath)
+    except ARCHIVE_ERRORS as e:
+        _remove_new_entries(destination_path, old_content)
+        if not writer.files:
+            # E.g. a compressed file without TAR archive inside
+            logger.debug("No valid archive, handling it as single file: " + str(e))
+            return None
+        info_student = "Your archive '{0}' is broken and could not be unpacked.".format(os.path.basename(fpath))
+        info_tutor = "Error while unpacking archive {0}: {1}".format(fpath, e)
+    except OSError as e:
+        _remove_new_entries(destination_path, old_content)
+        info_student = "Internal error with the validator. Please contact your course responsible."
+        info_tutor = "Error while unpacking archive {0}: {1}".format(fpath, e)
+    logger.error(info_tutor)
+    raise JobException(info_student=info_student, info_tutor=info_tutor)
+
+
+def unpack_if_needed(destination_path, fpath, config=None):
     '''
     fpath is the fully qualified path to a single file that
     might be a ZIP / TGZ archive.
@@ -22,6 +219,11 @@ def unpack_if_needed(destination_path, fpath):
     The function moves the file, or the content if it is an
     archive, to the directory given by destination_path.
 
+    Archive entries with names leading outside of destination_path
+    are rejected. With a given executor configuration, the limits for
+    unpacked archives are enforced. Violations and broken archives
+    raise a JobException.
+
     The function returns two values. The first one is a 
     directory name if:
 
@@ -46,13 +248,15 @@ def unpack_if_needed(destination_path, fpath):
                  (destination_path, str(dircontent)))
 
     # Perform un-archiving, in case
-    if zipfile.is_zipfile(fpath):
+    kind = archive_type(fpath)
+    writer = ArchiveWriter(destination_path, config)
+    if kind == 'zip':
         logger.debug("Detected ZIP file at %s, unpacking it." % (fpath))
-        did_unpack = True
-        with zipfile.ZipFile(fpath, "r") as zip:
-            infolist = zip.infolist()
-            directories = [
-                entry.filename for entry in infolist if entry.filename.endswith('/')]
+        result = _unpack(_unpack_zip, writer, destination_path, fpath, dircontent)
+        if result is not None:
+            directories, files = result
+            did_unpack = True
+        if did_unpack:
             logger.debug("List of directory entries: " + str(directories))
 
             # Consider this case: ['subdir1/', 'subdir1/subdir2/']
@@ -71,8 +275,6 @@ def unpack_if_needed(destination_path, fpath):
                 logger.debug(
                     "Updated list of directory entries: " + str(directories))
 
-            files = [
-                entry.filename for entry in infolist if not entry.filename.endswith('/')]
             logger.debug("List of files: " + str(files))
             if len(directories) == 1:
                 d = directories[0]
@@ -80,16 +282,15 @@ def unpack_if_needed(destination_path, fpath):
                 if len(files) == len(in_this_dir):
                     logger.debug("ZIP archive contains only one subdirectory")
                     single_dir = d
-            zip.extractall(destination_path)
-    elif tarfile.is_tarfile(fpath):
+    elif kind == 'tar':
         logger.debug("Detected TAR file at %s, unpacking it." % (fpath))
-        did_unpack = True
-        with tarfile.open(fpath) as tar:
-            infolist = tar.getmembers()
+        result = _unpack(_unpack_tar, writer, destination_path, fpath, dircontent)
+        if result is not None:
+            directories, files = result
+            did_unpack = True
+        if did_unpack:
             # A TGZ file of one subdirectory with arbitrary files
             # has one infolist entry per directory and file
-            directories = [entry.name for entry in infolist if entry.isdir()]
-            files = [entry.name for entry in infolist if entry.isfile()]
             logger.debug(directories)
             logger.debug(files)
             if len(directories) == 1:
@@ -98,8 +299,7 @@ def unpack_if_needed(destination_path, fpath):
                 if len(files) == len(in_this_dir):
                     logger.debug("TGZ archive contains only one subdirectory")
                     single_dir = d
-            tar.extractall(destination_path)
-    else:
+    if not did_unpack:
         if not fpath.startswith(destination_path):
             logger.debug(
                 "File at %s is a single non-archive file, copying it to %s" % (fpath, destination_path))
@@ -164,7 +364,7 @@ def prepare_working_directory(job, submission_path, validator_path):
     validator_fname = os.path.basename(validator_path)
 
     # Un-archive student submission
-    single_dir, did_unpack = unpack_if_needed(job.working_dir, submission_path)
+    single_dir, did_unpack = unpack_if_needed(job.working_dir, submission_path, job._config)
     job.student_files = os.listdir(job.working_dir)
     if did_unpack:
         job.student_files.remove(submission_fname)
@@ -1,32 +1,83 @@
 '''
     Functions to retrieve host information.
+
+    Collecting the complete host information takes some time,
+    so the result is cached on disk. The cache is valid until
+    its time to live expires, or until the host fingerprint
+    (e.g. modification times of the system directories) changes.
 '''
 
 import platform
-from subprocess import getoutput
+import hashlib
+import json
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
+from os import environ, killpg, makedirs, replace, stat, path, getloadavg, cpu_count
+from ipaddress import ip_address
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from .cache import validator_cache
+
+import logging
+logger = logging.getLogger('opensubmitexec')
 
-# def from_cmd(cmd, stdhndl=" 2>&1", e_shell=True):
+# Directories that change when software is (un-)installed
+FINGERPRINT_PATHS = ['/usr/bin', '/usr/lib', '/usr/include',
+                     '/usr/local/bin', '/usr/local/lib', '/etc/alternatives']
 
+# Upper limit for the number of cached validators reported to the server
+MAX_REPORTED_VALIDATORS = 50
 
-def from_cmd(cmd):
+
+def from_cmd(cmd, timeout=None):
     '''
     Determine some system information based on a shell command.
+
+    Commands running longer than the timeout are killed,
+    together with their child processes.
     '''
-    return getoutput(cmd)
+    proc = subprocess.Popen(cmd, shell=True, stdin=subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                            start_new_session=True)
+    try:
+        output, _ = proc.communicate(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        killpg(proc.pid, signal.SIGKILL)
+        proc.communicate()
+        logger.warning("Timeout while determining host information with '{0}'".format(cmd))
+        return ""
+    return output.decode('utf-8', errors='replace').rstrip('\n')
 
 
 def ipaddress():
     '''
-    Determine our own IP adress.
-    This seems to be far more complicated than you would think:
+    Determine our own IP adress from the local network interfaces.
+
+    Loopback and link-local addresses are ignored, IPv4 addresses are preferred.
     '''
     try:
-        import socket
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("gmail.com", 80))
-        result = s.getsockname()[0]
-        s.close()
-        return result
+        import psutil
+        stats = psutil.net_if_stats()
+        candidates = []
+        for name, addrs in sorted(psutil.net_if_addrs().items()):
+            if name in stats and not stats[name].isup:
+                continue
+            for addr in addrs:
+                if addr.family not in [socket.AF_INET, socket.AF_INET6]:
+                    continue
+                try:
+                    address = ip_address(addr.address.split('%')[0])
+                except ValueError:
+                    continue
+                if address.is_loopback or address.is_link_local:
+                    continue
+                candidates.append(address)
+        candidates.sort(key=lambda address: address.version)
+        return str(candidates[0]) if candidates else ""
     except Exception:
         return ""
 
@@ -70,30 +121,163 @@ def cpu():
         return platform.processor()
 
 
-def compiler():
+def compiler(timeout=None):
     if platform.system() == "Windows":
-        conf = from_cmd("cl.exe|@echo off", "")  # force returncode 0
+        conf = from_cmd("cl.exe|@echo off", timeout)  # force returncode 0
         conf = conf.split("\n")[0]  # extract version info
     else:
-        conf = from_cmd("cc -v")
+        conf = from_cmd("cc -v", timeout)
     return conf
 
 
-def all_host_infos():
+# Host information entries, either as shell command or as function
+PROBES = [
+    ["Operating system", os],
+    ["CPUID information", cpu],
+    ["CC information", compiler],
+    ["JDK information", "java -version"],
+    ["MPI information", "mpirun -version"],
+    ["Scala information", "scala -version"],
+    ["OpenCL headers", "find /usr/include|grep opencl.h"],
+    ["OpenCL libraries", "find /usr/lib/ -iname '*opencl*'"],
+    ["NVidia SMI", "nvidia-smi -q"],
+    ["OpenCL Details", opencl]
+]
+
+
+def collect_host_infos(timeout=None):
     '''
-        Summarize all host information.
+        Summarize all host information, running the probes in parallel.
+        Probes that take longer than the timeout (in seconds) are reported
+        with an empty result.
     '''
+    def run(probe):
+        if probe is compiler:
+            return compiler(timeout)
+        elif callable(probe):
+            return probe()
+        else:
+            return from_cmd(probe, timeout)
+
+    pool = ThreadPoolExecutor(max_workers=len(PROBES))
+    futures = [pool.submit(run, probe) for name, probe in PROBES]
+    # Python functions cannot be killed, so we do not wait for them
+    pool.shutdown(wait=False)
     output = []
-    output.append(["Operating system", os()])
-    output.append(["CPUID information", cpu()])
-    output.append(["CC information", compiler()])
-    output.append(["JDK information", from_cmd("java -version")])
-    output.append(["MPI information", from_cmd("mpirun -version")])
-    output.append(["Scala information", from_cmd("scala -version")])
-    output.append(["OpenCL headers", from_cmd(
-        "find /usr/include|grep opencl.h")])
-    output.append(["OpenCL libraries", from_cmd(
-        "find /usr/lib/ -iname '*opencl*'")])
-    output.append(["NVidia SMI", from_cmd("nvidia-smi -q")])
-    output.append(["OpenCL Details", opencl()])
+    deadline = time.time() + timeout if timeout else None
+    for (name, probe), future in zip(PROBES, futures):
+        try:
+            remaining = max(deadline - time.time(), 0) if deadline else None
+            output.append([name, future.result(remaining)])
+        except TimeoutError:
+            logger.warning("Timeout while determining '{0}'".format(name))
+            output.append([name, ""])
+        except Exception as e:
+            logger.warning("Error while determining '{0}': {1}".format(name, str(e)))
+            output.append([name, ""])
     return output
+
+
+def fingerprint():
+    '''
+        A cheap summary of the host state, which changes when the
+        system is rebooted, or software is installed or removed.
+    '''
+    data = [list(platform.uname()), environ.get('PATH', '')]
+    try:
+        import psutil
+        data.append(psutil.boot_time())
+    except Exception:
+        pass
+    for dirname in FINGERPRINT_PATHS:
+        try:
+            data.append([dirname, stat(dirname).st_mtime])
+        except OSError:
+            pass
+    return hashlib.sha1(json.dumps(data).encode('utf-8')).hexdigest()
+
+
+def _cache_fname(config):
+    return path.join(config.get("Execution", "cache_dir"), 'hostinfo.json')
+
+
+def _read_cache(config):
+    try:
+        with open(_cache_fname(config)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(config, data):
+    fname = _cache_fname(config)
+    makedirs(path.dirname(fname), exist_ok=True)
+    handle, tmpname = tempfile.mkstemp(dir=path.dirname(fname), prefix='.')
+    with open(handle, 'w') as f:
+        json.dump(data, f)
+    replace(tmpname, fname)
+
+
+def all_host_infos(config=None):
+    '''
+        Summarize all host information.
+
+        With a given executor configuration, the on-disk cache
+        is used and updated.
+    '''
+    if not config:
+        return collect_host_infos()
+
+    data = _read_cache(config)
+    current = fingerprint()
+    age = time.time() - data.get('created', 0)
+    if data.get('fingerprint') == current and age < config.getint("Execution", "hostinfo_ttl"):
+        logger.debug("Using cached host information from {0}".format(_cache_fname(config)))
+        return data['info']
+
+    logger.debug("Collecting host information")
+    data['info'] = collect_host_infos(config.getint("Execution", "hostinfo_timeout"))
+    data['fingerprint'] = current
+    data['created'] = time.time()
+    _write_cache(config, data)
+    return data['info']
+
+
+def last_sent(config, key):
+    '''
+        The checksum of the host information last sent
+        under the given key, e.g. the server URL.
+    '''
+    return _read_cache(config).get('sent', {}).get(key)
+
+
+def set_last_sent(config, key, checksum):
+    data = _read_cache(config)
+    data.setdefault('sent', {})[key] = checksum
+    _write_cache(config, data)
+
+
+def current_status(config, free_slots):
+    '''
+        The current capacity of this machine, which is sent
+        to the server with each job request: the number of free
+        job slots, the load average per CPU, the free disk space
+        in MB for the working directories, and the content hashes
+        of the most recently used validators in the cache.
+    '''
+    try:
+        load = getloadavg()[0] / (cpu_count() or 1)
+    except OSError:
+        load = 0
+    try:
+        free_disk = shutil.disk_usage(config.get("Execution", "directory")).free // (1024 * 1024)
+    except OSError:
+        free_disk = None
+    try:
+        validators = validator_cache(config).recent_keys(MAX_REPORTED_VALIDATORS)
+    except OSError:
+        validators = []
+    return {'free_slots': free_slots,
+            'load': round(load, 2),
+            'free_disk': free_disk,
+            'validators': validators}
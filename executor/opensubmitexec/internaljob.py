@@ -1,11 +1,16 @@
 import os.path
 import sys
+import time
 import importlib
 
 from .config import read_config
 from .exceptions import *
-from .server import send_post
+from .spool import ResultSpool
 from .filesystem import remove_working_directory
+from .locking import JobSlot
+from .running import shorten
+from .processes import ProcessRegistry
+from .metrics import timed, record_job
 
 import logging
 logger = logging.getLogger('opensubmitexec')
@@ -26,8 +31,30 @@ class InternalJob():
 
     submission_url = None
     validator_url = None
+    validator_hash = None
+    # Lease of this job in the v2 API
+    lease_id = None
     result_sent = False
 
+    # The job slot occupied while the validator runs.
+    _slot = None
+
+    # Performance data lines collected by benchmark_program().
+    _perf_data = None
+
+    # Durations of the processing phases, in seconds.
+    _timings = None
+    # Creation time, error code of the sent result and
+    # name of the exception that ended the validator, for the metrics.
+    _created = None
+    _error_code = None
+    _exception = None
+    _metrics_recorded = False
+
+    # Processes of the executor account when the first program
+    # of this job started, as base for the process limit.
+    _user_processes = None
+
     # The base name of the validation / full test script
     # on disk, for importing.
     _validator_import_name = 'validator'
@@ -38,6 +65,9 @@ class InternalJob():
         else:
             self._config = read_config()
         self._online = online
+        self._perf_data = []
+        self._timings = {}
+        self._created = time.time()
 
     def __str__(self):
         '''
@@ -47,20 +77,92 @@ class InternalJob():
 
     def _run_validate(self):
         '''
-        Execute the validate() method in the test script belonging to this job.
+        Execute the validate() method in the test script belonging to this job,
+        while occupying a job slot on this machine.
+        '''
+        try:
+            with JobSlot(self._config) as self._slot:
+                try:
+                    with timed(self._timings, 'validate'):
+                        self._run_validator_script()
+                finally:
+                    self._kill_programs()
+            self._slot = None
+        finally:
+            self._record_metrics()
+
+    def _record_metrics(self):
+        '''
+        Store the phase timings and the outcome of this job.
+        '''
+        if self._metrics_recorded:
+            return
+        self._metrics_recorded = True
+        if self._error_code is None:
+            result = 'none'
+        elif self._error_code == 0:
+            result = 'pass'
+        else:
+            result = 'fail'
+        record_job(self._config, {'time': time.time(),
+                                  'duration': time.time() - self._created,
+                                  'submission_id': getattr(self, 'sub_id', None),
+                                  'file_id': self.file_id,
+                                  'action': self.action,
+                                  'result': result,
+                                  'exception': self._exception,
+                                  'phases': self._timings})
+
+    def _kill_programs(self):
+        '''
+        Terminate all remaining process trees started for this job.
         '''
+        registry = ProcessRegistry(self._config)
+        for entry in registry.job_entries(self.file_id):
+            registry.kill(entry)
+
+    def _reserve_all_slots(self):
+        '''
+        Make sure that no other job runs in parallel on this machine.
+        Left-over programs of other jobs are terminated.
+        '''
+        if self._slot and not self._slot.exclusive:
+            self._slot.reserve_all()
+            registry = ProcessRegistry(self._config)
+            for entry in registry.entries():
+                if entry['job'] != self.file_id:
+                    logger.debug("Killing left-over process group %u of job %s." % (entry['pgid'], entry['job']))
+                    registry.kill(entry)
+
+    def _run_validator_script(self):
         assert(os.path.exists(self.validator_script_name))
         old_path = sys.path
         sys.path = [self.working_dir] + old_path
         # logger.debug('Python search path is now {0}.'.format(sys.path))
+        try:
+            validated = self._call_validator()
+        finally:
+            # Daemon workers run many jobs, so roll back in any case
+            sys.path = old_path
+        if validated:
+            # Test script was executed, result was somehow sent
+            # Clean the file system, since we can't do anything else
+            remove_working_directory(self.working_dir, self._config)
+
+    def _call_validator(self):
+        '''
+        Load the validator module and call it.
 
+        Returns False if a failure result was sent instead.
+        '''
         try:
             module = importlib.import_module(self._validator_import_name)
         except Exception as e:
+            self._exception = type(e).__name__
             text_student = "Internal validation problem, please contact your course responsible."
             text_tutor = "Exception while loading the validator: " + str(e)
             self._send_result(text_student, text_tutor, UNSPECIFIC_ERROR)
-            return
+            return False
 
         # Looped validator loading in the test suite demands this
         importlib.reload(module)
@@ -69,6 +171,7 @@ class InternalJob():
         try:
             module.validate(self)
         except Exception as e:
+            self._exception = type(e).__name__
             # get more info
             text_student = None
             text_tutor = None
@@ -86,6 +189,13 @@ class InternalJob():
                     e.instance.name)
                 text_student += "\n\nOutput so far:\n" + e.output
                 text_tutor += "\n\nOutput so far:\n" + e.output
+            elif isinstance(e, ResourceLimitException):
+                text_student = "The execution of '{0}' was cancelled, since it exceeded the {1} limit.".format(
+                    e.instance.name, e.limit)
+                text_tutor = "The execution of '{0}' was cancelled due to the {1} limit.".format(
+                    e.instance.name, e.limit)
+                text_student += "\n\nOutput so far:\n" + e.output
+                text_tutor += "\n\nOutput so far:\n" + e.output
             elif type(e) is NestedException:
                 text_student = "Unexpected problem during the execution of '{0}'. {1}".format(
                     e.instance.name,
@@ -128,29 +238,49 @@ class InternalJob():
                     str(e))
             # We got the text. Report the problem.
             self._send_result(text_student, text_tutor, UNSPECIFIC_ERROR)
-            return
+            return False
         # no unhandled exception during the execution of the validator
         if not self.result_sent:
             logger.debug("Validation script forgot result sending, assuming success.")
             self.send_pass_result()
-        # roll back
-        sys.path = old_path
-        # Test script was executed, result was somehow sent
-        # Clean the file system, since we can't do anything else
-        remove_working_directory(self.working_dir, self._config)
+        return True
 
     def _send_result(self, info_student, info_tutor, error_code):
+        # Enforce the configured size limit for result messages
+        max_size = self._config.getint("Execution", "message_size")
+        if info_student:
+            info_student = shorten(info_student.encode(), max_size).decode(errors='ignore')
+        if info_tutor:
+            info_tutor = shorten(info_tutor.encode(), max_size).decode(errors='ignore')
         post_data = [("SubmissionFileId", self.file_id),
                      ("Message", info_student),
                      ("Action", self.action),
                      ("MessageTutor", info_tutor),
                      ("ExecutorDir", self.working_dir),
                      ("ErrorCode", error_code),
+                     ("PerfData", "\n".join(self._perf_data)),
+                     ("ValidatorHash", self.validator_hash or ''),
                      ("Secret", self._config.get("Server", "secret")),
                      ("UUID", self._config.get("Server", "uuid"))
                      ]
         logger.info(
             'Sending result to OpenSubmit Server: ' + str(post_data))
         if self._online:
-            send_post(self._config, "/jobs/", post_data)
+            with timed(self._timings, 'report'):
+                result = None
+                if self.lease_id:
+                    result = {'lease_id': self.lease_id,
+                              'error_code': error_code,
+                              'message': info_student,
+                              'message_tutor': info_tutor,
+                              'perf_data': "\n".join(self._perf_data),
+                              'validator_hash': self.validator_hash}
+                # Stored on disk first, so that the result survives server downtimes
+                spool = ResultSpool(self._config)
+                spool.put(self.file_id, post_data, result)
+                try:
+                    spool.flush()
+                except Exception as e:
+                    logger.error("Error while delivering spooled results: " + str(e))
+        self._error_code = error_code
         self.result_sent = True
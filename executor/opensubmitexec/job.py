@@ -5,14 +5,49 @@ The official executor API for validation test and full test scripts.
 from .internaljob import InternalJob, UNSPECIFIC_ERROR
 from .filesystem import has_file
 from .exceptions import *
-from .compiler import GCC, compiler_cmdline
+from .compiler import GCC, compiler_cmdline, compile_cache_key
+from .cache import compiler_cache
 from .running import RunningProgram
 
 import os
 import re
+import mmap
+import time
+import resource
+import statistics
 import logging
+from collections import namedtuple
 logger = logging.getLogger('opensubmitexec')
 
+# Files above this size are searched through a memory mapping
+MMAP_THRESHOLD = 64 * 1024
+
+Match = namedtuple('Match', ['file', 'line', 'pattern'])
+Match.__doc__ = """A search result from Job.search().
+
+Attributes:
+    file (str):    Path of the file, relative to the working directory.
+    line (int):    Number of the matching line, starting with 1.
+    pattern (str): The pattern that matched.
+"""
+
+
+def _combine_patterns(patterns):
+    '''
+    Combine the patterns into one regular expression, as alternation of named groups.
+
+    Numbered backreferences would point to the wrong group in the combination.
+    In this case, or if the combination does not compile, every line is a candidate.
+    '''
+    if not any(re.search(r'\\[1-9]', pattern) for pattern in patterns):
+        try:
+            return re.compile('|'.join('(?P<p{0}>{1})'.format(i, pattern)
+                                       for i, pattern in enumerate(patterns)).encode(),
+                              re.MULTILINE)
+        except re.error:
+            pass
+    return re.compile(b'^', re.MULTILINE)
+
 
 class Job(InternalJob):
     """A OpenSubmit validation job to be done.
@@ -122,6 +157,10 @@ class Job(InternalJob):
     def run_compiler(self, compiler=GCC, inputs=None, output=None):
         """Runs a compiler in the working directory.
 
+        If the same compiler call was already made for identical input
+        and student files, the output file is taken from the compile cache
+        of the executor instead.
+
         Args:
             compiler (tuple): The compiler program and its command-line arguments,
                               including placeholders for output and input files.
@@ -130,10 +169,21 @@ class Job(InternalJob):
 
         """
         # Let exceptions travel through
-        prog = RunningProgram(self, *compiler_cmdline(compiler=compiler,
-                                                      inputs=inputs,
-                                                      output=output))
+        name, arguments = compiler_cmdline(compiler=compiler,
+                                           inputs=inputs,
+                                           output=output)
+        cache, key = None, None
+        if output and self._config.getboolean("Execution", "compile_cache"):
+            cache = compiler_cache(self._config)
+            key = compile_cache_key(self.working_dir, [name] + arguments, inputs,
+                                    self._student_file_paths(True), output)
+            if key and cache.get(key, self.working_dir + output):
+                logger.info("Using cached compilation result for " + output)
+                return
+        prog = RunningProgram(self, name, arguments)
         prog.expect_exit_status(0)
+        if key and os.path.isfile(self.working_dir + output):
+            cache.put(key, self.working_dir + output)
 
     def run_build(self, compiler=GCC, inputs=None, output=None):
         """Combined call of 'configure', 'make' and the compiler.
@@ -161,7 +211,8 @@ class Job(InternalJob):
             timeout (int):     The timeout for execution.
             exclusive (bool):  Prevent parallel validation runs on the
                                test machines, e.g. when doing performance
-                               measurements for submitted code.
+                               measurements for submitted code. Waits until
+                               all other jobs on this machine are finished.
 
         Returns:
             RunningProgram: An object representing the running program.
@@ -169,7 +220,7 @@ class Job(InternalJob):
         """
         logger.debug("Spawning program for interaction ...")
         if exclusive:
-            kill_longrunning(self.config)
+            self._reserve_all_slots()
 
         return RunningProgram(self, name, arguments, timeout)
 
@@ -182,7 +233,8 @@ class Job(InternalJob):
             timeout (int):     The timeout for execution.
             exclusive (bool):  Prevent parallel validation runs on the
                                test machines, e.g. when doing performance
-                               measurements for submitted code.
+                               measurements for submitted code. Waits until
+                               all other jobs on this machine are finished.
 
         Returns:
             tuple: A tuple of the exit code, as reported by the operating system,
@@ -190,14 +242,142 @@ class Job(InternalJob):
         """
         logger.debug("Running program ...")
         if exclusive:
-            kill_longrunning(self.config)
+            self._reserve_all_slots()
 
         prog = RunningProgram(self, name, arguments, timeout)
         return prog.expect_end()
 
-    def grep(self, regex):
+    def benchmark_program(self, name, arguments=[], runs=5, warmup=1, timeout=30, exclusive=True):
+        """Runs a program repeatedly in the working directory and measures its execution time.
+
+        Every run must end with exit status 0. The statistics are reported as
+        performance data to OpenSubmit, together with the validation result.
+
+        Args:
+            name (str):        The name of the program to be executed.
+            arguments (tuple): Command-line arguments for the program.
+            runs (int):        The number of measured runs.
+            warmup (int):      The number of runs before the measurement, e.g. for filling caches.
+            timeout (int):     The timeout for each run.
+            exclusive (bool):  Prevent parallel validation runs on the
+                               test machines. Without this, the measurements
+                               are disturbed by the other jobs, and the user / system
+                               times also include their programs.
+
+        Returns:
+            dict: The median, standard deviation and minimum in seconds
+            for the 'wall', 'user' and 'sys' time of the measured runs, e.g.
+            result['wall']['median'].
+
+        """
+        if runs < 1:
+            raise ValidatorBrokenException("You need at least one measured run for benchmarking.")
+        logger.debug("Benchmarking program ...")
+        if exclusive:
+            self._reserve_all_slots()
+
+        samples = {'wall': [], 'user': [], 'sys': []}
+        for run in range(warmup + runs):
+            before = resource.getrusage(resource.RUSAGE_CHILDREN)
+            start = time.perf_counter()
+            prog = RunningProgram(self, name, arguments, timeout)
+            prog.expect_exitstatus(0)
+            wall = time.perf_counter() - start
+            after = resource.getrusage(resource.RUSAGE_CHILDREN)
+            if run >= warmup:
+                samples['wall'].append(wall)
+                samples['user'].append(after.ru_utime - before.ru_utime)
+                samples['sys'].append(after.ru_stime - before.ru_stime)
+
+        result = {}
+        for metric, values in samples.items():
+            result[metric] = {'median': statistics.median(values),
+                              'stddev': statistics.stdev(values) if len(values) > 1 else 0.0,
+                              'min': min(values)}
+            self._perf_data.append("{0};{1};{2};{3:.6f};{4:.6f};{5:.6f}".format(
+                name, metric, runs,
+                result[metric]['median'], result[metric]['stddev'], result[metric]['min']))
+        return result
+
+    def _student_file_paths(self, recursive):
+        # Relative paths of all regular student files, in stable order
+        result = []
+        for fname in sorted(self.student_files):
+            path = self.working_dir + fname
+            if os.path.islink(path):
+                continue
+            if os.path.isfile(path):
+                result.append(fname)
+            elif recursive and os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    for name in sorted(files):
+                        fpath = os.path.join(root, name)
+                        if os.path.isfile(fpath) and not os.path.islink(fpath):
+                            result.append(os.path.relpath(fpath, self.working_dir))
+        return result
+
+    def search(self, patterns, recursive=True):
         """Scans the student files for text patterns.
 
+        All patterns are combined into one regular expression, and each file
+        is scanned only once. Patterns are matched per line, so they never
+        span line breaks. A line matching multiple patterns is reported once
+        per pattern.
+
+        Args:
+            patterns (tuple):  Regular expressions used for scanning inside the files. A single string is accepted, too.
+            recursive (bool):  Also scan the files in student subdirectories.
+
+        Returns:
+            list: :class:`Match` entries with file name, line number and pattern, ordered by file and line.
+        """
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        compiled = [(pattern, re.compile(pattern.encode())) for pattern in patterns]
+        combined = _combine_patterns(patterns)
+        matches = []
+        logger.debug("Searching student files for {0}".format(patterns))
+        for fname in self._student_file_paths(recursive):
+            with open(self.working_dir + fname, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if size == 0:
+                    continue
+                if size > MMAP_THRESHOLD:
+                    data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                else:
+                    data = f.read()
+                # Line number bookkeeping is incremental, so that the
+                # content is not split into lines
+                line, pos = 1, 0
+                # A trailing newline ends the last line, and does not start a new one
+                end = size - 1 if data[size - 1:size] == b'\n' else size
+                while pos < size:
+                    m = combined.search(data, pos, end)
+                    if not m:
+                        break
+                    # mmap has no count(), slices are bytes
+                    line += data[pos:m.start()].count(b'\n')
+                    line_start = max(pos, data.rfind(b'\n', pos, m.start()) + 1)
+                    line_end = data.find(b'\n', m.start())
+                    if line_end < 0:
+                        line_end = size
+                    # The combined match may span lines, the
+                    # single patterns decide on the line alone
+                    text = data[line_start:line_end]
+                    for pattern, regex in compiled:
+                        if regex.search(text):
+                            logger.debug("{0}:{1} contains '{2}'".format(fname, line, pattern))
+                            matches.append(Match(fname, line, pattern))
+                    line += 1
+                    pos = line_end + 1
+                if isinstance(data, mmap.mmap):
+                    data.close()
+        return matches
+
+    def grep(self, regex):
+        """Scans the top-level student files for a text pattern.
+
         Args:
             regex (str):       Regular expression used for scanning inside the files.
 
@@ -205,13 +385,9 @@ class Job(InternalJob):
             tuple:     Names of the matching files in the working directory.
         """
         matches = []
-        logger.debug("Searching student files for '{0}'".format(regex))
-        for fname in self.student_files:
-            if os.path.isfile(self.working_dir + fname):
-                for line in open(self.working_dir + fname, 'br'):
-                    if re.search(regex.encode(), line):
-                        logger.debug("{0} contains '{1}'".format(fname, regex))
-                        matches.append(fname)
+        for match in self.search(regex, recursive=False):
+            if match.file not in matches:
+                matches.append(match.file)
         return matches
 
     def ensure_files(self, filenames):
@@ -0,0 +1,182 @@
+'''
+    Resource limits for student programs.
+'''
+
+import os
+import errno
+import signal
+import resource
+import itertools
+import time
+
+from .exceptions import *
+
+import logging
+logger = logging.getLogger('opensubmitexec')
+
+# Unique names for the control groups of parallel programs
+_cgroup_counter = itertools.count()
+
+MB = 1024 * 1024
+
+
+def remove_cgroup(path):
+    '''
+    Kill all processes in the control group and remove it.
+    '''
+    try:
+        if os.path.exists(os.path.join(path, "cgroup.kill")):
+            with open(os.path.join(path, "cgroup.kill"), 'w') as f:
+                f.write("1")
+        # Killing is asynchronous, the group is busy until all processes are gone
+        for attempt in range(20):
+            try:
+                os.rmdir(path)
+                return
+            except OSError as e:
+                if e.errno != errno.EBUSY:
+                    raise
+                time.sleep(0.05)
+        os.rmdir(path)
+    except OSError as e:
+        logger.warning("Could not remove control group {0}: {1}".format(path, e))
+
+
+def user_processes(job):
+    '''
+    Number of processes and threads of the executor account.
+    Scanning the process table is expensive, so it is only
+    done for the first program of the job.
+    '''
+    if job._user_processes is None:
+        import psutil
+        uid = os.getuid()
+        job._user_processes = 0
+        for proc in psutil.process_iter(attrs=['uids', 'num_threads']):
+            if proc.info['uids'] and proc.info['uids'].real == uid:
+                job._user_processes += proc.info['num_threads'] or 1
+    return job._user_processes
+
+
+class ResourceLimits():
+    '''
+    Resource limits for one spawned program, as configured
+    in the executor settings. A limit of 0 means no limit.
+
+    The limits are set with setrlimit() in the child process,
+    right before the program starts. If a cgroup (v2) directory
+    is configured, the program additionally gets its own child group
+    there. It limits memory and process count for the whole process tree,
+    and allows to detect violations of these limits.
+
+    Without a cgroup, the process limit is only best-effort. RLIMIT_NPROC
+    counts all processes of the executor account, so the limit is put on
+    top of the number of processes that were running when the first program
+    of the job was started. Parallel jobs share this budget.
+    '''
+    cpu = 0           # CPU seconds
+    memory = 0        # MB of address space
+    processes = 0     # Number of processes / threads
+    file_size = 0     # MB per written file
+    cgroup = None     # Path of the control group, if any
+    _nproc = 0        # RLIMIT_NPROC value, if no cgroup is used
+    _started = None   # Time stamp for detecting files written by the program
+
+    def __init__(self, job):
+        config = job._config
+        self.cpu = config.getint("Execution", "limit_cpu")
+        self.memory = config.getint("Execution", "limit_memory")
+        self.processes = config.getint("Execution", "limit_processes")
+        self.file_size = config.getint("Execution", "limit_file_size")
+        self._started = time.time()
+        base = config.get("Execution", "cgroup")
+        if base and (self.memory or self.processes):
+            self._create_cgroup(base)
+        if self.processes and not self.cgroup:
+            self._nproc = user_processes(job) + self.processes
+
+    def _create_cgroup(self, base):
+        path = os.path.join(base, "opensubmit-%u-%u" % (os.getpid(), next(_cgroup_counter)))
+        try:
+            os.mkdir(path)
+            self.cgroup = path
+            if self.memory:
+                self._write_cgroup("memory.max", str(self.memory * MB))
+            if self.processes:
+                self._write_cgroup("pids.max", str(self.processes))
+        except OSError as e:
+            logger.warning("Could not create control group in {0}, using only rlimits: {1}".format(base, e))
+            self.release()
+
+    def _write_cgroup(self, name, value):
+        with open(os.path.join(self.cgroup, name), 'w') as f:
+            f.write(value)
+
+    def _read_cgroup_event(self, name, event):
+        try:
+            with open(os.path.join(self.cgroup, name)) as f:
+                for line in f:
+                    key, value = line.split()
+                    if key == event:
+                        return int(value)
+        except OSError:
+            pass
+        return 0
+
+    def apply(self):
+        '''
+        Set the limits for the current process.
+        Intended as preexec_fn for the spawned program.
+        '''
+        if self.cgroup:
+            self._write_cgroup("cgroup.procs", str(os.getpid()))
+        if self.cpu:
+            # Soft limit gives SIGXCPU, hard limit SIGKILL
+            resource.setrlimit(resource.RLIMIT_CPU, (self.cpu, self.cpu + 1))
+        if self.memory:
+            resource.setrlimit(resource.RLIMIT_AS, (self.memory * MB, self.memory * MB))
+        if self.file_size:
+            resource.setrlimit(resource.RLIMIT_FSIZE, (self.file_size * MB, self.file_size * MB))
+        if self._nproc:
+            resource.setrlimit(resource.RLIMIT_NPROC, (self._nproc, self._nproc))
+
+    def check(self, instance, signalstatus):
+        '''
+        Raise the according exception if the terminated program
+        hit one of the limits.
+
+        Exceeded memory and process limits can only be detected
+        with a control group. Without it, the program just
+        gets errors from malloc() or fork().
+        '''
+        output = instance.get_output()
+        if self.cpu and signalstatus == signal.SIGXCPU:
+            raise CpuLimitException(instance, "CPU time", output)
+        if self.file_size:
+            # Programs ignoring SIGXFSZ only get an error on write()
+            if signalstatus == signal.SIGXFSZ or self._has_full_file(instance.job.working_dir):
+                raise FileSizeLimitException(instance, "file size", output)
+        if self.cgroup:
+            if self._read_cgroup_event("memory.events", "oom_kill") > 0:
+                raise MemoryLimitException(instance, "memory", output)
+            if self._read_cgroup_event("pids.events", "max") > 0:
+                raise ProcessLimitException(instance, "process count", output)
+
+    def _has_full_file(self, directory):
+        for root, dirs, files in os.walk(directory):
+            for fname in files:
+                try:
+                    stat = os.stat(os.path.join(root, fname))
+                    if stat.st_mtime >= self._started and stat.st_size >= self.file_size * MB:
+                        return True
+                except OSError:
+                    pass
+        return False
+
+    def release(self):
+        '''
+        Remove the control group, including all remaining processes in it.
+        '''
+        if self.cgroup:
+            remove_cgroup(self.cgroup)
+            self.cgroup = None
@@ -3,6 +3,7 @@
 '''
 
 from twisted.python.lockfile import FilesystemLock
+import fcntl
 import os
 
 import logging
@@ -43,3 +44,62 @@ class ScriptLock():
         '''
         logger.debug("Releasing script lock")
         self.flock.unlock()
+
+
+class JobSlot():
+    '''
+    Marker for a job running on this machine.
+
+    All jobs hold a shared lock on the slot file, so that any number
+    of them can run in parallel. The number of parallel jobs is limited
+    by the number of configured slots in the executor daemon.
+
+    A job demanding exclusive execution converts its lock into an exclusive
+    one, which means that it waits until all other jobs are finished.
+    The additional gate lock prevents new jobs from starting in the meantime.
+    '''
+    slot_fname = None
+    gate_fname = None
+    slot_file = None
+    gate_file = None
+    exclusive = False
+
+    def __init__(self, config):
+        fname = config.get("Execution", "pidfile")
+        self.slot_fname = fname + '.slots'
+        self.gate_fname = fname + '.gate'
+
+    def __enter__(self):
+        '''
+        Be a context manager.
+        '''
+        self.slot_file = open(self.slot_fname, 'a')
+        self.gate_file = open(self.gate_fname, 'a')
+        fcntl.flock(self.gate_file, fcntl.LOCK_EX)
+        fcntl.flock(self.slot_file, fcntl.LOCK_SH)
+        fcntl.flock(self.gate_file, fcntl.LOCK_UN)
+        return self
+
+    def reserve_all(self):
+        '''
+        Wait until this is the only job running on the machine.
+        '''
+        if self.exclusive:
+            return
+        logger.debug("Waiting for exclusive job slot")
+        # Give up our own shared lock first, so that two jobs
+        # asking for exclusive execution cannot block each other.
+        fcntl.flock(self.slot_file, fcntl.LOCK_UN)
+        fcntl.flock(self.gate_file, fcntl.LOCK_EX)
+        fcntl.flock(self.slot_file, fcntl.LOCK_EX)
+        fcntl.flock(self.gate_file, fcntl.LOCK_UN)
+        self.exclusive = True
+        logger.debug("Got exclusive job slot")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''
+        Be a context manager.
+        '''
+        fcntl.flock(self.slot_file, fcntl.LOCK_UN)
+        self.slot_file.close()
+        self.gate_file.close()
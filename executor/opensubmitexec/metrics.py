@@ -0,0 +1,115 @@
+'''
+    Timing and outcome metrics of executor jobs.
+
+    Each finished job is written as one JSON line to the configured
+    metrics file. Optionally, counters and histograms over all jobs
+    are maintained in a Prometheus text format file, e.g. for the
+    textfile collector of the node exporter.
+'''
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+from contextlib import contextmanager
+
+import logging
+logger = logging.getLogger('opensubmitexec')
+
+# Upper bounds in seconds for the phase duration histogram
+PHASE_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, 300, 600]
+
+PREFIX = 'opensubmit_executor_'
+
+
+@contextmanager
+def timed(timings, phase):
+    '''
+    Adds the duration of the enclosed code to the
+    timings dictionary entry for this phase.
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[phase] = timings.get(phase, 0) + time.perf_counter() - started
+
+
+def record_job(config, record):
+    '''
+    Store the metrics record of a finished job, according to the configuration.
+    Problems are only logged, they never break the job processing.
+    '''
+    try:
+        fname = config.get("Logging", "metrics_file")
+        if fname:
+            with open(fname, 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+        fname = config.get("Logging", "metrics_prometheus")
+        if fname:
+            _update_prometheus(fname, record)
+    except Exception as e:
+        logger.error("Error while storing job metrics: " + str(e))
+
+
+def _update_prometheus(fname, record):
+    '''
+    Add the record to the aggregated values in the state file next to
+    the Prometheus file, and write the Prometheus file again.
+
+    Jobs run in different processes, so the state file is locked.
+    '''
+    with open(fname + '.state', 'a+') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        f.seek(0)
+        try:
+            state = json.load(f)
+        except ValueError:
+            state = {'jobs': {}, 'failures': {}, 'phases': {}}
+        state['jobs'][record['result']] = state['jobs'].get(record['result'], 0) + 1
+        if record.get('exception'):
+            state['failures'][record['exception']] = state['failures'].get(record['exception'], 0) + 1
+        for phase, duration in record['phases'].items():
+            entry = state['phases'].setdefault(phase, {'buckets': [0] * len(PHASE_BUCKETS), 'sum': 0, 'count': 0})
+            for index, bound in enumerate(PHASE_BUCKETS):
+                if duration <= bound:
+                    entry['buckets'][index] += 1
+            entry['sum'] += duration
+            entry['count'] += 1
+        f.seek(0)
+        f.truncate()
+        json.dump(state, f)
+        f.flush()
+        _write_atomic(fname, prometheus_text(state))
+
+
+def _write_atomic(fname, text):
+    handle, tmpname = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(fname)), prefix='.')
+    with os.fdopen(handle, 'w') as f:
+        f.write(text)
+    os.chmod(tmpname, 0o644)
+    os.replace(tmpname, fname)
+
+
+def prometheus_text(state):
+    '''
+    Render the aggregated metrics in the Prometheus text exposition format.
+    '''
+    lines = ['# HELP {0}jobs_total Finished jobs by result.'.format(PREFIX),
+             '# TYPE {0}jobs_total counter'.format(PREFIX)]
+    for result, count in sorted(state['jobs'].items()):
+        lines.append('{0}jobs_total{{result="{1}"}} {2}'.format(PREFIX, result, count))
+    lines += ['# HELP {0}job_failures_total Jobs ended by an exception, by exception type.'.format(PREFIX),
+              '# TYPE {0}job_failures_total counter'.format(PREFIX)]
+    for exception, count in sorted(state['failures'].items()):
+        lines.append('{0}job_failures_total{{exception="{1}"}} {2}'.format(PREFIX, exception, count))
+    lines += ['# HELP {0}phase_duration_seconds Duration of the job processing phases.'.format(PREFIX),
+              '# TYPE {0}phase_duration_seconds histogram'.format(PREFIX)]
+    for phase, entry in sorted(state['phases'].items()):
+        for bound, count in zip(PHASE_BUCKETS, entry['buckets']):
+            lines.append('{0}phase_duration_seconds_bucket{{phase="{1}",le="{2}"}} {3}'.format(PREFIX, phase, bound, count))
+        lines.append('{0}phase_duration_seconds_bucket{{phase="{1}",le="+Inf"}} {2}'.format(PREFIX, phase, entry['count']))
+        lines.append('{0}phase_duration_seconds_sum{{phase="{1}"}} {2}'.format(PREFIX, phase, entry['sum']))
+        lines.append('{0}phase_duration_seconds_count{{phase="{1}"}} {2}'.format(PREFIX, phase, entry['count']))
+    return '\n'.join(lines) + '\n'
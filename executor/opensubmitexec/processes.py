@@ -0,0 +1,98 @@
+'''
+    Registry of the process trees started by validators.
+'''
+
+import os
+import json
+import time
+import signal
+
+from .limits import remove_cgroup
+
+import logging
+logger = logging.getLogger('opensubmitexec')
+
+
+class ProcessRegistry():
+    '''
+    On-disk registry of the programs spawned for jobs on this machine.
+
+    Each spawned program is the leader of a new session and process group
+    (pexpect gives it its own terminal), so killing the process group also
+    kills all its children that did not leave the group on purpose.
+    If the program runs in a control group, this is killed as well.
+
+    The entries are files next to the pidfile, so that the programs of crashed
+    executor processes can still be found by the next executor run.
+    '''
+    directory = None
+
+    def __init__(self, config):
+        self.directory = config.get("Execution", "pidfile") + '.procs'
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, pgid):
+        return os.path.join(self.directory, str(pgid))
+
+    def register(self, pgid, job_id, cgroup=None):
+        '''
+        Remember a new process group for the given job.
+        '''
+        import psutil
+        entry = {'pgid': pgid,
+                 'job': job_id,
+                 'owner': os.getpid(),
+                 'started': time.time(),
+                 'cgroup': cgroup}
+        try:
+            # Allows to detect PID reuse later
+            entry['create_time'] = psutil.Process(pgid).create_time()
+        except psutil.Error:
+            entry['create_time'] = None
+        with open(self._path(pgid), 'w') as f:
+            json.dump(entry, f)
+
+    def entries(self):
+        result = []
+        for fname in os.listdir(self.directory):
+            try:
+                with open(self._path(fname)) as f:
+                    result.append(json.load(f))
+            except (OSError, ValueError):
+                # Removed in the meantime, or not completely written yet
+                pass
+        return result
+
+    def job_entries(self, job_id):
+        '''
+        Entries of the given job that were registered by this process.
+        '''
+        return [entry for entry in self.entries()
+                if entry['job'] == job_id and entry['owner'] == os.getpid()]
+
+    def kill(self, entry):
+        '''
+        Terminate the process tree of the entry and remove it from the registry.
+        '''
+        import psutil
+        pgid = entry['pgid']
+        try:
+            leader = psutil.Process(pgid)
+            if entry['create_time'] and leader.create_time() != entry['create_time']:
+                # The process ID is used by some unrelated new process
+                pgid = None
+        except psutil.Error:
+            # Leader is gone, remaining group members are still killed
+            pass
+        if pgid:
+            try:
+                os.killpg(pgid, signal.SIGKILL)
+                logger.debug("Killed process group {0} of job {1}.".format(pgid, entry['job']))
+            except (ProcessLookupError, PermissionError):
+                pass
+        if entry['cgroup'] and os.path.isdir(entry['cgroup']):
+            remove_cgroup(entry['cgroup'])
+        try:
+            os.remove(self._path(entry['pgid']))
+        except FileNotFoundError:
+            pass
@@ -1,9 +1,10 @@
 import pexpect
 import os
 import time
-import tempfile
 
 from .exceptions import *
+from .limits import ResourceLimits
+from .processes import ProcessRegistry
 
 import logging
 logger = logging.getLogger('opensubmitexec')
@@ -11,29 +12,103 @@ logger = logging.getLogger('opensubmitexec')
 
 def kill_longrunning(config):
     '''
-        Terminate everything under the current user account
-        that has run too long. This is a final safeguard if
+        Terminate the student programs that have run too long, or
+        whose executor process is gone. This is a final safeguard if
         the subprocess timeout stuff is not working.
-        You better have no production servers running also
-        under the current user account ...
+        Only the process trees in the registry of spawned programs
+        are considered, everything else on the machine is left alone.
     '''
-    import psutil
-    ourpid = os.getpid()
-    username = psutil.Process(ourpid).username
-    # Check for other processes running under this account
     # Take the timeout definition from the config file
     timeout = config.getint("Execution", "timeout")
-    for proc in psutil.process_iter():
-        if proc.username == username and proc.pid != ourpid:
-            runtime = time.time() - proc.create_time
-            logger.debug("This user already runs %u for %u seconds." %
-                         (proc.pid, runtime))
-            if runtime > timeout:
-                logger.debug("Killing %u due to exceeded runtime." % proc.pid)
-                try:
-                    proc.kill()
-                except Exception:
-                    logger.error("ERROR killing process %d." % proc.pid)
+    registry = ProcessRegistry(config)
+    for entry in registry.entries():
+        runtime = time.time() - entry['started']
+        if runtime > timeout:
+            logger.debug("Killing process group %u due to exceeded runtime." % entry['pgid'])
+            registry.kill(entry)
+        elif not _is_running(entry['owner']):
+            logger.debug("Killing process group %u of a terminated executor." % entry['pgid'])
+            registry.kill(entry)
+
+
+def _is_running(pid):
+    # Dead pool workers stay zombies until the pool collects them
+    import psutil
+    try:
+        return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+    except psutil.NoSuchProcess:
+        return False
+
+
+# Replacement for the middle part of shortened output
+OMISSION_MARKER = b"\n[... %u bytes omitted ...]\n"
+
+
+def shorten(data, max_size):
+    '''
+        Cut out the middle of the given bytes, so that only max_size
+        bytes of the data remain. Start and end are kept, since
+        they typically carry the interesting information.
+        A max_size <= 0 means no limit.
+    '''
+    if max_size <= 0 or len(data) <= max_size:
+        return data
+    head = max_size // 2
+    return data[:head] + OMISSION_MARKER % (len(data) - max_size) + data[len(data) - (max_size - head):]
+
+
+class OutputCapture():
+    '''
+        Logfile replacement for pexpect, which keeps only the
+        beginning and the end of the console I/O in memory.
+
+        Half of max_size is used for the first bytes of the output, the other half
+        is a ring buffer for the last bytes. Everything in between is only counted.
+        A max_size <= 0 means that everything is kept.
+    '''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.head_size = max_size // 2
+        self.tail_size = max_size - self.head_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+        self._text = ''
+        self._text_offset = 0
+
+    def write(self, data):
+        self.total += len(data)
+        if self.max_size <= 0:
+            self.head += data
+            return
+        if len(self.head) < self.head_size:
+            free = self.head_size - len(self.head)
+            self.head += data[:free]
+            data = data[free:]
+        self.tail += data
+        # Trim only now and then, to avoid copying on each write
+        if len(self.tail) > 2 * self.tail_size:
+            del self.tail[:len(self.tail) - self.tail_size]
+
+    def flush(self):
+        pass
+
+    def text(self):
+        '''
+            The captured output as text. Decoding only happens when
+            new output arrived since the last call.
+        '''
+        if self._text_offset != self.total:
+            data = bytes(self.head)
+            tail = self.tail[max(0, len(self.tail) - self.tail_size):]
+            omitted = self.total - len(data) - len(tail)
+            if omitted > 0:
+                data += OMISSION_MARKER % omitted
+            data += tail
+            self._text = data.decode('utf-8', errors='replace')
+            self._text_offset = self.total
+        return self._text
 
 
 class RunningProgram(pexpect.spawn):
@@ -52,17 +127,29 @@ class RunningProgram(pexpect.spawn):
     arguments = None
     _logfile = None
     _spawn = None
+    _limits = None
 
     def get_output(self):
         """Get the program output produced so far.
 
+        Very long output is shortened in the middle,
+        according to the 'output_size' setting of the executor.
+
         Returns:
             str: Program output as text. May be incomplete.
         """
-        # Open temporary file for reading, in text mode
-        # This makes sure that the file pointer for writing
-        # is not touched
-        return ''.join(open(self._logfile.name).readlines())
+        return self._logfile.text()
+
+    def _check_limits(self):
+        """Raise a ResourceLimitException if the terminated program
+        exceeded one of the configured resource limits.
+        """
+        # Fetches the exit status, if the program is already gone
+        self._spawn.isalive()
+        try:
+            self._limits.check(self, self._spawn.signalstatus)
+        finally:
+            self._limits.release()
 
     def get_exitstatus(self):
         """Get the exit status of the program execution.
@@ -80,7 +167,9 @@ class RunningProgram(pexpect.spawn):
         self.arguments = arguments
 
         # Allow code to load its own libraries
-        os.environ["LD_LIBRARY_PATH"] = job.working_dir
+        # Parallel jobs demand that we do not touch our own environment
+        env = os.environ.copy()
+        env["LD_LIBRARY_PATH"] = job.working_dir
 
         logger.debug("Spawning '{0}' in {1} with the following arguments:{2}".format(
             name,
@@ -90,17 +179,22 @@ class RunningProgram(pexpect.spawn):
         if name.startswith('./'):
             name = name.replace('./', self.job.working_dir)
 
-        self._logfile = tempfile.NamedTemporaryFile()
-        logger.debug("Keeping console I/O in " + self._logfile.name)
+        self._logfile = OutputCapture(job._config.getint("Execution", "output_size"))
+        self._limits = ResourceLimits(job)
         try:
             self._spawn = pexpect.spawn(name, arguments,
                                         logfile=self._logfile,
                                         timeout=timeout,
                                         cwd=self.job.working_dir,
-                                        echo=False)
+                                        env=env,
+                                        echo=False,
+                                        preexec_fn=self._limits.apply)
         except Exception as e:
             logger.debug("Spawning failed: " + str(e))
+            self._limits.release()
             raise NestedException(instance=self, real_exception=e, output=self.get_output())
+        # Remember the process tree, so that it can be killed at the end of the job
+        ProcessRegistry(job._config).register(self._spawn.pid, job.file_id, self._limits.cgroup)
 
     def expect_output(self, pattern, timeout=-1):
         """Wait until the running program performs some given output, or terminates.
@@ -118,12 +212,14 @@ class RunningProgram(pexpect.spawn):
         Raises:
             TimeoutException: The output did not match within the given time frame.
             TerminationException: The program terminated before producing the output.
+            ResourceLimitException: The program was terminated due to a resource limit.
             NestedException: An internal problem occured while waiting for the output.
         """
         logger.debug("Expecting output '{0}' from '{1}'".format(pattern, self.name))
         try:
             return self._spawn.expect(pattern, timeout)
         except pexpect.exceptions.EOF as e:
+            self._check_limits()
             logger.debug("Raising termination exception.")
             raise TerminationException(instance=self, real_exception=e, output=self.get_output())
         except pexpect.exceptions.TIMEOUT as e:
@@ -141,12 +237,14 @@ class RunningProgram(pexpect.spawn):
 
         Raises:
             TerminationException: The program terminated before / while / after sending the input.
+            ResourceLimitException: The program was terminated due to a resource limit.
             NestedException: An internal problem occured while waiting for the output.
         """
         logger.debug("Sending input '{0}' to '{1}'".format(text, self.name))
         try:
             return self._spawn.sendline(text)
         except pexpect.exceptions.EOF as e:
+            self._check_limits()
             logger.debug("Raising termination exception.")
             raise TerminationException(instance=self, real_exception=e, output=self.get_output())
         except pexpect.exceptions.TIMEOUT as e:
@@ -161,6 +259,9 @@ class RunningProgram(pexpect.spawn):
 
         Returns:
             A tuple with the exit code, as reported by the operating system, and the output produced.
+
+        Raises:
+            ResourceLimitException: The program was terminated due to a resource limit.
         """
         logger.debug("Waiting for termination of '{0}'".format(self.name))
         try:
@@ -168,6 +269,7 @@ class RunningProgram(pexpect.spawn):
             # Recommendation from the pexpect docs.
             self._spawn.expect(pexpect.EOF)
             self._spawn.wait()
+            self._check_limits()
             dircontent = str(os.listdir(self.job.working_dir))
             logger.debug("Working directory after execution: " + dircontent)
             return self.get_exitstatus(), self.get_output()
@@ -177,6 +279,8 @@ class RunningProgram(pexpect.spawn):
         except pexpect.exceptions.TIMEOUT as e:
             logger.debug("Raising timeout exception.")
             raise TimeoutException(instance=self, real_exception=e, output=self.get_output())
+        except ResourceLimitException:
+            raise
         except Exception as e:
             logger.debug("Waiting for expected program end failed.")
             raise NestedException(instance=self, real_exception=e, output=self.get_output())
@@ -8,60 +8,168 @@ import shutil
 import os.path
 import glob
 import json
+import time
+import hashlib
+import tempfile
 
 from .exceptions import *
 from .filesystem import *
-from .hostinfo import ipaddress, all_host_infos
+from .hostinfo import ipaddress, all_host_infos, last_sent, set_last_sent, current_status
+from .cache import validator_cache, file_hash
+from .metrics import timed
+from . import client
 
-from urllib.request import urlopen, urlretrieve
 from urllib.error import HTTPError, URLError
 from urllib.parse import urlencode
 
 import logging
 logger = logging.getLogger('opensubmitexec')
 
+# Long polling support announced by the servers, as maximum wait time per server URL
+_max_wait = {}
 
-def fetch(url, fullpath):
+# Support for the JSON-based v2 API, per server URL
+_api_v2 = {}
+
+# Protocol features of the v2 API used by this executor
+CAPABILITIES = ['lease_ids', 'bulk_results', 'perf_data', 'long_poll', 'validator_hash', 'status']
+
+
+def fetch_validator(config, url, fullpath, content_hash=None):
     '''
-    Fetch data from an URL and save it under the given target name.
+    Fetch a validator package, using the local validator cache.
+
+    If the server announced the content hash of the validator with the job,
+    and we have it in the cache, no download is needed at all.
+    Otherwise, the download is a conditional request for the
+    last known version of this URL.
     '''
-    logger.debug("Fetching %s from %s" % (fullpath, url))
+    cache = validator_cache(config)
+    if content_hash and cache.get(content_hash, fullpath):
+        return
+
+    headers = {}
+    known_hash = cache.get_tag(url)
+    if known_hash and known_hash in cache:
+        headers['If-None-Match'] = '"%s"' % known_hash
+    with open(fullpath, 'wb') as target:
+        result = client.request(config, url, headers=headers, target=target)
+    if result.status == 304:
+        if cache.get(known_hash, fullpath):
+            return
+        # Evicted in the meantime
+        with open(fullpath, 'wb') as target:
+            result = client.request(config, url, target=target)
 
-    tmpfile, headers = urlretrieve(url)
-    if os.path.exists(fullpath):
-        os.remove(fullpath)
-    shutil.move(tmpfile, fullpath)
+    logger.debug("Fetched %s from %s" % (fullpath, url))
+    etag = result.headers['ETag']
+    if etag:
+        content_hash = etag.strip('"')
+    else:
+        content_hash = file_hash(fullpath)
+    cache.put(content_hash, fullpath)
+    cache.set_tag(url, content_hash)
 
 
 def send_post(config, urlpath, post_data):
     '''
     Send POST data to an OpenSubmit server url path,
     according to the configuration.
+
+    Returns True on success.
     '''
     server = config.get("Server", "url")
-    post_data = urlencode(post_data)
-    post_data = post_data.encode("utf-8", errors="ignore")
     url = server + urlpath
     try:
-        urlopen(url, post_data)
+        client.request(config, url, data=post_data)
+        return True
     except Exception as e:
         logger.error('Error while sending data to server: ' + str(e))
+        return False
+
+
+def use_api_v2(config):
+    '''
+    Check if the server offers the JSON-based v2 API.
+    The answer is remembered per server URL.
+    '''
+    url = config.get("Server", "url")
+    if url not in _api_v2:
+        try:
+            result = client.request(config, url + "/api/v2/")
+            info = json.loads(result.body.decode('utf-8'))
+            _api_v2[url] = compatible_api_version(info["api_version"])
+        except HTTPError:
+            logger.debug("Server does not support the v2 API.")
+            _api_v2[url] = False
+        except (URLError, ValueError, KeyError) as e:
+            # Try again next time
+            logger.error("Error while contacting {0}: {1}".format(url, str(e)))
+            return False
+    return _api_v2[url]
+
+
+def post_json(config, urlpath, payload, timeout=None):
+    '''
+    Send a request to the v2 API of the OpenSubmit server.
+    The shared secret and the machine UUID are added to the payload.
+
+    Returns the decoded JSON answer. Error answers of the API
+    have an 'error' code and a 'message'.
+    Raises URLError when the server is not reachable.
+    '''
+    payload = dict(payload)
+    payload['secret'] = config.get("Server", "secret")
+    payload['uuid'] = config.get("Server", "uuid")
+    url = config.get("Server", "url") + urlpath
+    try:
+        result = client.request(config, url, data=json.dumps(payload).encode('utf-8'),
+                                headers={'Content-Type': 'application/json'}, timeout=timeout)
+        body = result.body
+    except HTTPError as e:
+        body = e.read()
+    try:
+        return json.loads(body.decode('utf-8'))
+    except ValueError:
+        raise URLError("Invalid answer from {0}".format(url))
 
 
-def send_hostinfo(config):
+def send_hostinfo(config, only_changed=False):
     '''
     Register this host on OpenSubmit test machine.
+
+    With only_changed, nothing is sent when the server
+    already got the same information from us.
+
+    Returns False when the sending was skipped.
     '''
-    info = all_host_infos()
+    info = all_host_infos(config)
+    address = ipaddress()
+    key = config.get("Server", "url") + ' ' + config.get("Server", "uuid")
+    checksum = hashlib.sha1(json.dumps([info, address]).encode('utf-8')).hexdigest()
+    if only_changed and last_sent(config, key) == checksum:
+        logger.debug("Host information is unchanged, not sending it.")
+        return False
     logger.debug("Sending host information: " + str(info))
-    post_data = [("Config", json.dumps(info)),
-                 ("Action", "get_config"),
-                 ("UUID", config.get("Server", "uuid")),
-                 ("Address", ipaddress()),
-                 ("Secret", config.get("Server", "secret"))
-                 ]
-
-    send_post(config, "/machines/", post_data)
+    if use_api_v2(config):
+        try:
+            answer = post_json(config, "/api/v2/register/",
+                               {'config': info, 'address': address, 'capabilities': CAPABILITIES})
+            sent = 'error' not in answer
+        except URLError as e:
+            logger.error('Error while sending data to server: ' + str(e))
+            sent = False
+    else:
+        post_data = [("Config", json.dumps(info)),
+                     ("Action", "get_config"),
+                     ("UUID", config.get("Server", "uuid")),
+                     ("Address", address),
+                     ("Secret", config.get("Server", "secret"))
+                     ]
+        sent = send_post(config, "/machines/", post_data)
+    if sent:
+        set_last_sent(config, key, checksum)
+    return True
 
 
 def compatible_api_version(server_version):
@@ -70,7 +178,7 @@ def compatible_api_version(server_version):
     '''
     try:
         semver = server_version.split('.')
-        if semver[0] != '1':
+        if semver[0] not in ['1', '2']:
             logger.error(
                 'Server API version (%s) is too new for us. Please update the executor installation.' % server_version)
             return False
@@ -82,11 +190,74 @@ def compatible_api_version(server_version):
         return False
 
 
-def fetch_job(config):
+def _prepare_job(config, job):
+    '''
+    Fetch the validator for a job, where the submission is
+    already stored in the working directory, and prepare the
+    working directory for execution.
+
+    Returns None if the job failed already in this stage.
+    '''
+    submission_fname = job.working_dir + job.file_name
+    assert(os.path.exists(submission_fname))
+
+    # Store validator package in working directory
+    validator_fname = job.working_dir + 'download.validator'
+    with timed(job._timings, 'validator'):
+        fetch_validator(config, job.validator_url, validator_fname, job.validator_hash)
+
+    try:
+        with timed(job._timings, 'prepare'):
+            prepare_working_directory(job, submission_fname, validator_fname)
+    except JobException as e:
+        job._exception = type(e).__name__
+        job.send_fail_result(e.info_student, e.info_tutor)
+        job._record_metrics()
+        return None
+    logger.debug("Got job: " + str(job))
+    return job
+
+
+def long_poll_wait(config):
+    '''
+    Number of seconds a job request may wait on the server for new work,
+    according to the configuration and the last announcement of the server.
+    '''
+    return min(config.getfloat("Execution", "long_poll"),
+               _max_wait.get(config.get("Server", "url"), 0))
+
+
+def _remember_max_wait(config, max_wait):
+    try:
+        _max_wait[config.get("Server", "url")] = float(max_wait or 0)
+    except ValueError:
+        _max_wait[config.get("Server", "url")] = 0
+
+
+def _status_query(config, free_slots):
+    '''
+    The current status of this machine as query string parameters.
+    '''
+    status = current_status(config, free_slots)
+    params = [('FreeSlots', status['free_slots']),
+              ('Load', status['load']),
+              ('Validators', ','.join(status['validators']))]
+    if status['free_disk'] is not None:
+        params.append(('FreeDisk', status['free_disk']))
+    return '&' + urlencode(params)
+
+
+def fetch_job(config, wait=0, free_slots=1):
     '''
     Fetch any available work from the OpenSubmit server and
     return an according job object.
 
+    If wait is given, the server can wait up to this number
+    of seconds for new work before it answers.
+
+    The request includes the current status of this machine,
+    so that the server can choose a suitable job.
+
     Returns None if no work is available.
 
     Errors are reported by this function directly.
@@ -94,11 +265,22 @@ def fetch_job(config):
     url = "%s/jobs/?Secret=%s&UUID=%s" % (config.get("Server", "url"),
                                           config.get("Server", "secret"),
                                           config.get("Server", "uuid"))
+    if wait:
+        url += "&Wait=%g" % wait
+    url += _status_query(config, free_slots)
+    timeout = config.getfloat("Server", "request_timeout") + wait
+    started = time.perf_counter()
 
+    # The submission is streamed to disk before we know the
+    # working directory, so it is moved there afterwards.
+    handle, download_fname = tempfile.mkstemp(dir=config.get("Execution", "directory"),
+                                              prefix='download_')
     try:
         # Fetch information from server
-        result = urlopen(url)
-        headers = result.info()
+        with os.fdopen(handle, 'wb') as target:
+            result = client.request(config, url, target=target, timeout=timeout)
+        headers = result.headers
+        _remember_max_wait(config, headers["MaxWait"])
         if not compatible_api_version(headers["APIVersion"]):
             # No proper reporting possible, so only logging.
             logger.error("Incompatible API version. Please update OpenSubmit.")
@@ -129,32 +311,145 @@ def fetch_job(config):
             job.timeout = int(headers["Timeout"])
         if "PostRunValidation" in headers:
             job.validator_url = headers["PostRunValidation"]
+        if "PostRunValidationHash" in headers:
+            job.validator_hash = headers["PostRunValidationHash"]
         job.working_dir = create_working_dir(config, job.sub_id)
 
         # Store submission in working directory
-        submission_fname = job.working_dir + job.file_name
-        with open(submission_fname, 'wb') as target:
-            target.write(result.read())
-        assert(os.path.exists(submission_fname))
+        os.rename(download_fname, job.working_dir + job.file_name)
+        # Includes the waiting time for long polling
+        job._timings['fetch'] = time.perf_counter() - started
 
-        # Store validator package in working directory
-        validator_fname = job.working_dir + 'download.validator'
-        fetch(job.validator_url, validator_fname)
-
-        try:
-            prepare_working_directory(job, submission_fname, validator_fname)
-        except JobException as e:
-            job.send_fail_result(e.info_student, e.info_tutor)
-            return None
-        logger.debug("Got job: " + str(job))
-        return job
+        return _prepare_job(config, job)
     except HTTPError as e:
         if e.code == 404:
+            _remember_max_wait(config, e.headers["MaxWait"])
             logger.debug("Nothing to do.")
             return None
     except URLError as e:
         logger.error("Error while contacting {0}: {1}".format(url, str(e)))
         return None
+    finally:
+        if os.path.exists(download_fname):
+            os.remove(download_fname)
+
+
+# Job attributes delivered in the lease manifest of the server
+MANIFEST_JOB_ATTRIBUTES = ('action', 'file_name', 'submitter_name',
+                           'submitter_student_id', 'submitter_studyprogram',
+                           'author_names', 'course', 'assignment', 'timeout',
+                           'validator_url', 'validator_hash')
+
+
+def fetch_jobs(config, max_jobs, wait=0):
+    '''
+    Lease up to max_jobs jobs from the OpenSubmit server in one request
+    and return a list of according job objects.
+
+    If wait is given, the server can wait up to this number
+    of seconds for new work before it answers.
+
+    Servers with the v2 API are asked with a JSON request. Older servers
+    without lease support are asked for a single job with fetch_job().
+
+    Errors are reported by this function directly.
+    '''
+    if use_api_v2(config):
+        return _fetch_jobs_v2(config, max_jobs, wait)
+
+    url = "%s/jobs/lease/?Secret=%s&UUID=%s&MaxJobs=%u" % (config.get("Server", "url"),
+                                                           config.get("Server", "secret"),
+                                                           config.get("Server", "uuid"),
+                                                           max_jobs)
+    if wait:
+        url += "&Wait=%g" % wait
+    url += _status_query(config, max_jobs)
+    timeout = config.getfloat("Server", "request_timeout") + wait
+
+    try:
+        result = client.request(config, url, timeout=timeout)
+        manifest = json.loads(result.body.decode('utf-8'))
+    except HTTPError as e:
+        if e.code == 404:
+            logger.debug("Job leasing not supported by the server, fetching single job.")
+            job = fetch_job(config, wait, max_jobs)
+            return [job] if job else []
+        logger.error("Error while contacting {0}: {1}".format(url, str(e)))
+        return []
+    except (URLError, ValueError) as e:
+        logger.error("Error while contacting {0}: {1}".format(url, str(e)))
+        return []
+
+    if not compatible_api_version(manifest["api_version"]):
+        # No proper reporting possible, so only logging.
+        logger.error("Incompatible API version. Please update OpenSubmit.")
+        return []
+
+    if manifest["action"] == "get_config":
+        logger.info("Machine unknown on server, sending registration ...")
+        send_hostinfo(config)
+        return []
+
+    _remember_max_wait(config, manifest.get("max_wait"))
+
+    return _jobs_from_manifest(config, manifest["jobs"])
+
+
+def _fetch_jobs_v2(config, max_jobs, wait=0):
+    '''
+    Lease up to max_jobs jobs with the v2 API,
+    and return a list of according job objects.
+    '''
+    timeout = config.getfloat("Server", "request_timeout") + wait
+    try:
+        answer = post_json(config, "/api/v2/lease/",
+                           {'max_jobs': max_jobs, 'wait': wait,
+                            'status': current_status(config, max_jobs)}, timeout=timeout)
+    except URLError as e:
+        logger.error("Error while leasing jobs: {0}".format(str(e)))
+        return []
+
+    if answer.get('error') == 'unknown_machine':
+        logger.info("Machine unknown on server, sending registration ...")
+        send_hostinfo(config)
+        return []
+    elif 'error' in answer:
+        logger.error("Server rejected the job request: {0}".format(answer['message']))
+        return []
+
+    _remember_max_wait(config, answer.get("max_wait"))
+    return _jobs_from_manifest(config, answer["jobs"])
+
+
+def _jobs_from_manifest(config, entries):
+    '''
+    Create job objects from the job descriptions of the server,
+    download the submissions and prepare the working directories.
+    '''
+    if not entries:
+        logger.debug("Nothing to do.")
+
+    from .job import Job
+    jobs = []
+    for entry in entries:
+        job = Job(config)
+        for attribute in MANIFEST_JOB_ATTRIBUTES:
+            setattr(job, attribute, entry[attribute])
+        job.lease_id = entry.get("lease_id")
+        job.file_id = str(entry["file_id"])
+        job.sub_id = str(entry["sub_id"])
+        job.working_dir = create_working_dir(config, job.sub_id)
+        try:
+            with timed(job._timings, 'fetch'), open(job.working_dir + job.file_name, 'wb') as target:
+                client.request(config, entry["download_url"], target=target)
+            job = _prepare_job(config, job)
+        except (HTTPError, URLError) as e:
+            # The lease runs into the timeout on the server side
+            logger.error("Error while fetching job {0}: {1}".format(job.file_id, str(e)))
+            continue
+        if job:
+            jobs.append(job)
+    return jobs
 
 
 def fake_fetch_job(config, src_dir):
@@ -0,0 +1,174 @@
+'''
+    Durable delivery of job results.
+
+    Results are stored in a local spool directory before they are
+    sent to the server, and only removed after the server got them.
+    When the server is not reachable, the delivery is repeated with
+    exponential backoff. Pending results are then sent in batches,
+    as soon as the server is back.
+'''
+
+import os
+import json
+import time
+import fcntl
+import tempfile
+from urllib.error import HTTPError, URLError
+
+from . import client
+from .server import post_json, use_api_v2
+
+import logging
+logger = logging.getLogger('opensubmitexec')
+
+# Maximum number of results sent in one v2 request
+BATCH_SIZE = 50
+
+
+class ResultSpool():
+    '''
+    A directory of pending results, one JSON file per result.
+
+    The file names start with the creation time, so that results
+    are delivered in their original order. Only one process (or thread)
+    at a time delivers results, guarded by a lock file in the directory.
+    '''
+    config = None
+    directory = None
+
+    def __init__(self, config):
+        self.config = config
+        self.directory = config.get("Execution", "spool_dir")
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _write(self, fname, entry):
+        handle, tmpname = tempfile.mkstemp(dir=self.directory, prefix='.')
+        with os.fdopen(handle, 'w') as f:
+            json.dump(entry, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmpname, os.path.join(self.directory, fname))
+
+    def put(self, file_id, post_data=None, result=None):
+        '''
+        Store a result for delivery, as post_data for the 1.x protocol
+        and, for jobs leased with the v2 API, as result dictionary.
+        The v2 form is used if the server still supports it.
+        '''
+        entry = {'url': self.config.get("Server", "url"),
+                 'file_id': file_id,
+                 'post_data': post_data,
+                 'result': result,
+                 'attempts': 0,
+                 'next_try': 0}
+        fname = '%.6f-%s-%u.json' % (time.time(), file_id, os.getpid())
+        self._write(fname, entry)
+        logger.debug("Spooled result for submission file {0} as {1}".format(file_id, fname))
+
+    def pending(self):
+        '''
+        List of (file name, entry) tuples for all results waiting for delivery
+        to the configured server, in the order of their creation.
+        '''
+        url = self.config.get("Server", "url")
+        result = []
+        for fname in sorted(os.listdir(self.directory)):
+            if fname.startswith('.') or not fname.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, fname)) as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                # Removed by a parallel delivery
+                continue
+            if entry['url'] == url:
+                result.append((fname, entry))
+        return result
+
+    def _remove(self, fname):
+        try:
+            os.remove(os.path.join(self.directory, fname))
+        except FileNotFoundError:
+            pass
+
+    def _postpone(self, pending):
+        '''
+        Schedule the next delivery attempt for the given entries.
+        '''
+        delay = self.config.getfloat("Execution", "spool_retry_delay")
+        max_delay = self.config.getfloat("Execution", "spool_retry_max")
+        for fname, entry in pending:
+            entry['attempts'] += 1
+            entry['next_try'] = time.time() + min(delay * 2 ** (entry['attempts'] - 1), max_delay)
+            self._write(fname, entry)
+        logger.info("Could not deliver {0} result(s), trying again later.".format(len(pending)))
+
+    def _deliver_v1(self, fname, entry):
+        '''
+        Send a single result with the 1.x protocol.
+        Returns False if the server was not reachable.
+        '''
+        try:
+            # JSON has no tuples
+            post_data = [tuple(item) for item in entry['post_data']]
+            client.request(self.config, entry['url'] + "/jobs/", data=post_data)
+        except HTTPError as e:
+            if e.code < 500:
+                logger.error("Server rejected the result for submission file {0}: {1}".format(entry['file_id'], str(e)))
+            else:
+                return False
+        except URLError as e:
+            logger.error('Error while sending result to server: ' + str(e))
+            return False
+        self._remove(fname)
+        return True
+
+    def _deliver_v2(self, batch):
+        '''
+        Send a batch of results with the v2 API.
+        Returns False if the server was not reachable.
+        '''
+        try:
+            answer = post_json(self.config, "/api/v2/results/",
+                               {'results': [entry['result'] for fname, entry in batch]})
+        except URLError as e:
+            logger.error('Error while sending results to server: ' + str(e))
+            return False
+        if answer.get('error') and answer['error'] != 'bad_request':
+            logger.error('Server rejected the results: ' + answer['message'])
+            return False
+        for (fname, entry), status in zip(batch, answer.get('results', [])):
+            if status['status'] != 'stored':
+                logger.warning("Result for submission file {0} was not stored: {1}".format(
+                    entry['file_id'], status['status']))
+        for fname, entry in batch:
+            self._remove(fname)
+        return True
+
+    def flush(self, force=False):
+        '''
+        Deliver all pending results that are due, or all of them with force.
+        Stops at the first delivery problem, since the server is probably down.
+
+        Returns the number of results that are still pending.
+        '''
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            # Wait for deliveries of other jobs, so that
+            # no result is sent twice
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            pending = self.pending()
+            due = [(fname, entry) for fname, entry in pending
+                   if force or entry['next_try'] <= time.time()]
+            while due:
+                fname, entry = due[0]
+                if entry['result'] is not None and use_api_v2(self.config):
+                    batch = [item for item in due if item[1]['result'] is not None][:BATCH_SIZE]
+                    delivered = self._deliver_v2(batch)
+                else:
+                    batch = [due[0]]
+                    delivered = self._deliver_v1(fname, entry)
+                if not delivered:
+                    self._postpone(due)
+                    break
+                due = [item for item in due if item not in batch]
+            return len(self.pending())
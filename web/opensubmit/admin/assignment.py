@@ -109,6 +109,8 @@ def view_links(obj):
     result+=format_html('<a href="%s" style="white-space: nowrap">Show duplicates</a><br/>'%reverse('duplicates', args=(obj.pk,)))
     result+=format_html('<a href="%s" style="white-space: nowrap">Show submissions</a><br/>'%obj.grading_url())
     result+=format_html('<a href="%s" style="white-space: nowrap">Download submissions</a>'%reverse('assarchive', args=(obj.pk,)))
+    if obj.has_perf_results():
+        result+=format_html('<br/><a href="%s" style="white-space: nowrap">Download performance data</a>'%reverse('assperfdata', args=(obj.pk,)))
     return result
 view_links.short_description = ""
 
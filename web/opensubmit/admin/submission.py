@@ -7,7 +7,8 @@ from django.shortcuts import redirect
 from django.utils.safestring import mark_safe
 from django.http import HttpResponse
 from django.utils.html import format_html
-from opensubmit.models import Assignment, Submission, Grading
+from opensubmit.models import Assignment, Submission, Grading, SubmissionTestResult
+from opensubmit.views.helpers import perf_data_response
 from django.utils import timesince
 
 import io
@@ -117,7 +118,7 @@ class SubmissionAdmin(ModelAdmin):
     list_filter = (SubmissionStateFilter, SubmissionCourseFilter,
                    SubmissionAssignmentFilter)
     filter_horizontal = ('authors',)
-    actions = ['downloadArchiveAction', 'setInitialStateAction', 'setFullPendingStateAction', 'setGradingNotFinishedStateAction',
+    actions = ['downloadArchiveAction', 'setInitialStateAction', 'setFullPendingStateAction', 'forgetTestResultsAction', 'setGradingNotFinishedStateAction',
                'setGradingFinishedStateAction', 'closeAndNotifyAction', 'sendMailAction', 'notifyAction', 'getPerformanceResultsAction']
     search_fields = ['=id', '=authors__email', '=authors__first_name',
                      '=authors__last_name', '=authors__username', '=notes']
@@ -301,6 +302,19 @@ class SubmissionAdmin(ModelAdmin):
                 request, "Changed status of %u submissions." % numchanged)
     setFullPendingStateAction.short_description = "Re-run full test for selected submissions (student invisible)"
 
+    def forgetTestResultsAction(self, request, queryset):
+        '''
+            Identical submission files get the earlier test result, as long as the validator is unchanged.
+            This action stops the reuse of the existing results for the selected submissions,
+            so that the next test run is really performed by an executor.
+        '''
+        checksums = queryset.exclude(file_upload__sha1__isnull=True).values_list('file_upload__sha1', flat=True)
+        numchanged = SubmissionTestResult.objects.filter(
+            submission_file__sha1__in=list(checksums)).exclude(validator_hash__isnull=True).update(validator_hash=None)
+        self.message_user(
+            request, "%u test results will no longer be reused." % numchanged)
+    forgetTestResultsAction.short_description = "Force real executor runs on next re-test of selected submissions"
+
     def closeAndNotifyAction(self, request, queryset):
         ''' Close all submissions were the tutor sayed that the grading is finished,
             and inform the student. CLosing only graded submissions is a safeguard,
@@ -348,16 +362,11 @@ class SubmissionAdmin(ModelAdmin):
         return response
     downloadArchiveAction.short_description = "Download selected submissions as ZIP archive"
 
-    # ToDo: Must be refactored to consider new performance data storage model
-    # def getPerformanceResultsAction(self, request, queryset):
-    #     qs = queryset.exclude(state=Submission.WITHDRAWN)  # avoid accidental addition of withdrawn solutions
-    #     response = HttpResponse(content_type="text/csv")
-    #     response.write("Submission ID;Course;Assignment;Authors;Performance Data\n")
-    #     for subm in qs:
-    #         if subm.file_upload and subm.file_upload.perf_data is not None:
-    #             auth = ", ".join([author.get_full_name() for author in subm.authors.all()])
-    #             response.write("%u;%s;%s;%s;" % (subm.pk, course(subm), subm.assignment, auth))
-    #             response.write(subm.file_upload.perf_data)
-    #             response.write("\n")
-    #     return response
-    # getPerformanceResultsAction.short_description = "Download performance data as CSV"
+    def getPerformanceResultsAction(self, request, queryset):
+        '''
+        Download the benchmark results of the selected submissions as CSV file.
+        '''
+        qs = queryset.exclude(state=Submission.WITHDRAWN)  # avoid accidental addition of withdrawn solutions
+        qs = qs.filter(file_upload__isnull=False).order_by('assignment', 'pk')
+        return perf_data_response(qs, 'perf_data.csv')
+    getPerformanceResultsAction.short_description = "Download performance data as CSV"
@@ -59,6 +59,12 @@ DATABASE_PORT: {database_port}
 # Change it, the value does not matter.
 SHARED_SECRET: 49846zut93purfh977TTTiuhgalkjfnk89
 
+# Policy for choosing the next job for an executor.
+# FairScheduler: Validity tests first, fair share between courses and assignments,
+#                closest deadline first, oldest submission first.
+# FifoScheduler: Validity tests first, oldest submission first.
+#SCHEDULER: opensubmit.scheduling.FairScheduler
+
 [admin]
 ADMIN_NAME: {admin_email}
 ADMIN_EMAIL: {admin_email}
@@ -312,6 +318,7 @@ def console_script(fsroot=''):
     parser_apachecreate = subparsers.add_parser('apachecreate', help='Create config file snippet for Apache 2.4.')
     parser_fixperms = subparsers.add_parser('fixperms', help='Check and fix student and tutor permissions.')
     parser_fixchecksums = subparsers.add_parser('fixchecksums', help='Re-create all student file checksums (for duplicate detection).')
+    parser_reapjobs = subparsers.add_parser('reapjobs', help='Mark test jobs as failed when the executor did not answer in time.')
 
     parser_makeadmin = subparsers.add_parser('makeadmin', help='Make this user an admin with backend rights.')
     parser_makeadmin.add_argument('email')
@@ -339,7 +346,7 @@ def console_script(fsroot=''):
         configtest(config_file)
         return
 
-    if args.command in ['fixperms', 'fixchecksums', 'democreate']:
+    if args.command in ['fixperms', 'fixchecksums', 'democreate', 'reapjobs']:
         django_admin([args.command])
         return
 
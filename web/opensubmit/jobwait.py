@@ -0,0 +1,25 @@
+'''
+    Process-local notification about new pending test jobs.
+
+    Long-polling executor requests wait for this notification,
+    so that jobs created in the same server process are delivered
+    immediately. Jobs created in other server processes are found
+    by the periodic database check of the waiting request.
+'''
+
+import threading
+
+_new_jobs = threading.Condition()
+
+
+def notify_new_job():
+    with _new_jobs:
+        _new_jobs.notify_all()
+
+
+def wait_for_new_job(timeout):
+    '''
+    Returns False if the timeout expired without notification.
+    '''
+    with _new_jobs:
+        return _new_jobs.wait(timeout)
@@ -1,4 +1,4 @@
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
 from django.core.urlresolvers import reverse
 
 from opensubmit import settings
@@ -35,14 +35,12 @@ for "%s" in "%s" was finalized.
 Further information can be found at %s.'''
 
 
-def inform_student(submission, state):
+def _student_message(submission, state):
     '''
     Create an email message for the student,
     based on the given submission state.
 
-    Sending eMails on validation completion does
-    not work, since this may have been triggered
-    by the admin.
+    Returns None if there is nothing to tell.
     '''
     details_url = settings.MAIN_URL + reverse('details', args=(submission.pk,))
 
@@ -64,7 +62,7 @@ def inform_student(submission, state):
                              submission.assignment.course,
                              details_url)
     else:
-        return
+        return None
 
     subject = "[%s] %s" % (submission.assignment.course, subject)
     from_email = submission.assignment.course.owner.email
@@ -74,5 +72,30 @@ def inform_student(submission, state):
     # TODO: This might be configurable later
     # email = EmailMessage(subject, message, from_email, recipients,
     # [self.assignment.course.owner.email])
-    email = EmailMessage(subject, message, from_email, recipients)
-    email.send(fail_silently=True)
+    return EmailMessage(subject, message, from_email, recipients)
+
+
+def inform_student(submission, state):
+    '''
+    Send an email message to the student,
+    based on the given submission state.
+
+    Sending eMails on validation completion does
+    not work, since this may have been triggered
+    by the admin.
+    '''
+    email = _student_message(submission, state)
+    if email:
+        email.send(fail_silently=True)
+
+
+def inform_students(submissions, state):
+    '''
+    Like inform_student, but for a batch of submissions
+    that all reached the same state.
+    All messages are sent over one mail server connection.
+    '''
+    messages = [_student_message(submission, state) for submission in submissions]
+    messages = [email for email in messages if email]
+    if messages:
+        get_connection(fail_silently=True).send_messages(messages)
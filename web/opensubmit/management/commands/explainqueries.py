@@ -0,0 +1,138 @@
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from opensubmit.models import Course, Assignment, Submission, SubmissionFile, SubmissionTestResult, TestMachine
+from opensubmit.scheduling import DISPATCH_LOOKAHEAD, FairScheduler, FifoScheduler
+from opensubmit.views.api import _fetchable_submissions
+
+
+class Rollback(Exception):
+    pass
+
+
+def hot_queries():
+    '''
+    The frequently used queries, as list of (description, queryset) tuples.
+    '''
+    some_file = SubmissionFile.objects.order_by('-pk').first()
+    some_machine = TestMachine.objects.order_by('-pk').first()
+    return [
+        ('Scheduled jobs for an executor (_fetchable_submissions)',
+         _fetchable_submissions(some_machine)[:1 + DISPATCH_LOOKAHEAD] if some_machine else Submission.objects.none()),
+        ('Fair job order (FairScheduler)',
+         FairScheduler().order(Submission.pending_tests.filter(file_upload__fetched__isnull=True))[:20]),
+        ('Oldest jobs first (FifoScheduler)',
+         FifoScheduler().order(Submission.pending_tests.filter(file_upload__fetched__isnull=True))[:20]),
+        ('Pending tests (PendingTestsManager)',
+         Submission.pending_tests.all()[:20]),
+        ('Fetchable jobs',
+         Submission.pending_tests.filter(file_upload__isnull=False,
+                                         file_upload__fetched__isnull=True)[:20]),
+        ('Leased jobs (reaper)',
+         Submission.pending_tests.filter(file_upload__fetched__isnull=False)),
+        ('Valid files by checksum (duplicate_files)',
+         SubmissionFile.valid_ones.order_by('md5')),
+        ('Latest test result (_get_test_result)',
+         SubmissionTestResult.objects.filter(submission_file=some_file,
+                                             kind=SubmissionTestResult.VALIDITY_TEST).order_by('-created')[:1]),
+        ('Files with identical content (result reuse)',
+         SubmissionFile.objects.filter(sha1=some_file.sha1 if some_file else '')),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Shows query plans and timings for the frequently used database queries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Number of submissions to create before, removed again afterwards.')
+        parser.add_argument('--runs', type=int, default=5,
+                            help='Number of runs per query for the timing.')
+
+    def seed(self, count):
+        '''
+        Create submissions with files and test results in bulk.
+        Most of them are finished, some are waiting for tests,
+        a few are fetched by an executor right now.
+        '''
+        print("Creating %u submissions ..." % count)
+        user = User.objects.create(username='explainqueries-seed')
+        course = Course.objects.create(title='Seed course', owner=user, homepage='http://example.org')
+        assignment = Assignment.objects.create(title='Seed assignment', course=course)
+        machine = TestMachine.objects.create(host='explainqueries-seed')
+        assignment.test_machines.add(machine)
+        now = datetime.now()
+        states = [Submission.CLOSED] * 90 + [Submission.SUBMITTED_TESTED] * 6 + \
+                 [Submission.TEST_VALIDITY_PENDING, Submission.TEST_FULL_PENDING,
+                  Submission.TEST_VALIDITY_FAILED, Submission.WITHDRAWN]
+        for start in range(0, count, 5000):
+            size = min(5000, count - start)
+            files = SubmissionFile.objects.bulk_create([
+                SubmissionFile(attachment='seed/%u.zip' % (start + i),
+                               md5='%032x' % random.getrandbits(128),
+                               sha1='%040x' % random.getrandbits(160),
+                               fetched=now if random.random() < 0.001 else None)
+                for i in range(size)])
+            if connection.features.can_return_ids_from_bulk_insert:
+                file_ids = [f.pk for f in files]
+            else:
+                file_ids = list(SubmissionFile.objects.filter(attachment__startswith='seed/')
+                                .order_by('-pk').values_list('pk', flat=True)[:size])
+            Submission.objects.bulk_create([
+                Submission(assignment=assignment, submitter=user, file_upload_id=file_id,
+                           state=random.choice(states))
+                for file_id in file_ids])
+            # 'modified' is overwritten on insert, so it is spread afterwards
+            random.shuffle(file_ids)
+            for group in range(100):
+                Submission.objects.filter(file_upload_id__in=file_ids[group::100]) \
+                                  .update(modified=now - timedelta(minutes=random.randint(0, 500000)))
+            SubmissionTestResult.objects.bulk_create([
+                SubmissionTestResult(submission_file_id=file_id, machine=machine, kind=kind, result='seed')
+                for file_id in file_ids
+                for kind in [SubmissionTestResult.VALIDITY_TEST, SubmissionTestResult.FULL_TEST]])
+        if connection.vendor == 'sqlite':
+            # Statistics for the query planner
+            connection.cursor().execute('ANALYZE')
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' '.join([str(column) for column in row]) for row in cursor.fetchall()]
+
+    def measure(self, queryset, runs):
+        durations = []
+        for run in range(runs):
+            started = time.perf_counter()
+            list(queryset._clone())
+            durations.append(time.perf_counter() - started)
+        return statistics.median(durations)
+
+    def report(self, runs):
+        print("%u submissions, %u files, %u test results in the database (%s)." % (
+            Submission.objects.count(), SubmissionFile.objects.count(),
+            SubmissionTestResult.objects.count(), connection.vendor))
+        for description, queryset in hot_queries():
+            print()
+            print("%s: %.2f ms (median of %u runs)" % (description, self.measure(queryset, runs) * 1000, runs))
+            for line in self.explain(queryset):
+                print("    " + line)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    self.seed(options['seed'])
+                self.report(options['runs'])
+                if options['seed']:
+                    # Remove the seeded data again
+                    raise Rollback()
+        except Rollback:
+            pass
@@ -0,0 +1,8 @@
+from django.core.management.base import BaseCommand
+from opensubmit.reaper import reap_expired_jobs
+
+class Command(BaseCommand):
+    help = 'Marks test jobs as failed when the executor did not answer in time'
+    def handle(self, *args, **options):
+        count = reap_expired_jobs()
+        print("%u expired test job(s) marked as failed."%count)
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 06:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opensubmit', '0036_result_reuse'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='submission',
+            index=models.Index(fields=['state', 'modified'], name='submission_state_modified'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionfile',
+            index=models.Index(fields=['fetched'], name='subfile_fetched'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionfile',
+            index=models.Index(fields=['replaced_by', 'md5'], name='subfile_replaced_md5'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionfile',
+            index=models.Index(fields=['sha1'], name='subfile_sha1'),
+        ),
+        migrations.AddIndex(
+            model_name='submissiontestresult',
+            index=models.Index(fields=['submission_file', 'kind', 'created'], name='result_file_kind_created'),
+        ),
+    ]
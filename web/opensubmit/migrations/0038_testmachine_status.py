@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('opensubmit', '0037_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='testmachine',
+            name='status_report',
+            field=models.TextField(editable=False, help_text='Last status reported by the executor, in JSON format.', null=True),
+        ),
+        migrations.AddField(
+            model_name='testmachine',
+            name='status_time',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
@@ -8,11 +8,16 @@ from .submissionfile import SubmissionFile
 from .submissiontestresult import SubmissionTestResult
 
 import os
+import hashlib
 from itertools import groupby
 
 import logging
 logger = logging.getLogger('OpenSubmit')
 
+# Content hashes of validator scripts, by file path.
+# Each entry is only valid for the file modification time and size stored with it.
+_script_hashes = {}
+
 
 class Assignment(models.Model):
     '''
@@ -117,6 +122,44 @@ class Assignment(models.Model):
         else:
             return None
 
+    def _script_hash(self, script):
+        '''
+            The hash is needed several times per executor job,
+            so the file is only read again when it was changed.
+        '''
+        path = script.path
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = _script_hashes.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                sha.update(chunk)
+        _script_hashes[path] = (version, sha.hexdigest())
+        return sha.hexdigest()
+
+    def validity_test_hash(self):
+        '''
+            Return the content hash of the validity test script,
+            which allows executors to cache it.
+        '''
+        if self.has_validity_test():
+            return self._script_hash(self.attachment_test_validity)
+        else:
+            return None
+
+    def full_test_hash(self):
+        '''
+            Return the content hash of the full test script,
+            which allows executors to cache it.
+        '''
+        if self.has_full_test():
+            return self._script_hash(self.attachment_test_full)
+        else:
+            return None
+
     def url(self):
         '''
             Return absolute URL for assignment description.
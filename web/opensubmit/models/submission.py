@@ -42,7 +42,7 @@ class PendingStudentTestsManager(models.Manager):
 
     def get_queryset(self):
         jobs = Submission.objects.filter(
-            state=Submission.TEST_VALIDITY_PENDING).order_by('-modified')
+            state=Submission.TEST_VALIDITY_PENDING).order_by('modified')
         return jobs
 
 
@@ -59,7 +59,7 @@ class PendingFullTestsManager(models.Manager):
         jobs = Submission.objects.filter(
             state__in=[Submission.TEST_FULL_PENDING,
                        Submission.CLOSED_TEST_FULL_PENDING]
-        ).order_by('-state').order_by('-modified')
+        ).order_by('-state', 'modified')
         return jobs
 
 
@@ -73,7 +73,7 @@ class PendingTestsManager(models.Manager):
             state__in=[Submission.TEST_FULL_PENDING,           # PF
                        Submission.CLOSED_TEST_FULL_PENDING,    # CT
                        Submission.TEST_VALIDITY_PENDING]      # PV
-        ).order_by('-state').order_by('-modified')
+        ).order_by('-state', 'modified')
         return jobs
 
 
@@ -215,6 +215,10 @@ class Submission(models.Model):
 
     class Meta:
         app_label = 'opensubmit'
+        indexes = [
+            # Pending test managers and the scheduler
+            models.Index(fields=['state', 'modified'], name='submission_state_modified'),
+        ]
 
     @staticmethod
     def qs_valid(qs):
@@ -504,13 +508,15 @@ class Submission(models.Model):
         # this implies that the Apache media serving is disabled
         return reverse('submission_grading_file', args=(self.pk,))
 
-    def _save_test_result(self, machine, text_student, text_tutor, kind, perf_data):
+    def _save_test_result(self, machine, text_student, text_tutor, kind, perf_data, validator_hash, error_code):
         result = SubmissionTestResult(
             result=text_student,
             result_tutor=text_tutor,
             machine=machine,
             kind=kind,
             perf_data=perf_data,
+            validator_hash=validator_hash,
+            error_code=error_code,
             submission_file=self.file_upload)
         result.save()
 
@@ -520,24 +526,35 @@ class Submission(models.Model):
         except:
             return None
 
-    def save_fetch_date(self):
-        SubmissionFile.objects.filter(
-            pk=self.file_upload.pk).update(fetched=datetime.now())
+    def save_fetch_date(self, machine=None):
+        '''
+            Mark the submission file as fetched by the given test machine.
+
+            This is a conditional update in the database, so that only one
+            of several parallel executor requests can fetch the file.
+            Returns the fetch date, or None if the file was already fetched.
+        '''
+        fetched = datetime.now()
+        if SubmissionFile.objects.filter(pk=self.file_upload_id, fetched__isnull=True) \
+                                 .update(fetched=fetched, fetched_by=machine):
+            return fetched
+        else:
+            return None
 
     def get_fetch_date(self):
         return self.file_upload.fetched
 
     def clean_fetch_date(self):
         SubmissionFile.objects.filter(
-            pk=self.file_upload.pk).update(fetched=None)
+            pk=self.file_upload.pk).update(fetched=None, fetched_by=None)
 
-    def save_validation_result(self, machine, text_student, text_tutor, perf_data=None):
+    def save_validation_result(self, machine, text_student, text_tutor, perf_data=None, validator_hash=None, error_code=None):
         self._save_test_result(
-            machine, text_student, text_tutor, SubmissionTestResult.VALIDITY_TEST, perf_data)
+            machine, text_student, text_tutor, SubmissionTestResult.VALIDITY_TEST, perf_data, validator_hash, error_code)
 
-    def save_fulltest_result(self, machine, text_tutor, perf_data=None):
+    def save_fulltest_result(self, machine, text_tutor, perf_data=None, validator_hash=None, error_code=None):
         self._save_test_result(
-            machine, None, text_tutor, SubmissionTestResult.FULL_TEST, perf_data)
+            machine, None, text_tutor, SubmissionTestResult.FULL_TEST, perf_data, validator_hash, error_code)
 
     def get_validation_result(self):
         '''
@@ -551,6 +568,21 @@ class Submission(models.Model):
         '''
         return self._get_test_result(SubmissionTestResult.FULL_TEST)
 
+    def perf_data_rows(self):
+        '''
+            Return the performance data from the most recent test results
+            as list of CSV rows, one per line of performance data.
+        '''
+        rows = []
+        authors = ", ".join([author.get_full_name() for author in self.authors.all()])
+        for result in [self.get_validation_result(), self.get_fulltest_result()]:
+            if result and result.perf_data:
+                for line in result.perf_data.splitlines():
+                    if line.strip():
+                        rows.append([self.pk, str(self.assignment.course), str(self.assignment),
+                                     authors, result.get_kind_display()] + line.split(';'))
+        return rows
+
     def inform_student(self, state):
         '''
             We hand-in explicitely about which new state we want to inform,
@@ -42,20 +42,34 @@ class SubmissionFile(models.Model):
         The "fetched" field defines the time stamp when the file was fetched for
         checking by some executor. On result retrieval, this timestamp is emptied
         again, which allows to find 'stucked' executor jobs on the server side.
+        The "fetched_by" field stores the test machine that fetched it.
         The "md5" field keeps a checksum of the file upload, for duplicate detection.
+        The "sha1" field keeps an exact checksum of the file upload, for the reuse of test results.
     '''
 
     attachment = models.FileField(
         upload_to=upload_path, verbose_name="File upload")
     original_filename = models.CharField(max_length=255, default='student.upload')
     fetched = models.DateTimeField(editable=False, null=True)
+    fetched_by = models.ForeignKey(
+        'TestMachine', null=True, blank=True, editable=False, on_delete=models.SET_NULL, related_name='+')
     replaced_by = models.ForeignKey(
         'SubmissionFile', null=True, blank=True, editable=False)
     md5 = models.CharField(max_length=36, null=True,
                            blank=True, editable=False)
+    sha1 = models.CharField(max_length=40, null=True,
+                            blank=True, editable=False)
 
     class Meta:
         app_label = 'opensubmit'
+        indexes = [
+            # Job fetching and lease expiry
+            models.Index(fields=['fetched'], name='subfile_fetched'),
+            # ValidSubmissionFileManager, ordered by checksum for duplicate detection
+            models.Index(fields=['replaced_by', 'md5'], name='subfile_replaced_md5'),
+            # Result reuse
+            models.Index(fields=['sha1'], name='subfile_sha1'),
+        ]
 
     def __str__(self):
         return self.attachment.name
@@ -116,6 +130,20 @@ class SubmissionFile(models.Model):
             ''.join(sorted(md5_set)).encode('utf-8')).hexdigest()
         return result
 
+    def attachment_sha1(self):
+        '''
+            Calculate the exact checksum of the file upload.
+            In contrast to attachment_md5(), every byte counts here.
+        '''
+        sha = hashlib.sha1()
+        try:
+            for chunk in self.attachment.chunks():
+                sha.update(chunk)
+        except Exception as e:
+            logger.warning("Exception on SHA1 computation: " + str(e))
+            return None
+        return sha.hexdigest()
+
     def basename(self):
         return self.attachment.name[self.attachment.name.rfind('/') + 1:]
 
@@ -135,6 +163,13 @@ class SubmissionFile(models.Model):
     def absolute_path(self):
         return settings.MEDIA_ROOT + "/" + self.attachment.name
 
+    def executor_url(self):
+        '''
+            Return absolute download URL of the file for the executors.
+            Using reverse() seems to be broken with FORCE_SCRIPT in use, so we use direct URL formulation.
+        '''
+        return settings.MAIN_URL + "/download/%u/submission_file/secret=%s" % (self.pk, settings.JOB_EXECUTOR_SECRET)
+
     def is_executed(self):
         return self.fetched is not None
 
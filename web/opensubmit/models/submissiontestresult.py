@@ -18,6 +18,13 @@ class SubmissionTestResult(models.Model):
     result_tutor = models.TextField(null=True, blank=True)
     kind = models.CharField(max_length=2, choices=JOB_TYPES)
     perf_data = models.TextField(null=True, blank=True)
+    # Content hash of the validator, results are only reused when it is set
+    validator_hash = models.CharField(max_length=40, null=True, blank=True, editable=False)
+    error_code = models.IntegerField(null=True, blank=True, editable=False)
 
     class Meta:
         app_label = 'opensubmit'
+        indexes = [
+            # Latest result of some kind for a submission file
+            models.Index(fields=['submission_file', 'kind', 'created'], name='result_file_kind_created'),
+        ]
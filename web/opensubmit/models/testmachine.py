@@ -1,6 +1,14 @@
 from django.db import models
+from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 
+import json
+from datetime import datetime, timedelta
+
+# Seconds until an executor status report is considered as outdated
+STATUS_TIMEOUT = 120
+
 
 class TestMachine(models.Model):
     name = models.CharField(null=True, blank=True, max_length=50, help_text="Human-readable name of this machine.")
@@ -8,6 +16,8 @@ class TestMachine(models.Model):
     last_contact = models.DateTimeField(editable=False, default=timezone.now)
     config = models.TextField(null=True, help_text="Host configuration in JSON format.")
     enabled = models.BooleanField(default=True, help_text="Test machines can be temporarily disabled for maintenance. All jobs are held back during that time.")
+    status_report = models.TextField(null=True, editable=False, help_text="Last status reported by the executor, in JSON format.")
+    status_time = models.DateTimeField(null=True, editable=False)
 
     class Meta:
         app_label = 'opensubmit'
@@ -17,3 +27,80 @@ class TestMachine(models.Model):
             return self.name
         else:
             return "Test Machine {0}".format(self.pk)
+
+    def _heartbeat_key(self):
+        return 'opensubmit-heartbeat-{0}'.format(self.pk)
+
+    def heartbeat(self, now=None):
+        '''
+        Remember a contact with this machine.
+
+        Executors poll frequently, so the contact time is only kept in the cache.
+        The database field is updated when it is older than the configured
+        heartbeat interval.
+        '''
+        now = now or datetime.now()
+        cache.set(self._heartbeat_key(), now, None)
+        if not self.last_contact or now - self.last_contact >= timedelta(seconds=settings.JOB_HEARTBEAT_INTERVAL):
+            TestMachine.objects.filter(pk=self.pk).update(last_contact=now)
+        self.last_contact = now
+
+    @property
+    def last_seen(self):
+        '''
+        The most recent contact with this machine, including
+        heartbeats not written to the database so far.
+        '''
+        cached = cache.get(self._heartbeat_key())
+        if cached and cached > self.last_contact:
+            return cached
+        return self.last_contact
+
+    def report_status(self, free_slots, load, free_disk, validators, now=None):
+        '''
+        Remember the current status reported by the executor on this machine:
+        the number of free job slots, the load average per CPU, the free disk
+        space in MB (None if unknown), and the content hashes of the cached validators.
+
+        The status is stored in the database, so that all web server processes
+        see it. Executors report it with each job request, so the database is
+        updated at most every JOB_STATUS_INTERVAL seconds, and only when the
+        status changed or is about to become outdated.
+
+        Raises ValueError or TypeError for invalid values.
+        '''
+        status = {'free_slots': int(free_slots),
+                  'load': round(float(load), 1),
+                  'free_disk': None if free_disk is None else int(free_disk),
+                  # Sorted, since the executor reports them in usage order
+                  'validators': sorted(str(entry) for entry in validators)}
+        now = now or datetime.now()
+        if self.status_time and now - self.status_time < timedelta(seconds=settings.JOB_STATUS_INTERVAL):
+            return
+        if status != self.status or now - self.status_time >= timedelta(seconds=STATUS_TIMEOUT / 2):
+            self.status_report = json.dumps(status)
+            self.status_time = now
+            TestMachine.objects.filter(pk=self.pk).update(status_report=self.status_report,
+                                                          status_time=self.status_time)
+
+    @property
+    def status(self):
+        '''
+        The last status reported by the executor, or None if it is outdated.
+        '''
+        if not self.status_report or datetime.now() - self.status_time >= timedelta(seconds=STATUS_TIMEOUT):
+            return None
+        return json.loads(self.status_report)
+
+    @staticmethod
+    def statuses(machines):
+        '''
+        The last reported status for each of the given machines,
+        as dictionary with the machine ID as key.
+        '''
+        result = {}
+        for machine in machines:
+            status = machine.status
+            if status:
+                result[machine.pk] = status
+        return result
@@ -0,0 +1,115 @@
+'''
+    Clean up of test jobs where the executor did not deliver
+    a result in time.
+
+    The reaper runs as 'reapjobs' management command, which can be
+    triggered by cron or a systemd timer, and additionally every
+    REAP_INTERVAL seconds on the executor job requests.
+'''
+
+from datetime import datetime, timedelta
+import time
+
+from opensubmit.models import Submission, SubmissionFile, SubmissionTestResult, TestMachine
+from opensubmit.mails import inform_students
+
+import logging
+logger = logging.getLogger('OpenSubmit')
+
+# Minimum time in seconds between two automatic runs in one server process
+REAP_INTERVAL = 30
+
+_last_run = 0
+
+
+def _expired_jobs(now):
+    '''
+    Fetched jobs where the test timeout expired, as list of tuples.
+    The expiry is checked in the database, separately for each timeout value in use.
+    '''
+    leased = Submission.pending_tests.filter(file_upload__fetched__isnull=False)
+    timeouts = leased.order_by().values_list('assignment__attachment_test_timeout', flat=True).distinct()
+    expired = []
+    for timeout in timeouts:
+        expired += leased.filter(assignment__attachment_test_timeout=timeout,
+                                 file_upload__fetched__lt=now - timedelta(seconds=timeout)) \
+                         .values_list('pk', 'state', 'assignment', 'file_upload',
+                                      'file_upload__fetched', 'file_upload__fetched_by',
+                                      'assignment__attachment_test_timeout')
+    return expired
+
+
+def reap_expired_jobs():
+    '''
+    Mark all fetched jobs where the test timeout expired as failed,
+    and inform the students about failed validations.
+
+    Executors may deliver a result at the same time. All updates are therefore
+    conditional on the database state that was read before, and only
+    jobs where the update succeeded get a 'killed' result and a mail.
+
+    Returns the number of expired jobs.
+    '''
+    now = datetime.now()
+    expired = _expired_jobs(now)
+    if not expired:
+        return 0
+
+    # Results are attributed to the machine that fetched the job. Jobs fetched
+    # before this was recorded get the first test machine of the assignment.
+    fallback_machines = dict(TestMachine.objects.filter(assignments__in=[job[2] for job in expired])
+                                                .order_by('-pk')
+                                                .values_list('assignments', 'pk'))
+
+    # Late results for these jobs are ignored by api.jobs when the job was fetched again by another machine.
+    results = []
+    validity_failed = []
+    reaped = 0
+    for pk, state, assignment, file_upload, fetched, fetched_by, timeout in expired:
+        if not SubmissionFile.objects.filter(pk=file_upload, fetched=fetched,
+                                             fetched__lt=now - timedelta(seconds=timeout)) \
+                                     .update(fetched=None, fetched_by=None):
+            # Result delivered in the meantime
+            continue
+        reaped += 1
+        logger.debug(
+            "Reset executor fetch status for submission %u, due to timeout" % pk)
+        machine = fetched_by or fallback_machines.get(assignment)
+        if state == Submission.TEST_VALIDITY_PENDING:
+            new_state = Submission.TEST_VALIDITY_FAILED
+            kind = SubmissionTestResult.VALIDITY_TEST
+            result = "Killed due to non-reaction. Please check your application for deadlocks or keyboard input."
+            result_tutor = "Killed due to non-reaction on timeout signals."
+        elif state == Submission.TEST_FULL_PENDING:
+            new_state = Submission.TEST_FULL_FAILED
+            kind = SubmissionTestResult.FULL_TEST
+            result = None
+            result_tutor = "Killed due to non-reaction on timeout signals. Student not informed, since this was the full test."
+        else:
+            # Closed submission, the full test is just tried again
+            continue
+        if not Submission.objects.filter(pk=pk, state=state).update(state=new_state, modified=now):
+            # Result processed in the meantime
+            continue
+        if new_state == Submission.TEST_VALIDITY_FAILED:
+            validity_failed.append(pk)
+        if machine:
+            results.append(SubmissionTestResult(submission_file_id=file_upload, machine_id=machine,
+                                                kind=kind, result=result, result_tutor=result_tutor))
+
+    SubmissionTestResult.objects.bulk_create(results)
+    inform_students(Submission.objects.filter(pk__in=validity_failed)
+                                      .select_related('assignment__course__owner'),
+                    Submission.TEST_VALIDITY_FAILED)
+    return reaped
+
+
+def reap_expired_jobs_if_due():
+    '''
+    Run the reaper, if the last run in this server process
+    is more than REAP_INTERVAL seconds ago.
+    '''
+    global _last_run
+    if time.time() - _last_run >= REAP_INTERVAL:
+        _last_run = time.time()
+        reap_expired_jobs()
@@ -0,0 +1,191 @@
+'''
+    Scheduling policies for the executor job queue.
+
+    A policy decides which pending submission is delivered next to an
+    executor, by ordering the queryset of fetchable submissions. The
+    policy in use is configured with the JOB_SCHEDULER setting, which
+    contains the dotted path of a Scheduler class.
+
+    The dispatcher then picks the jobs for a particular executor
+    out of this order, based on the status reported by the executor.
+'''
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+
+from django.db.models import Case, When, Value, IntegerField, Count, F, Q
+from django.utils.module_loading import import_string
+from django.conf import settings
+
+from opensubmit.models import Submission, TestMachine
+
+import logging
+logger = logging.getLogger('OpenSubmit')
+
+# Number of additional queued jobs considered when picking the best ones for a machine
+DISPATCH_LOOKAHEAD = 10
+
+# Seconds a new job is held back from a saturated machine, so that an idle one can take it
+IDLE_PREFERENCE = 10
+
+
+class Scheduler(ABC):
+    '''
+    Base class for scheduling policies.
+    '''
+
+    @abstractmethod
+    def order(self, submissions):
+        '''
+        Return the given Submission queryset in the order
+        the jobs should be delivered to the executors.
+        '''
+
+
+def _test_priority():
+    '''
+    Validity tests (students are waiting) before full tests,
+    re-runs of full tests for closed submissions last.
+    '''
+    return Case(When(state=Submission.TEST_VALIDITY_PENDING, then=Value(0)),
+                When(state=Submission.TEST_FULL_PENDING, then=Value(1)),
+                default=Value(2),
+                output_field=IntegerField())
+
+
+class FifoScheduler(Scheduler):
+    '''
+    Validity tests before full tests, oldest submissions first.
+    '''
+
+    def order(self, submissions):
+        return submissions.annotate(test_priority=_test_priority()) \
+                          .order_by('test_priority', 'modified')
+
+
+class FairScheduler(Scheduler):
+    '''
+    Validity tests before full tests. Inside of these classes:
+
+    - Courses and assignments with less jobs currently running on the
+      executors come first, so that one large course or assignment
+      cannot block the others.
+    - Assignments with the closest upcoming hard deadline come next,
+      then the ones without deadline or with a passed deadline.
+    - Oldest submissions first.
+    '''
+
+    def order(self, submissions):
+        deadline_passed = Case(When(Q(assignment__hard_deadline__isnull=True) |
+                                    Q(assignment__hard_deadline__lt=datetime.now()), then=Value(1)),
+                               default=Value(0),
+                               output_field=IntegerField())
+        return submissions.annotate(
+            test_priority=_test_priority(),
+            running_in_course=_running_jobs('assignment__course'),
+            running_in_assignment=_running_jobs('assignment'),
+            deadline_passed=deadline_passed
+        ).order_by('test_priority',
+                   'running_in_course',
+                   'running_in_assignment',
+                   'deadline_passed',
+                   F('assignment__hard_deadline').asc(nulls_last=True),
+                   'modified')
+
+
+def _running_jobs(field):
+    '''
+    Number of jobs currently running on the executors, per value of
+    the given Submission field, as expression for the ordering.
+
+    The running jobs are counted once up front, instead of a correlated
+    subquery for every pending submission. Their number is bounded by
+    the job slots of all executors, so the resulting CASE stays short.
+    '''
+    running = Submission.pending_tests.filter(file_upload__fetched__isnull=False).order_by()
+    counts = running.values_list(field).annotate(count=Count('pk'))
+    return Case(*[When(**{field: value, 'then': Value(count)}) for value, count in counts],
+                default=Value(0),
+                output_field=IntegerField())
+
+
+def get_scheduler():
+    '''
+    Return the configured scheduling policy.
+    '''
+    return import_string(settings.JOB_SCHEDULER)()
+
+
+def is_saturated(status):
+    '''
+    Check if the executor reported to have no capacity left.
+    '''
+    return status['free_slots'] < 1 or status['load'] >= 1
+
+
+def is_low_on_disk(status):
+    return status['free_disk'] is not None and status['free_disk'] < settings.JOB_MIN_FREE_DISK
+
+
+def _validator_hash(sub):
+    if sub.state == Submission.TEST_VALIDITY_PENDING:
+        return sub.assignment.validity_test_hash()
+    else:
+        return sub.assignment.full_test_hash()
+
+
+def _idle_machine_available(machine, assignment):
+    '''
+    Check if another machine responsible for the assignment
+    recently reported to be idle.
+    '''
+    others = assignment.test_machines.filter(enabled=True).exclude(pk=machine.pk)
+    for status in TestMachine.statuses(others).values():
+        if not is_saturated(status) and not is_low_on_disk(status):
+            return True
+    return False
+
+
+def dispatch(machine, submissions, count):
+    '''
+    Pick up to 'count' jobs for the given machine from the
+    scheduler-ordered queryset of fetchable submissions.
+
+    Without a status report of the executor, the scheduler order is used as it is.
+    Otherwise:
+
+    - Machines low on disk space get no jobs.
+    - Saturated machines do not get new jobs that an idle machine could run,
+      unless the job waits for more than IDLE_PREFERENCE seconds.
+    - Among the next jobs of the same test priority, the ones with a validator
+      already cached on the machine come first.
+    '''
+    status = machine.status
+    if not status:
+        return list(submissions[:count])
+    if is_low_on_disk(status):
+        logger.debug("Test machine %s is low on disk space, holding back jobs." % machine)
+        return []
+
+    candidates = list(submissions.select_related('assignment')[:count + DISPATCH_LOOKAHEAD])
+    if is_saturated(status):
+        recent = datetime.now() - timedelta(seconds=IDLE_PREFERENCE)
+        idle_available = {}
+        for sub in candidates:
+            if sub.assignment_id not in idle_available:
+                idle_available[sub.assignment_id] = _idle_machine_available(machine, sub.assignment)
+        candidates = [sub for sub in candidates
+                      if not (sub.modified and sub.modified > recent and idle_available[sub.assignment_id])]
+
+    cached = set(status['validators'])
+    if cached:
+        # Hashes are memoized per validator file, so this
+        # only costs one stat() call per assignment
+        hashes = {}
+        for sub in candidates:
+            key = (sub.assignment_id, sub.state)
+            if key not in hashes:
+                hashes[key] = _validator_hash(sub)
+        candidates.sort(key=lambda sub: (getattr(sub, 'test_priority', 0),
+                                         hashes[(sub.assignment_id, sub.state)] not in cached))
+    return candidates[:count]
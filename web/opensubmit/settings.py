@@ -333,6 +333,28 @@ SOCIAL_AUTH_PIPELINE = (
 JOB_EXECUTOR_SECRET = config.get("executor", "SHARED_SECRET")
 assert(JOB_EXECUTOR_SECRET is not "")
 
+# Policy for choosing the next executor job, see scheduling.py
+JOB_SCHEDULER = 'opensubmit.scheduling.FairScheduler'
+if config.has_option("executor", "SCHEDULER"):
+    JOB_SCHEDULER = config.get("executor", "SCHEDULER")
+
+# Maximum age in seconds of the last executor contact stored in the database,
+# more recent heartbeats are only kept in the cache
+JOB_HEARTBEAT_INTERVAL = 60
+if config.has_option("executor", "HEARTBEAT_INTERVAL"):
+    JOB_HEARTBEAT_INTERVAL = config.getint("executor", "HEARTBEAT_INTERVAL")
+
+# Minimum age in seconds of the stored executor status before
+# a changed status report is written to the database again
+JOB_STATUS_INTERVAL = 10
+if config.has_option("executor", "STATUS_INTERVAL"):
+    JOB_STATUS_INTERVAL = config.getint("executor", "STATUS_INTERVAL")
+
+# Executors reporting less free disk space (in MB) get no new jobs
+JOB_MIN_FREE_DISK = 500
+if config.has_option("executor", "MIN_FREE_DISK"):
+    JOB_MIN_FREE_DISK = config.getint("executor", "MIN_FREE_DISK")
+
 GRAPPELLI_ADMIN_TITLE = "OpenSubmit"
 GRAPPELLI_SWITCH_USER = True
 GRAPPELLI_INDEX_DASHBOARD = {
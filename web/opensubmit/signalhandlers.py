@@ -5,6 +5,7 @@ from django.contrib.auth.models import User
 from .security import check_permission_system
 from .models import Submission, Course, SubmissionFile
 from .models.userprofile import db_fixes
+from .jobwait import notify_new_job
 
 
 @receiver(post_save, sender=User)
@@ -24,10 +25,11 @@ def post_user_save(sender,instance, signal, created, **kwargs):
 @receiver(post_save, sender=SubmissionFile)
 def submissionfile_post_save(sender,instance, signal, created, **kwargs):
     '''
-        Update MD5 field for newly uploaded files.
+        Update checksum fields for newly uploaded files.
     '''
     if created:
         instance.md5 = instance.attachment_md5()
+        instance.sha1 = instance.attachment_sha1()
         instance.save()
 
 @receiver(post_save, sender=Submission)
@@ -49,6 +51,16 @@ def submission_post_save(sender, instance, **kwargs):
                 subm.state = Submission.WITHDRAWN
                 subm.save()
 
+@receiver(post_save, sender=Submission)
+def submission_post_save_pending(sender, instance, **kwargs):
+    '''
+        Wake up executors waiting for new jobs.
+    '''
+    if instance.state in [Submission.TEST_VALIDITY_PENDING,
+                          Submission.TEST_FULL_PENDING,
+                          Submission.CLOSED_TEST_FULL_PENDING]:
+        notify_new_job()
+
 @receiver(post_save, sender=Course)
 def course_post_save(sender, instance, **kwargs):
     '''
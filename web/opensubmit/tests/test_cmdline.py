@@ -67,6 +67,10 @@ class CmdLine(TestCase):
         sys.argv = ['opensubmit-web', 'fixchecksums']
         cmdline.console_script(fsroot=self.tmpdir)
 
+    def test_reapjobs_call(self):
+        sys.argv = ['opensubmit-web', 'reapjobs']
+        cmdline.console_script(fsroot=self.tmpdir)
+
     def test_makeadmin_call(self):
         u = user.create_user(user.get_student_dict(0))
         sys.argv = ['opensubmit-web', 'makeadmin', u.email]
@@ -9,10 +9,23 @@ Missing tests:
 
 '''
 
+import io
+import json
 import os
 import os.path
+import shutil
 import sys
+import time
+import tarfile
+import tempfile
+import zipfile
 import logging
+from threading import Thread
+from concurrent.futures import wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pexpect
+import psutil
 
 from django.core import mail
 from django.conf import settings
@@ -21,7 +34,8 @@ from django.test.utils import override_settings
 from opensubmit.tests.cases import SubmitStudentScenarioTestCase
 from django.core.urlresolvers import reverse
 
-from opensubmit.models import TestMachine, SubmissionTestResult, Submission
+from opensubmit.models import TestMachine, SubmissionTestResult, Submission, SubmissionFile
+from opensubmit.reaper import reap_expired_jobs
 from opensubmit.tests import utils
 
 from .helpers.submission import create_validatable_submission
@@ -34,11 +48,24 @@ from .helpers.user import create_user, get_student_dict
 from . import uccrap, rootdir
 
 sys.path.insert(0, os.path.dirname(__file__) + '/../../../executor/')
-from opensubmitexec import config, cmdline, server, locking, compiler, exceptions  # NOQA
+from opensubmitexec import config, cmdline, server, locking, compiler, exceptions, daemon, client, cache, running, filesystem, hostinfo, metrics, spool, limits  # NOQA
+from opensubmitexec.job import Match  # NOQA
+from urllib.error import URLError
 
 logger = logging.getLogger('opensubmitexec')
 
 
+def _die_with_program(config):
+    '''
+    Executed in a daemon worker: start a registered student program, then die.
+    '''
+    import subprocess
+    from opensubmitexec.processes import ProcessRegistry
+    program = subprocess.Popen(['sleep', '60'], start_new_session=True)
+    ProcessRegistry(config).register(program.pid, 'orphan')
+    os._exit(1)
+
+
 class CmdLine(TestCase):
     '''
     Test cases for the executor command-line script.
@@ -63,6 +90,64 @@ class CmdLine(TestCase):
         with locking.ScriptLock(self.config):
             cmdline.console_script()
 
+    def test_unreachable_server(self):
+        self.config.set("Server", "request_retries", "2")
+        self.config.set("Server", "request_retry_delay", "0.1")
+        with self.assertRaises(URLError):
+            client.request(self.config, "http://127.0.0.1:1/jobs/")
+
+    def test_no_post_retries(self):
+        from http.server import HTTPServer, BaseHTTPRequestHandler
+        from urllib.error import HTTPError
+        requests = []
+
+        class Unavailable(BaseHTTPRequestHandler):
+            def _answer(self):
+                requests.append(self.command)
+                self.send_response(503)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_GET = do_POST = _answer
+
+            def log_message(self, *args):
+                pass
+
+        httpd = HTTPServer(('127.0.0.1', 0), Unavailable)
+        thread = Thread(target=httpd.serve_forever)
+        thread.start()
+        try:
+            self.config.set("Server", "request_retries", "2")
+            self.config.set("Server", "request_retry_delay", "0.1")
+            url = "http://127.0.0.1:%u/jobs/" % httpd.server_port
+            with self.assertRaises(HTTPError):
+                client.request(self.config, url)
+            with self.assertRaises(HTTPError):
+                client.request(self.config, url, data={'Result': 'Once'})
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+            thread.join()
+        # The POST request may have been processed by the server
+        self.assertEqual(['GET', 'GET', 'GET', 'POST'], requests)
+
+    def test_exclusive_job_slot(self):
+        # An exclusive reservation must wait for all other jobs
+        events = []
+
+        def reserve_exclusive():
+            with locking.JobSlot(self.config) as slot:
+                slot.reserve_all()
+                events.append('exclusive')
+
+        with locking.JobSlot(self.config):
+            thread = Thread(target=reserve_exclusive)
+            thread.start()
+            time.sleep(0.5)
+            events.append('shared done')
+        thread.join()
+        self.assertEqual(events, ['shared done', 'exclusive'])
+
 
 class Library(SubmitStudentScenarioTestCase):
     '''
@@ -101,6 +186,63 @@ class Library(SubmitStudentScenarioTestCase):
 
         self.assertEqual(db_entries[0].result, msg)
 
+    def test_hostinfo_cache(self):
+        self.config['Execution']['cache_dir'] = tempfile.mkdtemp()
+        info = hostinfo.all_host_infos(self.config)
+        self.assertEqual('Operating system', info[0][0])
+        # Second call is served from the cache
+        cache_fname = os.path.join(self.config['Execution']['cache_dir'], 'hostinfo.json')
+        with open(cache_fname) as f:
+            data = json.load(f)
+        data['info'] = [['Marker', '42']]
+        with open(cache_fname, 'w') as f:
+            json.dump(data, f)
+        self.assertEqual([['Marker', '42']], hostinfo.all_host_infos(self.config))
+        # Expired cache
+        self.config['Execution']['hostinfo_ttl'] = '0'
+        self.assertEqual(info[0], hostinfo.all_host_infos(self.config)[0])
+        # Unchanged information is only sent when demanded
+        self.config['Execution']['hostinfo_ttl'] = '3600'
+        self.assertTrue(server.send_hostinfo(self.config, only_changed=True))
+        self.assertFalse(server.send_hostinfo(self.config, only_changed=True))
+        self.assertTrue(server.send_hostinfo(self.config))
+        machine = TestMachine.objects.get(host=self.config['Server']['uuid'])
+        self.assertIn('Operating system', machine.config)
+        shutil.rmtree(self.config['Execution']['cache_dir'])
+
+    def test_validator_cache(self):
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        job = server.fetch_job(self.config)
+        self.assertNotEquals(None, job)
+        self.assertEqual(job.validator_hash, self.validated_assignment.validity_test_hash())
+        self.assertIn(job.validator_hash, cache.validator_cache(self.config))
+
+    def test_validator_download_not_modified(self):
+        url = self.validated_assignment.validity_test_url()
+        response = self.c.get(url)
+        self.assertEqual(200, response.status_code)
+        etag = response['ETag']
+        response = self.c.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(304, response.status_code)
+
+    def test_streamed_download(self):
+        url = self.validated_assignment.validity_test_url()
+        fname = self.config.get("Execution", "directory") + 'streamed.validator'
+        try:
+            with open(fname, 'wb') as target:
+                result = client.request(self.config, url, target=target)
+            self.assertEqual(None, result.body)
+            self.assertEqual(int(result.headers['Content-Length']), os.path.getsize(fname))
+            with open(fname, 'rb') as f:
+                self.validated_assignment.attachment_test_validity.open('rb')
+                self.assertEqual(self.validated_assignment.attachment_test_validity.read(), f.read())
+        finally:
+            os.remove(fname)
+
     def test_fetch_job_renaming(self):
         test_machine = self._register_executor()
         self.validated_assignment.test_machines.add(test_machine)
@@ -124,6 +266,37 @@ class Library(SubmitStudentScenarioTestCase):
         self.assertListEqual(job.grep("World"), ['helloworld.c'])
         self.assertListEqual(job.grep("foobar"), [])
 
+    def test_search(self):
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        job = server.fetch_job(self.config)
+        os.mkdir(job.working_dir + 'sub')
+        with open(job.working_dir + 'sub/forbidden.c', 'w') as f:
+            f.write('int x;\n' * 20000 + 'system("ls");\nfork();\n')
+        job.student_files.append('sub')
+        matches = job.search(['World', 'system', 'fork', 'foobar'])
+        self.assertIn(('helloworld.c', 'World'), [(m.file, m.pattern) for m in matches])
+        self.assertIn(Match('sub/forbidden.c', 20001, 'system'), matches)
+        self.assertIn(Match('sub/forbidden.c', 20002, 'fork'), matches)
+        self.assertNotIn('foobar', [m.pattern for m in matches])
+        self.assertEqual([], job.search('system', recursive=False))
+        # Matches never span lines, overlapping patterns are all reported
+        matches = job.search(['x;\\s+system', 'x;[^i]*fork', 'ls.*\\n', 'sys', r'(\w)\1'])
+        self.assertEqual([Match('sub/forbidden.c', 20001, 'sys')],
+                         [m for m in matches if m.file == 'sub/forbidden.c'])
+        matches = job.search(['(l)\\1', '(?P<call>fork)\\('])
+        self.assertIn(Match('helloworld.c', 4, '(l)\\1'), matches)
+        self.assertIn(Match('sub/forbidden.c', 20002, '(?P<call>fork)\\('), matches)
+        # No phantom line after the trailing newline
+        with open(job.working_dir + 'sub/lines.c', 'w') as f:
+            f.write('a\n\nb\nc\n')
+        self.assertEqual([Match('sub/lines.c', 2, '^$')],
+                         [m for m in job.search('^$') if m.file == 'sub/lines.c'])
+        self.assertEqual([], [m for m in job.search('^$') if m.file == 'sub/forbidden.c'])
+
     def test_ensure_files(self):
         sf = create_submission_file()
         sub = create_validatable_submission(
@@ -151,6 +324,232 @@ class Library(SubmitStudentScenarioTestCase):
         self.assertEquals(job.course, str(self.course))
         self.assertEquals(job.assignment, str(self.validated_assignment))
 
+    def test_output_capture(self):
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        self.config['Execution']['message_size'] = '100'
+        self.config['Execution']['output_size'] = '1000'
+        job = server.fetch_job(self.config)
+        exit_status, output = job.run_program(
+            'python3', ['-c', "print('A' * 500 + 'B' * 100000 + 'C' * 500)"])
+        self.assertEqual(0, exit_status)
+        self.assertTrue(output.startswith('A' * 500 + '\n[...'))
+        self.assertTrue(output.rstrip().endswith('C' * 400))
+        self.assertNotIn('BB', output)
+        # The validator gets more output than fits into a result message
+        exit_status, output = job.run_program('python3', ['-c', "print('E' * 900)"])
+        self.assertIn('E' * 900, output)
+        job.send_fail_result('D' * 1000)
+        result = sub.get_validation_result().result
+        self.assertTrue(result.startswith('D' * 50))
+        self.assertIn('900 bytes omitted', result)
+
+    def test_resource_limits(self):
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        self.config['Execution']['limit_cpu'] = '1'
+        self.config['Execution']['limit_file_size'] = '1'
+        job = server.fetch_job(self.config)
+        self.assertRaises(exceptions.CpuLimitException, job.run_program,
+                          'python3', ['-c', "while True: pass"])
+        self.assertRaises(exceptions.FileSizeLimitException, job.run_program,
+                          'python3', ['-c', "open('big', 'wb').write(b'x' * 2000000)"])
+        self.assertEqual((0, ''), job.run_program('python3', ['-c', "pass"]))
+
+    def test_process_limit_without_cgroup(self):
+        from unittest import mock
+        from opensubmitexec.job import Job
+        self.config['Execution']['limit_processes'] = '5'
+        jobs = [Job(self.config, online=False), Job(self.config, online=False)]
+        with mock.patch.object(psutil, 'process_iter', wraps=psutil.process_iter) as process_iter:
+            first = limits.ResourceLimits(jobs[0])
+            second = limits.ResourceLimits(jobs[0])
+            # The process table is only scanned once per job
+            self.assertEqual(1, process_iter.call_count)
+            limits.ResourceLimits(jobs[1])
+            self.assertEqual(2, process_iter.call_count)
+        self.assertIsNone(first.cgroup)
+        self.assertEqual(first._nproc, second._nproc)
+        self.assertGreater(first._nproc, 5)
+
+    def test_benchmark_program(self):
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        job = server.fetch_job(self.config)
+        result = job.benchmark_program('python3', ['-c', "pass"], runs=3, warmup=1)
+        for metric in ['wall', 'user', 'sys']:
+            self.assertLessEqual(result[metric]['min'], result[metric]['median'])
+        self.assertGreater(result['wall']['min'], 0)
+        job.send_pass_result()
+        perf_data = sub.get_validation_result().perf_data.splitlines()
+        self.assertEqual(3, len(perf_data))
+        self.assertTrue(perf_data[0].startswith('python3;'))
+        self.assertIn(';3;', perf_data[0])
+
+    def test_kill_longrunning(self):
+        import subprocess
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        job = server.fetch_job(self.config)
+        prog = job.spawn_program('sleep', ['60'])
+        # Not started by a validator, so never killed
+        other = subprocess.Popen(['sleep', '60'])
+        try:
+            running.kill_longrunning(self.config)
+            self.assertTrue(prog._spawn.isalive())
+            self.config['Execution']['timeout'] = '0'
+            running.kill_longrunning(self.config)
+            prog._spawn.wait()
+            self.assertFalse(prog._spawn.isalive())
+            self.assertEqual(None, other.poll())
+        finally:
+            other.kill()
+            other.wait()
+
+    def test_kill_job_programs(self):
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        job = server.fetch_job(self.config)
+        prog = job.spawn_program('sh', ['-c', 'sleep 60 & sleep 60'])
+        prog.expect_output(pexpect.TIMEOUT, timeout=0.5)
+        children = psutil.Process(prog._spawn.pid).children(recursive=True)
+        self.assertEqual(2, len(children))
+        job._kill_programs()
+        psutil.wait_procs(children, timeout=5)
+        for child in children:
+            self.assertFalse(child.is_running())
+
+    def test_archive_limits(self):
+        self.config['Execution']['max_unpacked_size'] = '1'
+        self.config['Execution']['max_unpacked_files'] = '10'
+        self.config['Execution']['max_path_depth'] = '3'
+        tmpdir = tempfile.mkdtemp()
+
+        def unpack(fname, entries, **kwargs):
+            # entries is a list of (name, content) tuples
+            fpath = os.path.join(tmpdir, fname)
+            with zipfile.ZipFile(fpath, 'w', zipfile.ZIP_DEFLATED) as zf:
+                for name, content in entries:
+                    zf.writestr(name, content)
+            dest = tempfile.mkdtemp(dir=tmpdir) + os.sep
+            filesystem.unpack_if_needed(dest, fpath, **kwargs)
+            return dest
+
+        # Normal archive with one directory
+        dest = unpack('ok.zip', [('sub/a.c', 'int a;'), ('sub/b.c', 'int b;')], config=self.config)
+        self.assertEqual(['a.c', 'b.c'], sorted(os.listdir(dest + 'sub')))
+        # Compression bomb
+        with self.assertRaises(exceptions.JobException) as cm:
+            unpack('bomb.zip', [('a', b'\0' * 2 * 1024 * 1024)], config=self.config)
+        self.assertIn('1 MB', cm.exception.info_student)
+        # Too many entries
+        with self.assertRaises(exceptions.JobException):
+            unpack('many.zip', [(str(i), '') for i in range(11)], config=self.config)
+        # Too deep
+        with self.assertRaises(exceptions.JobException):
+            unpack('deep.zip', [('a/b/c/d', '')], config=self.config)
+        # Path traversal is rejected also without limits
+        with self.assertRaises(exceptions.JobException):
+            unpack('evil.zip', [('../evil', '')])
+        self.assertFalse(os.path.exists(os.path.join(tmpdir, 'evil')))
+        # Absolute names end up in the destination
+        dest = unpack('abs.zip', [('/abs', '')])
+        self.assertTrue(os.path.exists(dest + 'abs'))
+
+        # TAR archive with symbolic links
+        fpath = os.path.join(tmpdir, 'links.tgz')
+        with tarfile.open(fpath, 'w:gz') as tf:
+            for name, linkname in [('inside', 'a'), ('outside', '/etc')]:
+                info = tarfile.TarInfo(name)
+                info.type = tarfile.SYMTYPE
+                info.linkname = linkname
+                tf.addfile(info)
+            info = tarfile.TarInfo('a')
+            info.size = 3
+            info.mode = 0o755
+            tf.addfile(info, io.BytesIO(b'abc'))
+        dest = tempfile.mkdtemp(dir=tmpdir) + os.sep
+        single_dir, did_unpack = filesystem.unpack_if_needed(dest, fpath, self.config)
+        self.assertTrue(did_unpack)
+        self.assertTrue(os.path.islink(dest + 'inside'))
+        self.assertFalse(os.path.lexists(dest + 'outside'))
+        self.assertTrue(os.access(dest + 'a', os.X_OK))
+
+        # Broken ZIP archive, the second entry has a wrong checksum
+        fpath = os.path.join(tmpdir, 'broken.zip')
+        with zipfile.ZipFile(fpath, 'w', zipfile.ZIP_STORED) as zf:
+            zf.writestr('a', 'first')
+            zf.writestr('b', 'second')
+        with open(fpath, 'r+b') as f:
+            data = f.read()
+            f.seek(data.index(b'second'))
+            f.write(b'SECOND')
+        dest = tempfile.mkdtemp(dir=tmpdir) + os.sep
+        with self.assertRaises(exceptions.JobException) as cm:
+            filesystem.unpack_if_needed(dest, fpath, self.config)
+        self.assertIn('broken', cm.exception.info_student)
+        self.assertEqual([], os.listdir(dest))
+        # Truncated TAR archive
+        fpath = os.path.join(tmpdir, 'truncated.tgz')
+        with tarfile.open(fpath, 'w:gz') as tf:
+            for name, content in [('a', b'abc'), ('b', os.urandom(10000))]:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                tf.addfile(info, io.BytesIO(content))
+        with open(fpath, 'r+b') as f:
+            f.truncate(os.path.getsize(fpath) // 2)
+        dest = tempfile.mkdtemp(dir=tmpdir) + os.sep
+        with self.assertRaises(exceptions.JobException):
+            filesystem.unpack_if_needed(dest, fpath, self.config)
+        self.assertEqual([], os.listdir(dest))
+        shutil.rmtree(tmpdir)
+
+    def test_job_metrics(self):
+        tmpdir = tempfile.mkdtemp()
+        self.config['Logging']['metrics_file'] = tmpdir + '/metrics.json'
+        self.config['Logging']['metrics_prometheus'] = tmpdir + '/executor.prom'
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        self.assertTrue(self._run_executor())
+        with open(tmpdir + '/metrics.json') as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual(1, len(records))
+        self.assertEqual('pass', records[0]['result'])
+        self.assertEqual(str(sf.pk), records[0]['file_id'])
+        self.assertEqual(['fetch', 'prepare', 'report', 'validate', 'validator'],
+                         sorted(records[0]['phases'].keys()))
+        with open(tmpdir + '/executor.prom') as f:
+            text = f.read()
+        self.assertIn('opensubmit_executor_jobs_total{result="pass"} 1', text)
+        self.assertIn('opensubmit_executor_phase_duration_seconds_count{phase="validate"} 1', text)
+        # Counters are aggregated over all jobs
+        metrics.record_job(self.config, {'result': 'fail', 'exception': 'TimeoutException',
+                                         'phases': {'validate': 1000}})
+        with open(tmpdir + '/executor.prom') as f:
+            text = f.read()
+        self.assertIn('opensubmit_executor_job_failures_total{exception="TimeoutException"} 1', text)
+        self.assertIn('opensubmit_executor_phase_duration_seconds_bucket{phase="validate",le="600"} 1', text)
+        self.assertIn('opensubmit_executor_phase_duration_seconds_bucket{phase="validate",le="+Inf"} 2', text)
+        shutil.rmtree(tmpdir)
+
     def test_wrong_compile_call(self):
         sf = create_submission_file()
         sub = create_validatable_submission(
@@ -165,6 +564,55 @@ class Library(SubmitStudentScenarioTestCase):
         # Wrong file, determined by compiler
         self.assertRaises(exceptions.WrongExitStatusException, job.run_compiler, inputs=['foo.c'], output='output')
 
+    def test_compile_cache(self):
+        sf = create_submission_file()
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, sf)
+        test_machine = self._register_executor()
+        sub.assignment.test_machines.add(test_machine)
+        job = server.fetch_job(self.config)
+        def cache_key():
+            return compiler.compile_cache_key(job.working_dir, ['gcc', '-o', 'output', 'helloworld.c'],
+                                              ['helloworld.c'], job._student_file_paths(True), 'output')
+        key = cache_key()
+        job.run_compiler(inputs=['helloworld.c'], output='output')
+        self.assertIn(key, cache.compiler_cache(self.config))
+        os.remove(job.working_dir + 'output')
+        with self.assertLogs('opensubmitexec', level='INFO') as logs:
+            job.run_compiler(inputs=['helloworld.c'], output='output')
+        self.assertIn('cached', logs.output[0])
+        self.assertTrue(os.access(job.working_dir + 'output', os.X_OK))
+        # The output itself is not part of the key
+        self.assertEqual(key, cache_key())
+        # Any included student file may lead to a new compilation, not only headers
+        with open(job.working_dir + 'list.inc', 'w') as f:
+            f.write('/* changed */')
+        job.student_files.append('list.inc')
+        self.assertNotEqual(key, cache_key())
+
+    def test_compile_cache_other_validator(self):
+        # Identical student files in two fresh job directories with different validators
+        tmpdir = tempfile.mkdtemp()
+        jobs = []
+        for validator in ['first', 'second']:
+            src_dir = os.path.join(tmpdir, validator)
+            os.mkdir(src_dir)
+            shutil.copy(rootdir + '/submfiles/validation/1000fff/helloworld.c', src_dir)
+            with open(os.path.join(src_dir, 'validator.py'), 'w') as f:
+                f.write("def validate(job):\n    job.send_pass_result('{0}')\n".format(validator))
+            job = server.fake_fetch_job(self.config, src_dir)
+            # Leftovers of an imported validator
+            os.mkdir(job.working_dir + '__pycache__')
+            with open(job.working_dir + '__pycache__/validator.pyc', 'w') as f:
+                f.write(validator)
+            jobs.append(job)
+        jobs[0].run_compiler(inputs=['helloworld.c'], output='hello')
+        with self.assertLogs('opensubmitexec', level='INFO') as logs:
+            jobs[1].run_compiler(inputs=['helloworld.c'], output='hello')
+        self.assertIn('cached', logs.output[0])
+        self.assertTrue(os.access(jobs[1].working_dir + 'hello', os.X_OK))
+        shutil.rmtree(tmpdir)
+
     def test_cleanup(self):
         '''
         If configured, then the executor should remove all temporary
@@ -309,6 +757,21 @@ class Communication(SubmitStudentScenarioTestCase):
         assert(self._register_executor().pk)
         self.assertEqual(machine_count + 1, TestMachine.objects.all().count())
 
+    def test_heartbeat_write_behind(self):
+        machine = self._register_executor()
+        stored = machine.last_contact
+        self._run_executor()
+        # Recent contact only in the cache
+        machine.refresh_from_db()
+        self.assertEqual(stored, machine.last_contact)
+        self.assertGreater(machine.last_seen, stored)
+        # Old contact information is written to the database
+        with override_settings(JOB_HEARTBEAT_INTERVAL=0):
+            self._run_executor()
+        machine.refresh_from_db()
+        self.assertGreater(machine.last_contact, stored)
+        self.assertEqual(machine.last_seen, machine.last_contact)
+
     @override_settings(JOB_EXECUTOR_SECRET='foo')
     def test_invalid_secret(self):
         self.assertNotEqual(True, self._run_executor())
@@ -345,6 +808,348 @@ class Communication(SubmitStudentScenarioTestCase):
             self.assertEqual(NUM_PARALLEL, len(results))
             self.assertNotEqual(0, len(results[0].result))
 
+    def test_lease_jobs(self):
+        self.validated_assignment.test_machines.add(self._register_executor())
+        subs = []
+        for i in range(1, 4):
+            stud = create_user(get_student_dict(i))
+            self.course.participants.add(stud.profile)
+            sf = create_submission_file()
+            subs.append(create_validatable_submission(
+                stud, self.validated_assignment, sf))
+
+        jobs = server.fetch_jobs(self.config, 2)
+        self.assertEqual(2, len(jobs))
+        jobs += server.fetch_jobs(self.config, 5)
+        self.assertEqual(3, len(jobs))
+        self.assertEqual([], server.fetch_jobs(self.config, 5))
+        self.assertEqual(set([str(sub.file_upload.pk) for sub in subs]),
+                         set([job.file_id for job in jobs]))
+
+        for job in jobs:
+            job._run_validate()
+        for sub in subs:
+            sub.refresh_from_db()
+            self.assertEqual(sub.state, Submission.TEST_FULL_PENDING)
+            self.assertEqual(None, sub.file_upload.fetched)
+
+    def test_lease_jobs_v1(self):
+        sub = self._register_test_machine()
+        url = self.config.get("Server", "url")
+        server._api_v2[url] = False
+        try:
+            jobs = server.fetch_jobs(self.config, 2)
+        finally:
+            del server._api_v2[url]
+        self.assertEqual(1, len(jobs))
+        self.assertEqual(None, jobs[0].lease_id)
+        jobs[0]._run_validate()
+        sub.refresh_from_db()
+        self.assertEqual(sub.state, Submission.TEST_FULL_PENDING)
+
+    @override_settings(JOB_STATUS_INTERVAL=0)
+    def test_executor_status(self):
+        sub = self._register_test_machine()
+        machine = sub.assignment.test_machines.all()[0]
+        # Held back, since the disk is too small
+        with override_settings(JOB_MIN_FREE_DISK=10 ** 12):
+            self.assertEqual([], server.fetch_jobs(self.config, 2))
+        machine.refresh_from_db()
+        self.assertEqual(2, machine.status['free_slots'])
+        jobs = server.fetch_jobs(self.config, 2)
+        self.assertEqual(1, len(jobs))
+        jobs[0]._run_validate()
+        # Cached validator is reported with the 1.x protocol, too
+        url = self.config.get("Server", "url")
+        server._api_v2[url] = False
+        try:
+            server.fetch_jobs(self.config, 1)
+        finally:
+            del server._api_v2[url]
+        machine.refresh_from_db()
+        self.assertEqual(1, machine.status['free_slots'])
+        self.assertIn(sub.assignment.validity_test_hash(), machine.status['validators'])
+
+    def test_parallel_job_claiming(self):
+        self.validated_assignment.test_machines.add(self._register_executor())
+        subs = []
+        for i in range(1, 6):
+            stud = create_user(get_student_dict(i))
+            self.course.participants.add(stud.profile)
+            sf = create_submission_file()
+            subs.append(create_validatable_submission(
+                stud, self.validated_assignment, sf))
+
+        results = utils.run_parallel(8, lambda: server.fetch_jobs(self.config, 2))
+        file_ids = [job.file_id for jobs in results for job in jobs]
+        self.assertEqual(sorted(file_ids),
+                         sorted([str(sub.file_upload.pk) for sub in subs]))
+
+    def test_late_result_of_refetched_job(self):
+        sub = self._register_test_machine()
+        other_machine = TestMachine.objects.create(host='other')
+        job = server.fetch_job(self.config)
+        # The job timed out and was fetched by another machine
+        SubmissionFile.objects.filter(pk=sub.file_upload.pk).update(fetched_by=other_machine)
+        job.send_fail_result("Too late")
+        sub.refresh_from_db()
+        self.assertEqual(sub.state, Submission.TEST_VALIDITY_PENDING)
+        self.assertEqual(None, sub.get_validation_result())
+
+    def test_api_v2(self):
+        secret = self.config.get("Server", "secret")
+        response = self.c.get('/api/v2/')
+        self.assertEqual('2.0.0', response.json()['api_version'])
+        self.assertIn('bulk_results', response.json()['capabilities'])
+
+        def post(url, data):
+            return self.c.post(url, json.dumps(data), content_type='application/json')
+
+        self.assertEqual('forbidden', post('/api/v2/lease/', {'secret': 'foo', 'uuid': 'new'}).json()['error'])
+        self.assertEqual('bad_request', post('/api/v2/lease/', [1, 2]).json()['error'])
+        response = post('/api/v2/lease/', {'secret': secret, 'uuid': 'new'})
+        self.assertEqual(409, response.status_code)
+        self.assertEqual('unknown_machine', response.json()['error'])
+        self.assertFalse(TestMachine.objects.filter(host='new').exists())
+        response = post('/api/v2/register/', {'secret': secret, 'uuid': 'new', 'config': [['OS', 'Foo']],
+                                              'capabilities': ['bulk_results', 'teleport']})
+        self.assertEqual(['bulk_results'], response.json()['capabilities'])
+        machine = TestMachine.objects.get(host='new')
+        self.assertIn('Foo', machine.config)
+
+        sub = create_validatable_submission(
+            self.user, self.validated_assignment, create_submission_file())
+        self.validated_assignment.test_machines.add(machine)
+        jobs = post('/api/v2/lease/', {'secret': secret, 'uuid': 'new', 'max_jobs': 5}).json()['jobs']
+        self.assertEqual(1, len(jobs))
+        lease_id = jobs[0]['lease_id']
+        self.assertTrue(lease_id.startswith('%u.test_validity.' % sub.file_upload.pk))
+
+        results = [{'lease_id': lease_id + '0', 'error_code': 0, 'message': 'Wrong lease'},
+                   {'lease_id': 'foo', 'error_code': 0},
+                   {'lease_id': lease_id, 'error_code': 0, 'message': 'Fine', 'message_tutor': 'Fine'}]
+        response = post('/api/v2/results/', {'secret': secret, 'uuid': 'new', 'results': results})
+        self.assertEqual(['expired', 'bad_request', 'stored'],
+                         [entry['status'] for entry in response.json()['results']])
+        sub.refresh_from_db()
+        self.assertEqual(Submission.TEST_FULL_PENDING, sub.state)
+        self.assertEqual('Fine', sub.get_validation_result().result)
+        # The lease is gone after the result was stored, or reaped
+        response = post('/api/v2/results/', {'secret': secret, 'uuid': 'new', 'results': results[2:]})
+        self.assertEqual('expired', response.json()['results'][0]['status'])
+
+    def test_executor_api_v2(self):
+        sub = self._register_test_machine()
+        self.assertTrue(server.use_api_v2(self.config))
+        jobs = server.fetch_jobs(self.config, 2)
+        self.assertEqual(1, len(jobs))
+        self.assertNotEqual(None, jobs[0].lease_id)
+        jobs[0].send_fail_result("Failed with v2")
+        sub.refresh_from_db()
+        self.assertEqual(Submission.TEST_VALIDITY_FAILED, sub.state)
+        self.assertEqual("Failed with v2", sub.get_validation_result().result)
+
+    def test_result_spool(self):
+        self.config['Execution']['spool_dir'] = tempfile.mkdtemp()
+        sub = self._register_test_machine()
+        job = server.fetch_jobs(self.config, 1)[0]
+        # Server rejects everything for a while
+        secret = self.config['Server']['secret']
+        self.config['Server']['secret'] = 'foo'
+        job.send_fail_result("Delivered later")
+        self.config['Server']['secret'] = secret
+        result_spool = spool.ResultSpool(self.config)
+        pending = result_spool.pending()
+        self.assertEqual(1, len(pending))
+        self.assertEqual(1, pending[0][1]['attempts'])
+        # Retry is not due yet
+        self.assertEqual(1, result_spool.flush())
+        sub.refresh_from_db()
+        self.assertEqual(Submission.TEST_VALIDITY_PENDING, sub.state)
+        self.assertEqual(0, result_spool.flush(force=True))
+        sub.refresh_from_db()
+        self.assertEqual(Submission.TEST_VALIDITY_FAILED, sub.state)
+        self.assertEqual("Delivered later", sub.get_validation_result().result)
+        shutil.rmtree(self.config['Execution']['spool_dir'])
+
+    def test_result_reuse(self):
+        sub = self._register_test_machine()
+        # validation test
+        self.assertEqual(True, self._run_executor())
+        # full test
+        self.assertEqual(True, self._run_executor())
+        sub.refresh_from_db()
+
+        # Re-submission of identical content gets the earlier results
+        resub = create_validatable_submission(
+            self.user, self.validated_assignment, create_submission_file())
+        self.assertEqual(None, server.fetch_job(self.config))
+        resub.refresh_from_db()
+        self.assertEqual(sub.state, resub.state)
+        self.assertEqual(sub.get_validation_result().result,
+                         resub.get_validation_result().result)
+        self.assertEqual(sub.get_fulltest_result().result_tutor,
+                         resub.get_fulltest_result().result_tutor)
+        self.assertEqual(None, SubmissionFile.objects.get(pk=resub.file_upload.pk).fetched)
+
+        # Identical content from somebody else is really tested
+        stud = create_user(get_student_dict(1))
+        self.course.participants.add(stud.profile)
+        othersub = create_validatable_submission(
+            stud, self.validated_assignment, create_submission_file())
+        job = server.fetch_job(self.config)
+        self.assertEqual(str(othersub.file_upload.pk), job.file_id)
+
+    def test_no_reuse_of_unspecific_errors(self):
+        self._register_test_machine()
+        job = server.fetch_job(self.config)
+        job.send_fail_result("Timeout on a loaded host")
+        # Re-submission of identical content is really tested
+        resub = create_validatable_submission(
+            self.user, self.validated_assignment, create_submission_file())
+        job = server.fetch_job(self.config)
+        self.assertEqual(str(resub.file_upload.pk), job.file_id)
+
+    def test_no_reuse_after_validator_change(self):
+        sub = self._register_test_machine()
+        job = server.fetch_job(self.config)
+        # The teacher replaces the validator while the job runs
+        with open(settings.MEDIA_ROOT + 'other_validator.py', 'w') as f:
+            f.write("def validate(job):\n    job.send_fail_result('Changed')\n")
+        self.validated_assignment.attachment_test_validity = 'other_validator.py'
+        self.validated_assignment.save()
+        job.send_pass_result("Result of the old validator")
+        self.assertEqual(None, sub.get_validation_result().validator_hash)
+        # Re-submission of identical content is really tested
+        resub = create_validatable_submission(
+            self.user, self.validated_assignment, create_submission_file())
+        job = server.fetch_job(self.config)
+        self.assertEqual(str(resub.file_upload.pk), job.file_id)
+
+    def test_reap_expired_jobs(self):
+        from datetime import datetime, timedelta
+
+        sub = self._register_test_machine()
+        machine = TestMachine.objects.get(host=self.config.get("Server", "uuid"))
+        job = server.fetch_job(self.config)
+        self.assertNotEqual(None, job)
+        self.assertEqual(machine, SubmissionFile.objects.get(pk=sub.file_upload.pk).fetched_by)
+
+        # Lease still valid
+        self.assertEqual(0, reap_expired_jobs())
+        SubmissionFile.objects.filter(pk=sub.file_upload.pk).update(
+            fetched=datetime.now() - timedelta(seconds=sub.assignment.attachment_test_timeout + 1))
+        self.assertEqual(1, reap_expired_jobs())
+
+        sub = Submission.objects.get(pk=sub.pk)
+        self.assertEqual(sub.state, Submission.TEST_VALIDITY_FAILED)
+        self.assertEqual(None, sub.file_upload.fetched)
+        result = sub.get_validation_result()
+        self.assertIn("non-reaction", result.result)
+        self.assertEqual(machine, result.machine)
+        self.assertEqual(1, len(mail.outbox))
+
+    def test_reap_racing_result(self):
+        from datetime import datetime, timedelta
+        from unittest import mock
+        from opensubmit import reaper
+
+        sub = self._register_test_machine()
+        job = server.fetch_job(self.config)
+        SubmissionFile.objects.filter(pk=sub.file_upload.pk).update(
+            fetched=datetime.now() - timedelta(seconds=sub.assignment.attachment_test_timeout + 1))
+        expired_jobs = reaper._expired_jobs
+
+        def deliver_meanwhile(now):
+            expired = expired_jobs(now)
+            job.send_pass_result("Just in time")
+            return expired
+
+        with mock.patch.object(reaper, '_expired_jobs', deliver_meanwhile):
+            self.assertEqual(0, reap_expired_jobs())
+        sub.refresh_from_db()
+        self.assertEqual(sub.state, Submission.TEST_FULL_PENDING)
+        self.assertEqual("Just in time", sub.get_validation_result().result)
+        self.assertEqual(1, SubmissionTestResult.objects.filter(submission_file=sub.file_upload).count())
+
+    def test_daemon(self):
+        sub = self._register_test_machine()
+        d = daemon.Daemon(os.path.dirname(__file__) + "/executor.cfg",
+                          override_url=self.live_server_url)
+        thread = Thread(target=d.run)
+        thread.start()
+        try:
+            # validation and full test are both done by the same daemon
+            for i in range(60):
+                sub.refresh_from_db()
+                if sub.state == Submission.SUBMITTED_TESTED:
+                    break
+                time.sleep(0.5)
+        finally:
+            d.stop()
+            thread.join()
+        self.assertEqual(sub.state, Submission.SUBMITTED_TESTED)
+
+    def test_daemon_broken_pool(self):
+        sub = self._register_test_machine()
+        d = daemon.Daemon(os.path.dirname(__file__) + "/executor.cfg",
+                          override_url=self.live_server_url)
+        d.running = {}
+        d._create_pool()
+        # Some worker process dies
+        with self.assertRaises(BrokenProcessPool):
+            d.pool.submit(os._exit, 1).result()
+        self.assertTrue(d.run_once())
+        wait(list(d.running), timeout=30)
+        d._collect_finished()
+        d.pool.shutdown()
+        sub.refresh_from_db()
+        self.assertEqual(sub.state, Submission.TEST_FULL_PENDING)
+
+    def test_daemon_broken_pool_programs(self):
+        from types import SimpleNamespace
+        from opensubmitexec.processes import ProcessRegistry
+        d = daemon.Daemon(os.path.dirname(__file__) + "/executor.cfg",
+                          override_url=self.live_server_url)
+        d.running = {}
+        d._create_pool()
+        future = d.pool.submit(_die_with_program, d.config)
+        wait([future], timeout=30)
+        pid = [entry['pgid'] for entry in ProcessRegistry(d.config).entries() if entry['job'] == 'orphan'][0]
+        self.assertTrue(psutil.pid_exists(pid))
+        d.running[future] = SimpleNamespace(file_id='orphan', _resubmitted=True)
+        d._collect_finished()
+        d.pool.shutdown()
+        for i in range(50):
+            if not psutil.pid_exists(pid) or psutil.Process(pid).status() == psutil.STATUS_ZOMBIE:
+                break
+            time.sleep(0.1)
+        else:
+            self.fail("Program of the dead worker is still running.")
+
+    def test_daemon_long_poll(self):
+        self.validated_assignment.test_machines.add(self._register_executor())
+        d = daemon.Daemon(os.path.dirname(__file__) + "/executor.cfg",
+                          override_url=self.live_server_url)
+        thread = Thread(target=d.run)
+        thread.start()
+        try:
+            # Let the daemon learn about long polling support
+            time.sleep(1)
+            sf = create_submission_file()
+            sub = create_validatable_submission(
+                self.user, self.validated_assignment, sf)
+            # Without long polling, the daemon would sleep for poll_interval seconds
+            for i in range(30):
+                sub.refresh_from_db()
+                if sub.state != Submission.TEST_VALIDITY_PENDING:
+                    break
+                time.sleep(0.1)
+        finally:
+            d.stop()
+            thread.join()
+        self.assertNotEqual(sub.state, Submission.TEST_VALIDITY_PENDING)
+
     def test_too_long_validation(self):
         from django.core import mail
 
@@ -387,7 +1192,9 @@ class Communication(SubmitStudentScenarioTestCase):
         sub.assignment.test_machines.add(test_machine)
 
         # Fire up the executor
+        search_path = list(sys.path)
         self.assertEqual(False, self._run_executor())
+        self.assertEqual(search_path, sys.path)
         sub.refresh_from_db()
         self.assertEqual(sub.state, Submission.TEST_VALIDITY_FAILED)
         text = sub.get_validation_result().result
@@ -120,6 +120,22 @@ class SubmissionModelAdminTestCase(SubmitTutorTestCase):
         self.assertEqual(0, Submission.objects.filter(
             state=Submission.TEST_FULL_PENDING).count())
 
+    def test_forget_test_results(self):
+        from opensubmit.models import SubmissionTestResult
+        self.sub3.file_upload.test_results.update(validator_hash='abc')
+        self.submadm.forgetTestResultsAction(
+            self.request, Submission.objects.all())
+        self.assertEqual(0, SubmissionTestResult.objects.filter(
+            validator_hash__isnull=False).count())
+
+    def test_perf_data_download(self):
+        response = self.submadm.getPerformanceResultsAction(
+            self.request, Submission.objects.all())
+        lines = response.content.decode('utf-8').splitlines()
+        # Header, plus validation and full test of the validated submission
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[2].startswith('%u;' % self.sub3.pk))
+
     def test_set_initial_state(self):
         self.submadm.setInitialStateAction(
             self.request, Submission.objects.all())
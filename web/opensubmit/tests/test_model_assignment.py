@@ -42,3 +42,14 @@ class AssignmentModelAdminTestCase(SubmitAdminTestCase):
         for ass in assignments:
             self.assertIsNone(ass.validity_test_url())
         self.assertIsNotNone(v_ass.validity_test_url())
+
+    def test_script_hash(self):
+        v_ass = create_validated_assignment_with_file(self.course,
+                                                      self.grading_scheme)
+        first = v_ass.validity_test_hash()
+        self.assertEqual(first, v_ass.validity_test_hash())
+        # Changed files are hashed again
+        path = v_ass.attachment_test_validity.path
+        with open(path, 'ab') as f:
+            f.write(b'changed')
+        self.assertNotEqual(first, v_ass.validity_test_hash())
@@ -3,9 +3,19 @@
 '''
 
 from opensubmit.tests.cases import SubmitStudentScenarioTestCase
-from opensubmit.models import Submission
+from django.conf import settings
+from django.test.utils import override_settings
+
+from opensubmit.models import Submission, TestMachine
+from opensubmit.scheduling import Scheduler, FairScheduler, FifoScheduler, dispatch
+
+from .helpers.submission import create_validatable_submission
+from .helpers.assignment import create_validated_assignment_with_archive, tomorrow, last_week
+from .helpers.djangofiles import create_submission_file
+from .helpers.user import create_user, get_student_dict
 
 import os
+import datetime
 import logging
 
 logger = logging.getLogger('opensubmitexec')
@@ -117,3 +127,108 @@ class SubmissionModel(SubmitStudentScenarioTestCase):
                 self.assertEqual(
                     self.hard_deadline_passed_assignment_sub.can_reupload(
                         self.user), False)
+
+    def _create_job_queue(self):
+        '''
+        Two assignments in the same course, the second one with the closer deadline.
+        Returns pending submissions from oldest to newest.
+        '''
+        assignment_a = self.validated_assignment
+        assignment_b = create_validated_assignment_with_archive(self.course, assignment_a.gradingScheme)
+        assignment_b.hard_deadline = tomorrow
+        assignment_b.save()
+        subs = {}
+        oldest = datetime.datetime.now() - datetime.timedelta(hours=1)
+        for i, name in enumerate(['full', 'a1', 'a2', 'b1', 'b2']):
+            stud = create_user(get_student_dict(i + 1))
+            self.course.participants.add(stud.profile)
+            assignment = assignment_b if name.startswith('b') else assignment_a
+            sub = create_validatable_submission(stud, assignment, create_submission_file())
+            state = Submission.TEST_FULL_PENDING if name == 'full' else Submission.TEST_VALIDITY_PENDING
+            Submission.objects.filter(pk=sub.pk).update(
+                state=state, modified=oldest + datetime.timedelta(minutes=i))
+            subs[name] = sub
+        return subs
+
+    def _run_scheduler(self, scheduler):
+        '''
+        Fetch all jobs in the order given by the scheduler.
+        '''
+        order = []
+        while True:
+            queue = scheduler.order(Submission.pending_tests.filter(file_upload__fetched__isnull=True))
+            if not queue:
+                return order
+            queue[0].save_fetch_date()
+            order.append(queue[0].pk)
+
+    def test_fifo_scheduler(self):
+        subs = self._create_job_queue()
+        expected = [subs[name].pk for name in ['a1', 'a2', 'b1', 'b2', 'full']]
+        self.assertEqual(expected, self._run_scheduler(FifoScheduler()))
+
+    def test_fair_scheduler(self):
+        subs = self._create_job_queue()
+        # Closest deadline first, then alternating between the assignments
+        expected = [subs[name].pk for name in ['b1', 'a1', 'b2', 'a2', 'full']]
+        self.assertEqual(expected, self._run_scheduler(FairScheduler()))
+
+    def test_fair_scheduler_passed_deadline(self):
+        subs = self._create_job_queue()
+        self.validated_assignment.hard_deadline = last_week
+        self.validated_assignment.save()
+        # Upcoming deadline before the one that passed long ago
+        expected = [subs[name].pk for name in ['b1', 'a1', 'b2', 'a2', 'full']]
+        self.assertEqual(expected, self._run_scheduler(FairScheduler()))
+
+    def test_status_interval(self):
+        machine = TestMachine.objects.create(host='busy')
+        now = datetime.datetime.now()
+        machine.report_status(1, 0.5, 10000, ['a', 'b'], now)
+        # Changes are only stored after the interval
+        with self.assertNumQueries(0):
+            machine.report_status(0, 0.5, 10000, ['a', 'b'], now + datetime.timedelta(seconds=1))
+        self.assertEqual(1, TestMachine.objects.get(pk=machine.pk).status['free_slots'])
+        machine.report_status(0, 0.5, 10000, ['a', 'b'], now + datetime.timedelta(seconds=11))
+        self.assertEqual(0, TestMachine.objects.get(pk=machine.pk).status['free_slots'])
+        # Validators are reported in usage order, this is no change
+        with self.assertNumQueries(0):
+            machine.report_status(0, 0.5, 10000, ['b', 'a'], now + datetime.timedelta(seconds=30))
+
+    def test_abstract_scheduler(self):
+        with self.assertRaises(TypeError):
+            Scheduler()
+
+    @override_settings(JOB_STATUS_INTERVAL=0)
+    def test_dispatch(self):
+        subs = self._create_job_queue()
+        machine = TestMachine.objects.create(host='busy')
+        idle_machine = TestMachine.objects.create(host='idle')
+        for sub in subs.values():
+            sub.assignment.test_machines.add(machine, idle_machine)
+        # Different validator for the second assignment
+        with open(settings.MEDIA_ROOT + 'other_validator.zip', 'wb') as f:
+            f.write(b'other')
+        subs['b1'].assignment.attachment_test_validity = 'other_validator.zip'
+        subs['b1'].assignment.save()
+        queue = FifoScheduler().order(Submission.pending_tests.all())
+        # Without status report, the scheduler decides
+        self.assertEqual([subs['a1']], dispatch(machine, queue, 1))
+        # Jobs with a cached validator first
+        machine.report_status(1, 0.5, 10000, [subs['b1'].assignment.validity_test_hash()])
+        self.assertEqual([subs['b1'], subs['b2'], subs['a1']], dispatch(machine, queue, 3))
+        # The status is shared through the database, unchanged reports are not written
+        self.assertEqual(machine.status, TestMachine.objects.get(pk=machine.pk).status)
+        with self.assertNumQueries(0):
+            machine.report_status(1, 0.52, 10000, [subs['b1'].assignment.validity_test_hash()])
+        # No jobs when the disk is full
+        machine.report_status(1, 0.5, 10, [])
+        self.assertEqual([], dispatch(machine, queue, 1))
+        # New jobs are held back for idle machines
+        validity_subs = [subs[name].pk for name in ['a1', 'a2', 'b1', 'b2']]
+        Submission.objects.filter(pk__in=validity_subs).update(modified=datetime.datetime.now())
+        machine.report_status(1, 2.0, 10000, [])
+        idle_machine.report_status(2, 0.1, 10000, [])
+        self.assertEqual([subs['full']], dispatch(machine, queue, 1))
+        idle_machine.report_status(0, 1.5, 10000, [])
+        self.assertIn(dispatch(machine, queue, 1)[0].pk, validity_subs)
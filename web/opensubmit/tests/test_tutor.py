@@ -74,6 +74,17 @@ class Tutor(SubmitTutorTestCase):
         # expect withdrawn submissions to be left out
         self.assertNotIn('#%u' % sub3.pk, str(response))
 
+    def test_perf_data_download(self):
+        sub = create_validated_submission(self.user, self.assignment)
+        response = self.c.get('/assignments/%u/perfdata/' %
+                              self.assignment.pk)
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode('utf-8').splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[1].startswith('%u;' % sub.pk))
+        self.assertIn(';Validation test;', lines[1])
+        self.assertTrue(lines[1].endswith(';41;42;43'))
+
     def test_preview_view(self):
         sub1 = create_validated_submission(self.user, self.assignment)
         response = self.c.get('/preview/%u/' % sub1.pk)
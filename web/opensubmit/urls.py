@@ -35,6 +35,7 @@ urlpatterns = [
     url(r'^preview/(?P<pk>\d+)/$', backend.PreviewView.as_view(), name='preview'),
     url(r'^assignments/(?P<pk>\d+)/duplicates/$', backend.DuplicatesView.as_view(), name='duplicates'),
     url(r'^assignments/(?P<pk>\d+)/archive/$', backend.AssignmentArchiveView.as_view(), name='assarchive'),
+    url(r'^assignments/(?P<pk>\d+)/perfdata/$', backend.AssignmentPerfDataView.as_view(), name='assperfdata'),
     url(r'^course/(?P<pk>\d+)/archive/$', backend.CourseArchiveView.as_view(), name='coursearchive'),
     url(r'^course/(?P<pk>\d+)/gradingtable/$', backend.GradingTableView.as_view(), name='gradingtable'),
     url(r'^mergeusers/(?P<primary_pk>\d+)/(?P<secondary_pk>\d+)/$', backend.MergeUsersView.as_view(), name='mergeusers'),
@@ -43,8 +44,14 @@ urlpatterns = [
     # Executor URLs
     url(r'^download/(?P<pk>\d+)/validity_testscript/secret=(?P<secret>\w+)$', api.ValidityScriptView.as_view()),
     url(r'^download/(?P<pk>\d+)/full_testscript/secret=(?P<secret>\w+)$', api.FullScriptView.as_view()),
+    url(r'^download/(?P<pk>\d+)/submission_file/secret=(?P<secret>\w+)$', api.SubmissionFileView.as_view()),
     url(r'^jobs/$', api.jobs, name='jobs'),
+    url(r'^jobs/lease/$', api.lease_jobs, name='lease_jobs'),
     url(r'^machines/$', api.MachinesView.as_view(), name='machines'),
+    url(r'^api/v2/$', api.info_v2, name='api_v2'),
+    url(r'^api/v2/register/$', api.register_v2, name='api_v2_register'),
+    url(r'^api/v2/lease/$', api.lease_v2, name='api_v2_lease'),
+    url(r'^api/v2/results/$', api.results_v2, name='api_v2_results'),
     # Error pages
     url(r'^403/$', TemplateView.as_view(template_name='403.html')),
     url(r'^404/$', TemplateView.as_view(template_name='404.html')),
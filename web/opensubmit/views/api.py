@@ -6,20 +6,26 @@
 '''
 
 from datetime import datetime, timedelta
+import functools
+import json
 import os
+import time
 
 from django.core.exceptions import PermissionDenied
 from django.core.mail import mail_managers
-from django.http import Http404, HttpResponse
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import DetailView, View
 from django.utils.decorators import method_decorator
 
 from opensubmit import settings
-from opensubmit.models import Assignment, Submission, TestMachine, SubmissionFile
+from opensubmit.models import Assignment, Submission, TestMachine, SubmissionFile, SubmissionTestResult
 from opensubmit.mails import inform_student
-from opensubmit.views.helpers import BinaryDownloadMixin
+from opensubmit.jobwait import wait_for_new_job
+from opensubmit.reaper import reap_expired_jobs_if_due
+from opensubmit.scheduling import get_scheduler, dispatch
+from opensubmit.views.helpers import BinaryDownloadMixin, file_download_response
 
 import logging
 logger = logging.getLogger('OpenSubmit')
@@ -40,6 +46,7 @@ class ValidityScriptView(BinaryDownloadMixin, DetailView):
                 raise PermissionDenied
         self.f = ass.attachment_test_validity
         self.fname = self.f.name[self.f.name.rfind('/') + 1:]
+        self.etag = ass.validity_test_hash()
         return ass
 
 
@@ -55,9 +62,25 @@ class FullScriptView(BinaryDownloadMixin, DetailView):
             raise PermissionDenied
         self.f = ass.attachment_test_full
         self.fname = self.f.name[self.f.name.rfind('/') + 1:]
+        self.etag = ass.full_test_hash()
         return ass
 
 
+class SubmissionFileView(BinaryDownloadMixin, DetailView):
+    '''
+    Download of a student submission file, for executors that leased the job.
+    '''
+    model = SubmissionFile
+
+    def get_object(self, queryset=None):
+        subfile = super().get_object(queryset)
+        if self.kwargs['secret'] != settings.JOB_EXECUTOR_SECRET:
+            raise PermissionDenied
+        self.f = subfile.attachment
+        self.fname = subfile.basename()
+        return subfile
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class MachinesView(View):
     '''
@@ -77,12 +100,436 @@ class MachinesView(View):
         if self.request.POST['Secret'] != settings.JOB_EXECUTOR_SECRET:
             raise PermissionDenied
         machine, created = TestMachine.objects.get_or_create(host=request.POST['UUID'])
-        machine.last_contact = datetime.now()
         machine.config = request.POST['Config']
-        machine.save()
+        machine.save(update_fields=['config'])
+        machine.heartbeat()
         return HttpResponse(status=201)
 
 
+# Upper limit for the number of jobs leased in one request
+MAX_LEASED_JOBS = 20
+
+# Error code of executor results for timeouts, resource limits and internal
+# problems, which may be transient and are therefore never reused
+UNSPECIFIC_ERROR = -9999
+
+# Upper limit in seconds for waiting on new jobs in one request (long polling)
+MAX_JOB_WAIT = 30
+
+# Interval in seconds for checking the database while waiting on new jobs
+JOB_WAIT_CHECK_INTERVAL = 0.5
+
+
+def _executor_machine(params, create=True):
+    '''
+    Check the shared secret in the executor request parameters
+    and update the last_contact information for the according test machine.
+
+    Returns the machine and a flag indicating if it was unknown before.
+    Without 'create', unknown machines are not stored and returned as None.
+    '''
+    try:
+        secret = params['Secret']
+        uuid = params['UUID']
+    except Exception as e:
+        logger.error(
+            "Error finding the neccessary data in the executor request: " + str(e))
+        raise PermissionDenied
+
+    if secret != settings.JOB_EXECUTOR_SECRET:
+        raise PermissionDenied
+
+    now = datetime.now()
+    if create:
+        machine, created = TestMachine.objects.get_or_create(
+            host=uuid, defaults={'last_contact': now})
+    else:
+        machine = TestMachine.objects.filter(host=uuid).first()
+        if not machine:
+            return None, True
+        created = False
+    machine.heartbeat(now)
+    return machine, created
+
+
+def _report_status(machine, status):
+    '''
+    Remember the status the executor sent with its job request, if any.
+    '''
+    if not status:
+        return
+    try:
+        machine.report_status(status['free_slots'], status['load'],
+                              status['free_disk'], status.get('validators', []))
+    except (KeyError, ValueError, TypeError) as e:
+        logger.error("Invalid executor status from test machine %s: %s" % (machine, str(e)))
+
+
+def _status_params(params):
+    '''
+    Executor status from the parameters of a 1.x job request.
+    '''
+    if 'FreeSlots' not in params:
+        return None
+    return {'free_slots': params.get('FreeSlots'),
+            'load': params.get('Load'),
+            'free_disk': params.get('FreeDisk'),
+            'validators': [entry for entry in params.get('Validators', '').split(',') if entry]}
+
+
+def _fetchable_submissions(machine):
+    '''
+    Submissions with pending tests this machine is responsible for,
+    and which are not fetched by some executor at the moment.
+    '''
+    submissions = Submission.pending_tests.filter(assignment__in=machine.assignments.all()) \
+                                          .filter(file_upload__isnull=False) \
+                                          .filter(file_upload__fetched__isnull=True)
+    return get_scheduler().order(submissions)
+
+
+def _job_wait(params):
+    '''
+    Determine the number of seconds the executor is willing to wait for new jobs.
+    '''
+    try:
+        return max(0, min(float(params.get('Wait', 0)), MAX_JOB_WAIT))
+    except ValueError:
+        return 0
+
+
+def _no_jobs_response():
+    '''
+    Response for job requests when no work is available.
+    '''
+    response = HttpResponse(status=404)
+    response['APIVersion'] = '1.1.0'  # semantic versioning
+    response['MaxWait'] = MAX_JOB_WAIT
+    return response
+
+
+def _lease(sub, machine):
+    '''
+    Mark the submission as fetched by the executor on the given machine.
+
+    Returns the fetch time, or None if another executor was faster.
+    '''
+    fetched = sub.save_fetch_date(machine)
+    if fetched is None:
+        return None
+    Submission.objects.filter(pk=sub.pk).update(modified=datetime.now())
+    return fetched
+
+
+def _lease_deadline(sub, fetched):
+    '''
+    The time when the lease of a job expires.
+    '''
+    return fetched + timedelta(seconds=sub.assignment.attachment_test_timeout)
+
+
+def _claim_submissions(machine, count, wait=0):
+    '''
+    Lease up to 'count' fetchable submissions for this machine.
+    If there are none, wait up to 'wait' seconds for new ones.
+
+    The choice among the fetchable submissions depends on the
+    status reported by the executor, see scheduling.dispatch().
+
+    Parallel requests never get the same submission, since the
+    leasing is an atomic conditional update. Submissions taken by
+    someone else in the meantime are replaced by the next candidates.
+    The same happens for submissions where an earlier test result
+    could be reused.
+
+    Returns a list of (submission, fetch time) tuples.
+    '''
+    deadline = time.time() + wait
+    claimed = []
+    while True:
+        candidates = _fetchable_submissions(machine).select_related('assignment', 'file_upload')
+        candidates = dispatch(machine, candidates, count - len(claimed))
+        for sub in candidates:
+            fetched = _lease(sub, machine)
+            if fetched and not _reuse_test_result(sub):
+                claimed.append((sub, fetched))
+        if len(claimed) >= count:
+            return claimed
+        if candidates:
+            # Lost some of them to parallel requests or result reuse, try the next ones
+            continue
+        remaining = deadline - time.time()
+        if claimed or remaining <= 0:
+            return claimed
+        wait_for_new_job(min(remaining, JOB_WAIT_CHECK_INTERVAL))
+
+
+def _has_attachment(sub):
+    '''
+    Check if the submission file is really available on the storage.
+    '''
+    f = sub.file_upload.attachment
+    # on dev server, we sometimes have stale database entries
+    if not os.access(f.path, os.F_OK):
+        mail_managers('Warning: Missing file',
+                      'Missing file on storage for submission file entry %u: %s' % (
+                          sub.file_upload.pk, str(sub.file_upload.attachment)), fail_silently=True)
+        return False
+    return True
+
+
+def _job_action(sub):
+    '''
+    Determine the test action for a submission with pending tests.
+
+    Returns the action, and the download URL and content hash of the according validator.
+    '''
+    if sub.state == Submission.TEST_VALIDITY_PENDING:
+        return 'test_validity', sub.assignment.validity_test_url(), sub.assignment.validity_test_hash()
+    elif sub.state == Submission.TEST_FULL_PENDING or sub.state == Submission.CLOSED_TEST_FULL_PENDING:
+        return 'test_full', sub.assignment.full_test_url(), sub.assignment.full_test_hash()
+    else:
+        assert (False)
+
+
+def _reuse_test_result(sub):
+    '''
+    Look for an earlier result of the same validator on identical submission content,
+    and store it for the (already leased) submission instead of running the job again.
+
+    Only results of submissions with a common author are considered, since the
+    validator output may contain personal information. Results without validator hash,
+    such as timeouts or results invalidated by an admin, are never reused. The same holds
+    for results with UNSPECIFIC_ERROR, which the executor also reports for its own problems.
+
+    Returns True if an earlier result was reused.
+    '''
+    action, validator_url, validator_hash = _job_action(sub)
+    if not validator_hash:
+        return False
+    submission_file = sub.file_upload
+    if not submission_file.sha1:
+        # Uploaded before checksums were stored
+        if not os.access(submission_file.attachment.path, os.F_OK):
+            return False
+        submission_file.sha1 = submission_file.attachment_sha1()
+        if not submission_file.sha1:
+            return False
+        SubmissionFile.objects.filter(pk=submission_file.pk).update(sha1=submission_file.sha1)
+    kind = SubmissionTestResult.VALIDITY_TEST if action == 'test_validity' else SubmissionTestResult.FULL_TEST
+    earlier = SubmissionTestResult.objects.filter(
+        kind=kind,
+        validator_hash=validator_hash,
+        error_code__isnull=False,
+        submission_file__sha1=submission_file.sha1,
+        submission_file__original_filename=submission_file.original_filename,
+        submission_file__submissions__assignment=sub.assignment,
+        submission_file__submissions__authors__in=sub.authors.all()) \
+        .exclude(error_code=UNSPECIFIC_ERROR).order_by('-created').first()
+    if not earlier:
+        return False
+    logger.debug("Reusing %s result %u for submission %u" % (action, earlier.pk, sub.pk))
+    return _process_result(sub, submission_file, earlier.machine, action,
+                           earlier.error_code, earlier.result, earlier.result_tutor, earlier.perf_data,
+                           validator_hash=validator_hash, reused=True)
+
+
+def _job_description(sub):
+    '''
+    Information about the test job for a submission,
+    as dictionary of (executor-side) job attributes.
+    '''
+    job = {'file_id': sub.file_upload.pk,
+           'file_name': sub.file_upload.original_filename,
+           'sub_id': sub.pk,
+           'submitter_name': sub.submitter.get_full_name(),
+           'submitter_student_id': sub.submitter.profile.student_id,
+           'author_names': ', '.join([author.get_full_name() for author in sub.authors.all()]),
+           'submitter_studyprogram': str(sub.submitter.profile.study_program),
+           'course': str(sub.assignment.course),
+           'assignment': str(sub.assignment),
+           'timeout': sub.assignment.attachment_test_timeout}
+    job['action'], job['validator_url'], job['validator_hash'] = _job_action(sub)
+    return job
+
+
+def _result_hash(reported, current):
+    '''
+    The validator hash to be stored with a test result. When the validator
+    was replaced while the job ran, or the executor did not report the hash
+    of the validator it used, the result gets none, so that it is never reused.
+    '''
+    return reported if reported and reported == current else None
+
+
+def _process_result(sub, submission_file, machine, action, error_code, message, message_tutor, perf_data=None,
+                    validator_hash=None, reused=False):
+    '''
+    Store a test result for the submission and perform the according state transition.
+    The validator_hash is the one of the validator the job was leased with.
+
+    Returns False if the result does not fit to the submission state.
+    For reused results, the job then stays leased, so that it is run by the executor.
+    '''
+    # Job state: Waiting for validity test
+    # Possible with + without full test
+    # Possible with + without grading
+    if action == 'test_validity' and sub.state == Submission.TEST_VALIDITY_PENDING:
+        sub.save_validation_result(
+            machine, message, message_tutor, perf_data,
+            validator_hash=_result_hash(validator_hash, sub.assignment.validity_test_hash()),
+            error_code=error_code)
+        if error_code == 0:
+            # We have a full test
+            if sub.assignment.attachment_test_full:
+                logger.debug(
+                    "Validity test working, setting state to pending full test")
+                sub.state = Submission.TEST_FULL_PENDING
+            # We have no full test
+            else:
+                logger.debug(
+                    "Validity test working, setting state to tested")
+                sub.state = Submission.SUBMITTED_TESTED
+                if not sub.assignment.is_graded():
+                    # Assignment is not graded. We are done here.
+                    sub.state = Submission.CLOSED
+                    sub.inform_student(Submission.CLOSED)
+        else:
+            logger.debug(
+                "Validity test not working, setting state to failed")
+            sub.state = Submission.TEST_VALIDITY_FAILED
+        sub.inform_student(sub.state)
+    # Job state: Waiting for full test
+    # Possible with + without grading
+    elif action == 'test_full' and sub.state == Submission.TEST_FULL_PENDING:
+        sub.save_fulltest_result(
+            machine, message_tutor, perf_data,
+            validator_hash=_result_hash(validator_hash, sub.assignment.full_test_hash()),
+            error_code=error_code)
+        if error_code == 0:
+            if sub.assignment.is_graded():
+                logger.debug("Full test working, setting state to tested (since graded)")
+                sub.state = Submission.SUBMITTED_TESTED
+            else:
+                logger.debug("Full test working, setting state to closed (since not graded)")
+                sub.state = Submission.CLOSED
+                inform_student(sub, Submission.CLOSED)
+        else:
+            logger.debug("Full test not working, setting state to failed")
+            sub.state = Submission.TEST_FULL_FAILED
+            # full tests may be performed several times and are meant to be a silent activity
+            # therefore, we send no mail to the student here
+    # Job state: Waiting for full test of already closed jobs ("re-test")
+    # Grading is already done
+    elif action == 'test_full' and sub.state == Submission.CLOSED_TEST_FULL_PENDING:
+        logger.debug(
+            "Closed full test done, setting state to closed again")
+        sub.save_fulltest_result(
+            machine, message_tutor, perf_data,
+            validator_hash=_result_hash(validator_hash, sub.assignment.full_test_hash()),
+            error_code=error_code)
+        sub.state = Submission.CLOSED
+        # full tests may be performed several times and are meant to be a silent activity
+        # therefore, we send no mail to the student here
+    elif action == 'test_validity' and sub.state == Submission.TEST_VALIDITY_FAILED:
+        # Can happen if the validation is set to failed due to timeout, but the executor delivers the late result.
+        # Happens in reality only with >= 2 executors, since the second one is pulling for new jobs and triggers
+        # the timeout check while the first one is still stucked with the big job.
+        # Can be ignored.
+        logger.debug(
+            "Ignoring executor result, since the submission is already marked as failed.")
+    elif reused:
+        # Leasing and result reuse happen in a loop, so the lease is kept
+        logger.debug(
+            "Not reusing result for submission %u, since it does not fit to the state." % (sub.pk))
+        return False
+    else:
+        msg = '''
+            Dear OpenSubmit administrator,
+
+            the executors returned some result, but this does not fit to the current submission state.
+            This is a strong indication for a bug in OpenSubmit - sorry for that.
+            The system will ignore the report from executor and mark the job as to be repeated.
+            Please report this on the project GitHub page for further investigation.
+
+            Submission ID: %u
+            Submission File ID reported by the executor: %u
+            Action reported by the executor: %s
+            Current state of the submission: %s (%s)
+            Message from the executor: %s
+            Error code from the executor: %u
+            ''' % (sub.pk, submission_file.pk, action,
+                   sub.state_for_tutors(), sub.state,
+                   message, error_code)
+        mail_managers('Warning: Inconsistent job state',
+                      msg, fail_silently=True)
+    # Mark work as done
+    sub.save()
+    sub.clean_fetch_date()
+    return True
+
+
+@csrf_exempt
+def lease_jobs(request):
+    '''
+    Lease up to 'MaxJobs' test jobs for an executor in one request.
+
+    GET requests are expected to contain the following parameters:
+                'Secret',
+                'UUID',
+                'MaxJobs' (optional, default 1),
+                'Wait' (optional, see jobs()),
+                'FreeSlots', 'Load', 'FreeDisk', 'Validators' (optional, see jobs())
+
+    The response is a JSON manifest with the following elements:
+                'api_version',
+                'action' ('get_config' for unknown machines, otherwise 'run'),
+                'max_wait',
+                'jobs'
+
+    Each entry in 'jobs' contains the job information from the
+    header-based GET response of jobs(), plus the 'download_url' for the
+    submission file and the 'lease_deadline'. Jobs not reported back
+    until the deadline are considered as failed.
+
+    An empty job list means that no work is available.
+    '''
+    machine, created = _executor_machine(request.GET)
+    manifest = {'api_version': '1.1.0', 'action': 'run', 'max_wait': MAX_JOB_WAIT, 'jobs': []}
+    if created:
+        logger.debug(
+            "Test machine is unknown, creating entry and asking executor for configuration.")
+        manifest['action'] = 'get_config'
+        manifest['machine_id'] = machine.pk
+        return JsonResponse(manifest)
+
+    if not machine.enabled:
+        # Act like no jobs are given for him
+        return JsonResponse(manifest)
+
+    try:
+        max_jobs = int(request.GET.get('MaxJobs', 1))
+    except ValueError:
+        max_jobs = 0
+    if max_jobs < 1:
+        return HttpResponseBadRequest()
+    max_jobs = min(max_jobs, MAX_LEASED_JOBS)
+
+    reap_expired_jobs_if_due()
+    _report_status(machine, _status_params(request.GET))
+    for sub, fetched in _claim_submissions(machine, max_jobs, _job_wait(request.GET)):
+        if not _has_attachment(sub):
+            # Leased anyway, so that the job runs into the timeout
+            continue
+        job = _job_description(sub)
+        job['download_url'] = sub.file_upload.executor_url()
+        job['lease_deadline'] = _lease_deadline(sub, fetched).isoformat()
+        logger.debug("Leasing submission %u as new %s job" %
+                     (sub.pk, job['action']))
+        manifest['jobs'].append(job)
+    return JsonResponse(manifest)
+
+
 @csrf_exempt
 def jobs(request):
     ''' This is the view used by the executor.py scripts for getting / putting the test results.
@@ -102,122 +549,89 @@ def jobs(request):
         All other POST requests are expected to contain the following parameters:
                     'SubmissionFileId',
                     'Message',
+                    'MessageTutor',
                     'ErrorCode',
                     'Action',
                     'Secret',
-                    'UUID'
+                    'UUID',
+                    'PerfData' (optional, lines of semicolon-separated benchmark results),
+                    'ValidatorHash' (optional, hash of the validator used for the job)
 
         GET requests are expected to contain the following parameters:
                     'Secret',
-                    'UUID'
+                    'UUID',
+                    'Wait' (optional),
+                    'FreeSlots', 'Load', 'FreeDisk', 'Validators' (optional)
 
         GET reponses deliver the following elements in the header:
                     'SubmissionFileId',
                     'Timeout',
                     'Action',
-                    'PostRunValidation'
+                    'PostRunValidation',
+                    'PostRunValidationHash'
+
+        If no work is available, the response has status code 404.
+        It contains the 'MaxWait' header, which announces the support for long polling:
+        When the GET request has a 'Wait' parameter, the server waits up to this number of
+        seconds (but not more than 'MaxWait') for new work before it answers.
+
+        The optional status parameters describe the current capacity of the executor:
+        the number of free job slots, the load average per CPU, the free disk space in MB,
+        and the comma-separated content hashes of the cached validators. They influence
+        which jobs the executor gets, see scheduling.dispatch().
     '''
-    try:
-        if request.method == 'GET':
-            secret = request.GET['Secret']
-            uuid = request.GET['UUID']
-        elif request.method == 'POST':
-            secret = request.POST['Secret']
-            uuid = request.POST['UUID']
-    except Exception as e:
-        logger.error(
-            "Error finding the neccessary data in the executor request: " + str(e))
-        raise PermissionDenied
-
-    if secret != settings.JOB_EXECUTOR_SECRET:
+    if request.method == 'GET':
+        machine, created = _executor_machine(request.GET)
+    elif request.method == 'POST':
+        machine, created = _executor_machine(request.POST)
+    else:
         raise PermissionDenied
 
-    # Update last_contact information for test machine
-    machine, created = TestMachine.objects.update_or_create(
-        host=uuid, defaults={'last_contact': datetime.now()})
     if created:
         # ask for configuration of new execution hosts by returning the according action
         logger.debug(
             "Test machine is unknown, creating entry and asking executor for configuration.")
         response = HttpResponse()
         response['Action'] = 'get_config'
-        response['APIVersion'] = '1.0.0'  # semantic versioning
+        response['APIVersion'] = '1.1.0'  # semantic versioning
         response['MachineId'] = machine.pk
         return response
 
     if not machine.enabled:
         # Act like no jobs are given for him
-        raise Http404
+        return _no_jobs_response()
 
     if request.method == "GET":
-        # Clean up submissions where the answer from the executors took too long
-        pending_submissions = Submission.pending_tests.filter(
-            file_upload__fetched__isnull=False)
-        #logger.debug("%u pending submission(s)"%(len(pending_submissions)))
-        for sub in pending_submissions:
-            max_delay = timedelta(
-                seconds=sub.assignment.attachment_test_timeout)
-            # There is a small chance that meanwhile the result was delivered, so fetched became NULL
-            if sub.file_upload.fetched and sub.file_upload.fetched + max_delay < datetime.now():
-                logger.debug(
-                    "Resetting executor fetch status for submission %u, due to timeout" % sub.pk)
-                # TODO:  Late delivery for such a submission by the executor may lead to result overwriting. Check this.
-                sub.clean_fetch_date()
-                if sub.state == Submission.TEST_VALIDITY_PENDING:
-                    sub.save_validation_result(
-                        machine, "Killed due to non-reaction. Please check your application for deadlocks or keyboard input.", "Killed due to non-reaction on timeout signals.")
-                    sub.state = Submission.TEST_VALIDITY_FAILED
-                    sub.inform_student(sub.state)
-                if sub.state == Submission.TEST_FULL_PENDING:
-                    sub.save_fulltest_result(
-                        machine, "Killed due to non-reaction on timeout signals. Student not informed, since this was the full test.")
-                    sub.state = Submission.TEST_FULL_FAILED
-                sub.save()
+        reap_expired_jobs_if_due()
+        _report_status(machine, _status_params(request.GET))
 
         # Now get an appropriate submission.
-        submissions = Submission.pending_tests
-        submissions = submissions.filter(assignment__in=machine.assignments.all()) \
-                                 .filter(file_upload__isnull=False) \
-                                 .filter(file_upload__fetched__isnull=True)
-        if len(submissions) == 0:
+        claimed = _claim_submissions(machine, 1, _job_wait(request.GET))
+        if not claimed:
             # Nothing found to be fetchable
-            #logger.debug("No pending work for executors")
-            raise Http404
-        else:
-            sub = submissions[0]
-        sub.save_fetch_date()
-        sub.modified = datetime.now()
-        sub.save()
+            return _no_jobs_response()
+        sub, fetched = claimed[0]
 
         # create HTTP response with file download
-        f = sub.file_upload.attachment
-        # on dev server, we sometimes have stale database entries
-        if not os.access(f.path, os.F_OK):
-            mail_managers('Warning: Missing file',
-                          'Missing file on storage for submission file entry %u: %s' % (
-                              sub.file_upload.pk, str(sub.file_upload.attachment)), fail_silently=True)
+        if not _has_attachment(sub):
             raise Http404
-        response = HttpResponse(f, content_type='application/binary')
-        response['APIVersion'] = '1.0.0'  # semantic versioning
-        response['Content-Disposition'] = 'attachment; filename="%s"' % sub.file_upload.basename()
-        response['SubmissionFileId'] = str(sub.file_upload.pk)
-        response['SubmissionOriginalFilename'] = sub.file_upload.original_filename
-        response['SubmissionId'] = str(sub.pk)
-        response['SubmitterName'] = sub.submitter.get_full_name()
-        response['SubmitterStudentId'] = sub.submitter.profile.student_id
-        response['AuthorNames'] = sub.authors.all()
-        response['SubmitterStudyProgram'] = str(sub.submitter.profile.study_program)
-        response['Course'] = str(sub.assignment.course)
-        response['Assignment'] = str(sub.assignment)
-        response['Timeout'] = sub.assignment.attachment_test_timeout
-        if sub.state == Submission.TEST_VALIDITY_PENDING:
-            response['Action'] = 'test_validity'
-            response['PostRunValidation'] = sub.assignment.validity_test_url()
-        elif sub.state == Submission.TEST_FULL_PENDING or sub.state == Submission.CLOSED_TEST_FULL_PENDING:
-            response['Action'] = 'test_full'
-            response['PostRunValidation'] = sub.assignment.full_test_url()
-        else:
-            assert (False)
+        job = _job_description(sub)
+        response = file_download_response(sub.file_upload.attachment, sub.file_upload.basename())
+        response['APIVersion'] = '1.1.0'  # semantic versioning
+        response['MaxWait'] = MAX_JOB_WAIT
+        response['SubmissionFileId'] = str(job['file_id'])
+        response['SubmissionOriginalFilename'] = job['file_name']
+        response['SubmissionId'] = str(job['sub_id'])
+        response['SubmitterName'] = job['submitter_name']
+        response['SubmitterStudentId'] = job['submitter_student_id']
+        response['AuthorNames'] = job['author_names']
+        response['SubmitterStudyProgram'] = job['submitter_studyprogram']
+        response['Course'] = job['course']
+        response['Assignment'] = job['assignment']
+        response['Timeout'] = job['timeout']
+        response['Action'] = job['action']
+        response['PostRunValidation'] = job['validator_url']
+        response['PostRunValidationHash'] = job['validator_hash']
         logger.debug("Delivering submission %u as new %s job" %
                      (sub.pk, response['Action']))
         return response
@@ -235,91 +649,249 @@ def jobs(request):
         sid = request.POST['SubmissionFileId']
         submission_file = get_object_or_404(SubmissionFile, pk=sid)
         sub = submission_file.submissions.all()[0]
-        logger.debug("Storing executor results for submission %u" % (sub.pk))
-        error_code = int(request.POST['ErrorCode'])
-        # Job state: Waiting for validity test
-        # Possible with + without full test
-        # Possible with + without grading
-        if request.POST['Action'] == 'test_validity' and sub.state == Submission.TEST_VALIDITY_PENDING:
-            sub.save_validation_result(
-                machine, request.POST['Message'], request.POST['MessageTutor'])
-            if error_code == 0:
-                # We have a full test
-                if sub.assignment.attachment_test_full:
-                    logger.debug(
-                        "Validity test working, setting state to pending full test")
-                    sub.state = Submission.TEST_FULL_PENDING
-                # We have no full test
-                else:
-                    logger.debug(
-                        "Validity test working, setting state to tested")
-                    sub.state = Submission.SUBMITTED_TESTED
-                    if not sub.assignment.is_graded():
-                        # Assignment is not graded. We are done here.
-                        sub.state = Submission.CLOSED
-                        sub.inform_student(Submission.CLOSED)
-            else:
-                logger.debug(
-                    "Validity test not working, setting state to failed")
-                sub.state = Submission.TEST_VALIDITY_FAILED
-            sub.inform_student(sub.state)
-        # Job state: Waiting for full test
-        # Possible with + without grading
-        elif request.POST['Action'] == 'test_full' and sub.state == Submission.TEST_FULL_PENDING:
-            sub.save_fulltest_result(
-                machine, request.POST['MessageTutor'])
-            if error_code == 0:
-                if sub.assignment.is_graded():
-                    logger.debug("Full test working, setting state to tested (since graded)")
-                    sub.state = Submission.SUBMITTED_TESTED
-                else:
-                    logger.debug("Full test working, setting state to closed (since not graded)")
-                    sub.state = Submission.CLOSED
-                    inform_student(sub, Submission.CLOSED)
-            else:
-                logger.debug("Full test not working, setting state to failed")
-                sub.state = Submission.TEST_FULL_FAILED
-                # full tests may be performed several times and are meant to be a silent activity
-                # therefore, we send no mail to the student here
-        # Job state: Waiting for full test of already closed jobs ("re-test")
-        # Grading is already done
-        elif request.POST['Action'] == 'test_full' and sub.state == Submission.CLOSED_TEST_FULL_PENDING:
-            logger.debug(
-                "Closed full test done, setting state to closed again")
-            sub.save_fulltest_result(
-                machine, request.POST['MessageTutor'])
-            sub.state = Submission.CLOSED
-            # full tests may be performed several times and are meant to be a silent activity
-            # therefore, we send no mail to the student here
-        elif request.POST['Action'] == 'test_validity' and sub.state == Submission.TEST_VALIDITY_FAILED:
-            # Can happen if the validation is set to failed due to timeout, but the executor delivers the late result.
-            # Happens in reality only with >= 2 executors, since the second one is pulling for new jobs and triggers
-            # the timeout check while the first one is still stucked with the big job.
-            # Can be ignored.
+        if submission_file.fetched_by_id not in [None, machine.pk]:
+            # Late delivery for a job that timed out and is now fetched by another executor.
             logger.debug(
-                "Ignoring executor result, since the submission is already marked as failed.")
-        else:
-            msg = '''
-                Dear OpenSubmit administrator,
-
-                the executors returned some result, but this does not fit to the current submission state.
-                This is a strong indication for a bug in OpenSubmit - sorry for that.
-                The system will ignore the report from executor and mark the job as to be repeated.
-                Please report this on the project GitHub page for further investigation.
-
-                Submission ID: %u
-                Submission File ID reported by the executor: %u
-                Action reported by the executor: %s
-                Current state of the submission: %s (%s)
-                Message from the executor: %s
-                Error code from the executor: %u
-                ''' % (sub.pk, submission_file.pk, request.POST['Action'],
-                       sub.state_for_tutors(), sub.state,
-                       request.POST['Message'], error_code)
-            mail_managers('Warning: Inconsistent job state',
-                          msg, fail_silently=True)
-        # Mark work as done
-        sub.save()
-        sub.clean_fetch_date()
+                "Ignoring executor result for submission %u, since the job is fetched by another machine." % (sub.pk))
+            return HttpResponse(status=201)
+        logger.debug("Storing executor results for submission %u" % (sub.pk))
+        _process_result(sub, submission_file, machine, request.POST['Action'], int(request.POST['ErrorCode']),
+                        request.POST['Message'], request.POST.get('MessageTutor'),
+                        request.POST.get('PerfData') or None, request.POST.get('ValidatorHash'))
         return HttpResponse(status=201)
 
+
+# Version of the JSON-based executor API, served next to the header-based 1.x protocol
+API_V2_VERSION = '2.0.0'
+
+# Protocol features offered by this server in the v2 API
+API_V2_CAPABILITIES = ['lease_ids', 'bulk_results', 'perf_data', 'long_poll', 'validator_hash', 'result_reuse', 'status']
+
+# Upper limit for the number of results in one v2 request
+MAX_BULK_RESULTS = 100
+
+
+class ApiError(Exception):
+    '''
+    A problem with a v2 API request, reported to the executor
+    as compact error code with a human-readable message.
+    '''
+    def __init__(self, code, message, status=400):
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def _v2_response(data, status=200):
+    data['api_version'] = API_V2_VERSION
+    return JsonResponse(data, status=status)
+
+
+def api_v2(registration=False):
+    '''
+    Decorator for v2 API views, which receive the parsed JSON body
+    and the executor machine, and return a dictionary.
+
+    Unknown machines get an 'unknown_machine' error in views other
+    than the registration, so that they send their configuration first.
+    '''
+    def decorator(view):
+        @csrf_exempt
+        @functools.wraps(view)
+        def wrapper(request):
+            return _api_v2_call(view, registration, request)
+        return wrapper
+    return decorator
+
+
+def _api_v2_call(view, registration, request):
+    try:
+        if request.method != 'POST':
+            raise ApiError('bad_method', 'Only POST requests are supported.', 405)
+        try:
+            data = json.loads(request.body.decode('utf-8'))
+            params = {'Secret': data['secret'], 'UUID': data['uuid']}
+        except (ValueError, TypeError, KeyError):
+            raise ApiError('bad_request', 'Expected a JSON object with secret and uuid.')
+        try:
+            machine, created = _executor_machine(params, create=registration)
+        except PermissionDenied:
+            raise ApiError('forbidden', 'Wrong executor secret.', 403)
+        if created and not registration:
+            raise ApiError('unknown_machine', 'Please register this machine first.', 409)
+        return _v2_response(view(data, machine))
+    except ApiError as e:
+        return _v2_response({'error': e.code, 'message': e.message}, e.status)
+
+
+def _lease_id(sub, action, fetched):
+    '''
+    Explicit identification of a job lease, which is
+    only valid as long as the job is fetched with this time stamp.
+    The time stamp has second resolution, since not all
+    databases store fractions of seconds.
+    '''
+    return '%u.%s.%s' % (sub.file_upload_id, action, fetched.strftime('%Y%m%d%H%M%S'))
+
+
+def _parse_lease_id(lease_id):
+    '''
+    Returns the submission file ID, the action and the time stamp
+    of a lease ID, or raises ValueError.
+    '''
+    file_id, action, stamp = str(lease_id).split('.')
+    if action not in ['test_validity', 'test_full']:
+        raise ValueError(action)
+    return int(file_id), action, stamp
+
+
+@csrf_exempt
+def info_v2(request):
+    '''
+    Capability announcement of the v2 executor API.
+
+    GET requests need no parameters. The response is a JSON object with the
+    following elements:
+                'api_version',
+                'capabilities',
+                'max_jobs',
+                'max_wait',
+                'max_results'
+    '''
+    return _v2_response({'capabilities': API_V2_CAPABILITIES,
+                         'max_jobs': MAX_LEASED_JOBS,
+                         'max_wait': MAX_JOB_WAIT,
+                         'max_results': MAX_BULK_RESULTS})
+
+
+@api_v2(registration=True)
+def register_v2(data, machine):
+    '''
+    Registration of an executor machine in the v2 API.
+
+    POST requests are expected to contain a JSON object with the following elements:
+                'secret',
+                'uuid',
+                'config' (host information, as list of name / value pairs),
+                'capabilities' (optional, protocol features supported by the executor)
+
+    The response contains the 'machine_id' and the 'capabilities'
+    supported by both sides.
+    '''
+    if 'config' not in data:
+        raise ApiError('bad_request', 'Missing host information.')
+    machine.config = json.dumps(data['config'])
+    machine.save()
+    return {'machine_id': machine.pk,
+            'capabilities': [entry for entry in data.get('capabilities', API_V2_CAPABILITIES)
+                             if entry in API_V2_CAPABILITIES]}
+
+
+@api_v2()
+def lease_v2(data, machine):
+    '''
+    Lease test jobs in the v2 API.
+
+    POST requests are expected to contain a JSON object with the following elements:
+                'secret',
+                'uuid',
+                'max_jobs' (optional, default 1),
+                'wait' (optional, seconds to wait for new work, see jobs()),
+                'status' (optional, object with 'free_slots', 'load', 'free_disk'
+                          and 'validators', see jobs())
+
+    The response contains the list of leased 'jobs'. Each entry has the
+    job information from lease_jobs(), plus the 'lease_id' to be used
+    when reporting the result.
+    '''
+    response = {'max_wait': MAX_JOB_WAIT, 'jobs': []}
+    if not machine.enabled:
+        # Act like no jobs are given for him
+        return response
+    try:
+        max_jobs = int(data.get('max_jobs', 1))
+    except (ValueError, TypeError):
+        max_jobs = 0
+    if max_jobs < 1:
+        raise ApiError('bad_request', 'Invalid number of jobs.')
+    max_jobs = min(max_jobs, MAX_LEASED_JOBS)
+
+    reap_expired_jobs_if_due()
+    _report_status(machine, data.get('status'))
+    for sub, fetched in _claim_submissions(machine, max_jobs, _job_wait({'Wait': data.get('wait', 0)})):
+        if not _has_attachment(sub):
+            # Leased anyway, so that the job runs into the timeout
+            continue
+        job = _job_description(sub)
+        job['download_url'] = sub.file_upload.executor_url()
+        job['lease_deadline'] = _lease_deadline(sub, fetched).isoformat()
+        job['lease_id'] = _lease_id(sub, job['action'], fetched)
+        logger.debug("Leasing submission %u as new %s job with lease %s" %
+                     (sub.pk, job['action'], job['lease_id']))
+        response['jobs'].append(job)
+    return response
+
+
+def _store_result_v2(machine, result):
+    '''
+    Store one entry of a v2 result report.
+    Returns the status code for this entry.
+    '''
+    try:
+        file_id, action, stamp = _parse_lease_id(result['lease_id'])
+        error_code = int(result['error_code'])
+    except (KeyError, ValueError, TypeError):
+        return 'bad_request'
+    submission_file = SubmissionFile.objects.filter(pk=file_id).first()
+    sub = submission_file.submissions.first() if submission_file else None
+    if not sub:
+        return 'unknown_lease'
+    if not submission_file.fetched or \
+       submission_file.fetched_by_id not in [None, machine.pk] or \
+       submission_file.fetched.strftime('%Y%m%d%H%M%S') != stamp:
+        # Late delivery for a job that timed out, and was reaped or fetched again.
+        logger.debug(
+            "Ignoring executor result for submission %u, since the lease %s expired." % (sub.pk, result['lease_id']))
+        return 'expired'
+    logger.debug("Storing executor results for submission %u" % (sub.pk))
+    _process_result(sub, submission_file, machine, action, error_code,
+                    result.get('message', ''), result.get('message_tutor'),
+                    result.get('perf_data') or None, result.get('validator_hash'))
+    return 'stored'
+
+
+@api_v2()
+def results_v2(data, machine):
+    '''
+    Report the results of one or more jobs in the v2 API.
+
+    POST requests are expected to contain a JSON object with the following elements:
+                'secret',
+                'uuid',
+                'results'
+
+    Each entry in 'results' has the following elements:
+                'lease_id',
+                'error_code',
+                'message',
+                'message_tutor',
+                'perf_data' (optional, lines of semicolon-separated benchmark results),
+                'validator_hash' (optional, hash of the validator used for the job)
+
+    The response contains a status for each result, in the same order:
+                'stored',
+                'expired' (the lease timed out or was already finished, the result was ignored),
+                'unknown_lease',
+                'bad_request'
+    '''
+    results = data.get('results')
+    if not isinstance(results, list) or len(results) > MAX_BULK_RESULTS:
+        raise ApiError('bad_request', 'Expected a list of up to %u results.' % MAX_BULK_RESULTS)
+    statuses = []
+    for result in results:
+        if not isinstance(result, dict):
+            statuses.append({'lease_id': None, 'status': 'bad_request'})
+            continue
+        statuses.append({'lease_id': result.get('lease_id'),
+                         'status': _store_result_v2(machine, result)})
+    return {'results': statuses}
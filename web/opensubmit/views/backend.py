@@ -14,7 +14,7 @@ from formtools.preview import FormPreview
 
 from opensubmit.models import Submission, Assignment, Course
 from opensubmit.models.userprofile import move_user_data
-from opensubmit.views.helpers import StaffRequiredMixin, ZipDownloadDetailView
+from opensubmit.views.helpers import StaffRequiredMixin, ZipDownloadDetailView, perf_data_response
 
 
 class AssignmentArchiveView(StaffRequiredMixin, ZipDownloadDetailView):
@@ -29,6 +29,15 @@ class AssignmentArchiveView(StaffRequiredMixin, ZipDownloadDetailView):
         return assignment.directory_name()
 
 
+class AssignmentPerfDataView(StaffRequiredMixin, DetailView):
+    model = Assignment
+
+    def get(self, request, *args, **kwargs):
+        assignment = self.get_object()
+        subs = Submission.valid_ones.filter(assignment=assignment, file_upload__isnull=False).order_by('pk')
+        return perf_data_response(subs, assignment.directory_name() + '_perf_data.csv')
+
+
 class CourseArchiveView(StaffRequiredMixin, ZipDownloadDetailView):
     model = Course
 
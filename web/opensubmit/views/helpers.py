@@ -2,12 +2,14 @@
 Helper functions for the view implementations.
 '''
 
+import csv
 import io
 import zipfile
 
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.views.generic import DetailView
-from django.http import FileResponse, HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
 
 
 class StaffRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
@@ -18,16 +20,57 @@ class StaffRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
         return self.request.user.is_staff
 
 
+def file_download_response(f, fname):
+    '''
+    Streams the content of the file field f as download,
+    without reading it completely into memory.
+    '''
+    f.open('rb')
+    response = FileResponse(f, content_type='application/binary')
+    response['Content-Length'] = f.size
+    response['Content-Disposition'] = 'attachment; filename="%s"' % fname
+    return response
+
+
+def perf_data_response(submissions, fname):
+    '''
+    Delivers the performance data of the given submissions as CSV download.
+    The columns after 'Test' are the ones reported by Job.benchmark_program()
+    in the executor.
+    '''
+    response = HttpResponse(content_type='text/csv')
+    response['Content-Disposition'] = 'attachment; filename="%s"' % fname
+    writer = csv.writer(response, delimiter=';')
+    writer.writerow(['Submission ID', 'Course', 'Assignment', 'Authors', 'Test',
+                     'Program', 'Metric', 'Runs', 'Median', 'Stddev', 'Min'])
+    for sub in submissions:
+        writer.writerows(sub.perf_data_rows())
+    return response
+
+
 class BinaryDownloadMixin(object):
+    '''
+    Delivers the file in self.f as download.
+
+    If the view sets self.etag, conditional requests
+    with If-None-Match are supported.
+    '''
     f = None
     fname = None
+    etag = None
 
     def get(self, request, *args, **kwargs):
         super().get(request, *args, **kwargs)
         assert(self.f is not None)
         assert(self.fname is not None)
-        response = HttpResponse(self.f, content_type='application/binary')
-        response['Content-Disposition'] = 'attachment; filename="%s"' % self.fname
+        if self.etag:
+            if quote_etag(self.etag) in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = HttpResponseNotModified()
+                response['ETag'] = quote_etag(self.etag)
+                return response
+        response = file_download_response(self.f, self.fname)
+        if self.etag:
+            response['ETag'] = quote_etag(self.etag)
         return response
 
 